@@ -0,0 +1,233 @@
+"""Admission control for expensive endpoints.
+
+Each request is sorted into a lane by its path. Heavy lanes (PDF reports,
+exports, transcription, SOAP analysis) admit a limited number of requests at
+once; the rest wait in the lane's queue, and once that is full new requests are
+turned away straight away with 503 and a Retry-After estimate. One user can
+only hold a few places in a queue (429 beyond that), and freed slots go to
+waiting users in round-robin order, so one clinician downloading twenty
+reports doesn't starve everyone else's single one.
+
+Everything else runs in the interactive lane, which gets the threadpool's 40
+threads minus the heavy lanes' combined concurrency. That share is reserved:
+heavy lanes can never take it, so dashboard reads keep their latency however
+backed up reports get. It is also a limit: a burst of interactive requests
+queues (fairly, per user) instead of piling up behind the threadpool.
+
+Limits come from the environment, e.g. ADMISSION_REPORTS_CONCURRENCY=2,
+ADMISSION_REPORTS_QUEUE=8, ADMISSION_REPORTS_QUEUE_PER_USER=2,
+ADMISSION_REPORTS_MAX_WAIT=30. Counters are per worker process and rendered
+for Prometheus by render_metrics().
+"""
+import asyncio
+import json
+import math
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from fastapi import HTTPException
+
+import auth
+from config import settings
+
+def _env(lane: str, setting: str, default):
+    return type(default)(settings.admission.get(f"ADMISSION_{lane.upper()}_{setting}", default))
+
+class Lane:
+    """Concurrency limit plus a per-user round-robin queue for one class of requests"""
+
+    def __init__(self, name: str, pattern: Optional[str], concurrency: int = 0, max_queue: int = 0,
+                 max_queue_per_user: int = 0, max_wait: float = 0.0):
+        self.name = name
+        self.pattern = re.compile(pattern) if pattern else None
+        self.concurrency = _env(name, "CONCURRENCY", concurrency) # 0: unlimited
+        self.max_queue = _env(name, "QUEUE", max_queue)
+        self.max_queue_per_user = _env(name, "QUEUE_PER_USER", max_queue_per_user)
+        self.max_wait = _env(name, "MAX_WAIT", max_wait)
+
+        self.in_flight = 0
+        self.queued = 0
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict() # user -> waiting futures, in service order
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "user_limit": 0, "timeout": 0}
+        self.wait_seconds = 0.0
+        self.service_seconds = 0.0
+        self.average_service = 1.0 # EWMA, seeds Retry-After before anything has finished
+
+    def retry_after(self) -> int:
+        """Seconds until a place is likely to free up"""
+        if not self.concurrency:
+            return 1
+        ahead = self.queued / self.concurrency + 1
+        return min(120, max(1, math.ceil(self.average_service * ahead)))
+
+    async def acquire(self, user: str) -> Optional[str]:
+        """Wait for a slot. Returns None once admitted, or the reason the request is rejected"""
+        if not self.concurrency or (self.in_flight < self.concurrency and not self.queued):
+            self.in_flight += 1
+            return None
+        if self.queued >= self.max_queue:
+            return "queue_full"
+        queue = self._waiting.get(user)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            return "user_limit"
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user, deque()).append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait({future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if future.done():
+                self.release()
+            else:
+                self._remove(user, future)
+            raise
+        if future.done():
+            return None # release() handed us its slot
+        self._remove(user, future)
+        return "timeout"
+
+    def _remove(self, user: str, future: asyncio.Future):
+        future.cancel()
+        queue = self._waiting.get(user)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self._waiting[user]
+
+    def release(self):
+        """Pass the slot to the next waiting user in round-robin order, or free it"""
+        while self._waiting:
+            user, queue = next(iter(self._waiting.items()))
+            future = queue.popleft()
+            self.queued -= 1
+            if queue:
+                self._waiting.move_to_end(user) # This user's next request waits for everyone else's turn
+            else:
+                del self._waiting[user]
+            if not future.done():
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+
+    def record(self, waited: float, served: float):
+        self.wait_seconds += waited
+        self.service_seconds += served
+        self.average_service = 0.8 * self.average_service + 0.2 * served
+
+THREADPOOL_THREADS = 40 # anyio's default, shared by sync endpoints and run_in_threadpool
+
+# First match wins; the interactive lane takes everything else
+LANES = [
+    Lane("reports", r"^/patients/\d+/report$", concurrency=2, max_queue=8, max_queue_per_user=2, max_wait=30),
+    Lane("batch_reports", r"^/reports/batch$", concurrency=1, max_queue=2, max_queue_per_user=1, max_wait=30),
+    Lane("exports", r"^/patients/\d+/export$", concurrency=2, max_queue=4, max_queue_per_user=1, max_wait=30),
+    Lane("transcribe", r"^/transcribe$", concurrency=4, max_queue=16, max_queue_per_user=2, max_wait=60),
+    Lane("analyze", r"^/analyze-consultation$", concurrency=4, max_queue=16, max_queue_per_user=2, max_wait=60),
+]
+INTERACTIVE = Lane(
+    "interactive", None, concurrency=max(8, THREADPOOL_THREADS - sum(lane.concurrency for lane in LANES)),
+    max_queue=200, max_queue_per_user=20, max_wait=10,
+)
+
+# Long-lived streams would hold a slot for their whole life
+EXEMPT_PATHS = re.compile(r"^/patients/\d+/events$")
+
+def lane_for(path: str) -> Lane:
+    for lane in LANES:
+        if lane.pattern.match(path):
+            return lane
+    return INTERACTIVE
+
+def request_user(scope) -> str:
+    """Fair-queuing key: the token's user id, or the client address for anonymous requests"""
+    token = None
+    for name, value in scope["headers"]:
+        if name == b"authorization" and value[:7].lower() == b"bearer ":
+            token = value[7:].decode("latin-1")
+            break
+    if token:
+        try:
+            return "user:" + str(auth.decode_access_token(token).get("sub"))
+        except HTTPException:
+            pass
+    client = scope.get("client")
+    return "addr:" + (client[0] if client else "unknown")
+
+async def _reject(send, status: int, detail: str, retry_after: int):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or EXEMPT_PATHS.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        lane = lane_for(scope["path"])
+        user = request_user(scope) if lane.concurrency else ""
+        queued_at = time.perf_counter()
+        reason = await lane.acquire(user)
+        if reason is not None:
+            lane.rejected[reason] += 1
+            retry_after = lane.retry_after()
+            if reason == "user_limit":
+                await _reject(send, 429, f"Too many {lane.name} requests in progress; try again in {retry_after}s", retry_after)
+            else:
+                await _reject(send, 503, f"Server busy with {lane.name}; try again in {retry_after}s", retry_after)
+            return
+
+        lane.admitted += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
+            lane.record(started - queued_at, time.perf_counter() - started)
+
+def render_metrics() -> str:
+    """Lane gauges and counters in the Prometheus text format"""
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str, samples):
+        lines.append(f"# HELP vm_admission_{name} {help_text}")
+        lines.append(f"# TYPE vm_admission_{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"vm_admission_{name}{{{label_text}}} {value}")
+
+    lanes = LANES + [INTERACTIVE]
+    metric("concurrency_limit", "gauge", "Requests a lane runs at once (0 = unlimited)",
+           [({"lane": l.name}, l.concurrency) for l in lanes])
+    metric("queue_limit", "gauge", "Requests a lane may queue",
+           [({"lane": l.name}, l.max_queue) for l in lanes])
+    metric("in_flight", "gauge", "Requests currently running",
+           [({"lane": l.name}, l.in_flight) for l in lanes])
+    metric("queued", "gauge", "Requests currently waiting",
+           [({"lane": l.name}, l.queued) for l in lanes])
+    metric("admitted_total", "counter", "Requests admitted",
+           [({"lane": l.name}, l.admitted) for l in lanes])
+    metric("rejected_total", "counter", "Requests turned away",
+           [({"lane": l.name, "reason": reason}, count) for l in lanes for reason, count in l.rejected.items()])
+    metric("wait_seconds_sum", "counter", "Time admitted requests spent queued",
+           [({"lane": l.name}, round(l.wait_seconds, 6)) for l in lanes])
+    metric("service_seconds_sum", "counter", "Time admitted requests spent running",
+           [({"lane": l.name}, round(l.service_seconds, 6)) for l in lanes])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,232 @@
+"""Clinic-wide analytics export: Notes, Vitals, Patients and SharedAccess to Parquet.
+
+    python analytics_export.py --out exports/ [--full] [--workers 4] [--chunk-size 20000]
+
+Output is Hive-style partitioned by month of `created_at`, zstd-compressed:
+
+    exports/notes/month=2025-01/part-<first id>-<last id>.parquet
+    exports/patients/part-1-500.parquet
+
+Notes and Vitals are append-only, so runs are incremental: only rows with an id
+above the last run's watermark (kept in exports/_state.json) are exported.
+Patients and SharedAccess change in place, so they are rewritten in full each
+run (they are small).
+
+Each table's id range is split into chunks that a process pool reads with
+keyset range queries, one autocommit SELECT per chunk, so no long transaction
+holds back vacuum or blocks writers. Files are written to a staging directory
+and moved into place only when every chunk succeeded, then the watermark is
+advanced.
+
+With SHARD_URLS set, every shard is exported into the same tree (ids are
+unique across shards) and keeps its own watermarks.
+
+Requires pyarrow (`pip install pyarrow`), which the web app does not need.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+
+from sqlalchemy import DateTime, Enum, Float, Integer, create_engine, func, select
+from sqlalchemy.pool import NullPool
+
+import models
+from config import settings
+from database import DATABASE_URL
+
+DEFAULT_CHUNK_SIZE = 20_000 # Ids per chunk (and per SELECT)
+COMMIT_LAG = timedelta(minutes=5) # Rows younger than this may sit behind uncommitted lower ids
+STATE_FILE = "_state.json"
+
+# table name -> (model, incremental, columns left out of the export)
+TABLES = {
+    "notes": (models.Notes, True, {"search_text"}),
+    "vitals": (models.Vitals, True, set()),
+    "patients": (models.Patients, False, {"data_version"}),
+    "shared_access": (models.SharedAccess, False, set()),
+}
+
+def export_columns(table_name: str):
+    model, _, excluded = TABLES[table_name]
+    return [column for column in model.__table__.columns if column.name not in excluded]
+
+def arrow_schema(table_name: str):
+    import pyarrow as pa
+
+    fields = []
+    for column in export_columns(table_name):
+        if isinstance(column.type, Enum):
+            arrow_type = pa.string()
+        elif isinstance(column.type, Integer):
+            arrow_type = pa.int64()
+        elif isinstance(column.type, Float):
+            arrow_type = pa.float64()
+        elif isinstance(column.type, DateTime):
+            arrow_type = pa.timestamp("us")
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type, nullable=column.nullable or column.name != "id"))
+    return pa.schema(fields)
+
+def database_urls() -> list:
+    """The primary's URL, then each extra shard's (see sharding.py)"""
+    return [DATABASE_URL, *settings.shard_urls]
+
+def watermark_key(table_name: str, shard: int) -> str:
+    return table_name if shard == 0 else f"{table_name}:{shard}"
+
+# Worker processes
+_engines = []
+
+def _init_worker(urls: list):
+    global _engines
+    _engines = [create_engine(url, poolclass=NullPool) for url in urls]
+
+def export_chunk(table_name: str, first_id: int, last_id: int, staging_dir: str, shard: int = 0) -> int:
+    """Export ids in [first_id, last_id] of one table of one shard; returns the number of rows written"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    model = TABLES[table_name][0]
+    columns = export_columns(table_name)
+    stmt = select(*columns).where(model.id >= first_id, model.id <= last_id).order_by(model.id)
+
+    # Autocommit: the SELECT is its own short read, no transaction left open between chunks
+    with _engines[shard].connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        rows = conn.execute(stmt).all()
+    if not rows:
+        return 0
+
+    partitions = {}
+    partitioned = "created_at" in {column.name for column in columns}
+    for row in rows:
+        month = None
+        if partitioned:
+            month = row.created_at.strftime("%Y-%m") if row.created_at else "unknown"
+        partitions.setdefault(month, []).append(row)
+
+    schema = arrow_schema(table_name)
+    for month, month_rows in partitions.items():
+        data = {
+            column.name: [getattr(value, "value", value) for value in values]
+            for column, values in zip(columns, zip(*month_rows))
+        }
+        directory = os.path.join(staging_dir, table_name, f"month={month}" if month else "")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{month_rows[0].id}-{month_rows[-1].id}.parquet")
+        pq.write_table(pa.table(data, schema=schema), path, compression="zstd")
+    return len(rows)
+
+# Coordinator
+def load_state(out_dir: str) -> dict:
+    path = os.path.join(out_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {"watermarks": {}, "runs": []}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(out_dir: str, state: dict):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def plan(engine, state: dict, full: bool, chunk_size: int, shard: int = 0):
+    """(table, first_id, last_id, shard) chunks to export from one shard, and the new watermark per incremental table"""
+    chunks, watermarks = [], {}
+    cutoff = datetime.utcnow() - COMMIT_LAG
+    with engine.connect() as conn:
+        for table_name, (model, incremental, _) in TABLES.items():
+            key = watermark_key(table_name, shard)
+            if incremental and not full:
+                start = state["watermarks"].get(key, 0) + 1
+                end = conn.execute(select(func.max(model.id)).where(model.created_at < cutoff)).scalar()
+            else:
+                start = 1
+                end = conn.execute(select(func.max(model.id))).scalar()
+            end = end or 0
+            if incremental:
+                watermarks[key] = end if full else max(end, start - 1)
+            # A shard's ids start far above 1: skip straight to the first one
+            start = max(start, conn.execute(select(func.min(model.id)).where(model.id >= start)).scalar() or start)
+            for first_id in range(start, end + 1, chunk_size):
+                chunks.append((table_name, first_id, min(first_id + chunk_size - 1, end), shard))
+    return chunks, watermarks
+
+def publish(staging_dir: str, out_dir: str, full: bool):
+    """Move a finished run's files into the export tree"""
+    for table_name, (_, incremental, _) in TABLES.items():
+        source = os.path.join(staging_dir, table_name)
+        target = os.path.join(out_dir, table_name)
+        if incremental and not full:
+            if not os.path.isdir(source):
+                continue
+            for root, _, files in os.walk(source):
+                destination = os.path.join(target, os.path.relpath(root, source))
+                os.makedirs(destination, exist_ok=True)
+                for name in files:
+                    os.replace(os.path.join(root, name), os.path.join(destination, name))
+        else:
+            # Snapshot: swap the whole table directory
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            if os.path.isdir(source):
+                os.replace(source, target)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+def run(out_dir: str, full: bool = False, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> dict:
+    try:
+        import pyarrow # noqa: F401
+    except ImportError:
+        raise SystemExit("analytics_export needs pyarrow: pip install pyarrow")
+
+    os.makedirs(out_dir, exist_ok=True)
+    state = load_state(out_dir)
+    started = time.monotonic()
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    staging_dir = os.path.join(out_dir, "_staging", run_id)
+
+    urls = database_urls()
+    chunks, watermarks = [], {}
+    for shard, url in enumerate(urls):
+        engine = create_engine(url, poolclass=NullPool)
+        shard_chunks, shard_watermarks = plan(engine, state, full, chunk_size, shard)
+        engine.dispose()
+        chunks += shard_chunks
+        watermarks.update(shard_watermarks)
+
+    rows = {table_name: 0 for table_name in TABLES}
+    # spawn: workers must not inherit the parent's database connections
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context("spawn"),
+        initializer=_init_worker, initargs=(urls,)
+    ) as pool:
+        futures = {
+            pool.submit(export_chunk, table_name, first_id, last_id, staging_dir, shard): (table_name, first_id)
+            for table_name, first_id, last_id, shard in chunks
+        }
+        for future in as_completed(futures):
+            rows[futures[future][0]] += future.result()
+
+    publish(staging_dir, out_dir, full)
+    state["watermarks"].update(watermarks)
+    summary = {"run_id": run_id, "full": full, "rows": rows, "seconds": round(time.monotonic() - started, 2)}
+    state["runs"] = (state["runs"] + [summary])[-50:]
+    save_state(out_dir, state)
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export clinic data to partitioned Parquet for analytics")
+    parser.add_argument("--out", default="exports", help="Output directory")
+    parser.add_argument("--full", action="store_true", help="Ignore watermarks and re-export everything")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Ids per chunk")
+    args = parser.parse_args()
+
+    summary = run(args.out, args.full, args.workers, args.chunk_size)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,282 @@
+"""Vitals anomaly scan: flags deteriorating patients as rows in `alerts`.
+
+    python anomaly.py [--full] [--chunk-size 2000] [--window-days 30]    # from cron, e.g. every 5 minutes
+
+Each run reads the vitals added since the last run's watermark, plus up to
+WINDOW_DAYS of earlier readings of the same patients as a baseline, into NumPy
+arrays one chunk of patients at a time. Every new reading is checked for:
+
+- threshold: outside fixed clinical limits (warning or critical)
+- zscore: ZSCORE_WARNING or more standard deviations from the mean of the
+  patient's previous ROLLING_READINGS readings
+- trend: a least-squares slope over the last ROLLING_READINGS readings that
+  adds up to a worsening change of at least TREND_CHANGE
+
+Rolling means, variances and slopes come from differences of cumulative sums
+over the patient-sorted arrays, so a chunk costs a fixed number of array
+operations however many patients it holds. Alerts and the new watermark are
+written in one transaction: a failed run writes nothing, and the next run
+retries the same readings. --full rescans the whole window from scratch.
+With SHARD_URLS set, each shard is scanned in turn.
+
+Requires numpy (`pip install numpy`), which the web app does not need.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, cast, delete, distinct, func, insert, or_, select, update
+
+import models
+
+WATERMARK = "vitals_anomaly"
+COMMIT_LAG = timedelta(minutes=1) # Ids are assigned before commit; younger rows may sit behind uncommitted lower ids
+WINDOW_DAYS = 30
+DEFAULT_CHUNK_SIZE = 2000 # Patients per query
+
+METRICS = ("systolic_bp", "diastolic_bp", "heart_rate", "temperature", "spo2")
+LABELS = {"systolic_bp": "Systolic BP", "diastolic_bp": "Diastolic BP", "heart_rate": "Heart rate",
+          "temperature": "Temperature", "spo2": "SpO2"}
+UNITS = {"systolic_bp": "mmHg", "diastolic_bp": "mmHg", "heart_rate": "bpm", "temperature": "F", "spo2": "%"}
+
+# (critical low, warning low, warning high, critical high); None where there is no limit
+LIMITS = {
+    "systolic_bp": (80, 90, 160, 180),
+    "diastolic_bp": (50, 60, 100, 120),
+    "heart_rate": (40, 50, 110, 130),
+    "temperature": (95.0, 96.8, 100.4, 104.0),
+    "spo2": (88, 92, None, None),
+}
+
+ROLLING_READINGS = 10
+MIN_BASELINE_READINGS = 5
+ZSCORE_WARNING = 3.0
+ZSCORE_CRITICAL = 4.0
+# Floor on the baseline's standard deviation, so a very stable patient doesn't alert on a normal wobble
+MIN_STD = {"systolic_bp": 5.0, "diastolic_bp": 4.0, "heart_rate": 4.0, "temperature": 0.4, "spo2": 1.0}
+# A z-score from a handful of readings is noisy; it also has to be a clinically meaningful change
+MIN_DEVIATION = {"systolic_bp": 25.0, "diastolic_bp": 15.0, "heart_rate": 25.0, "temperature": 2.0, "spo2": 4.0}
+
+# (direction that is worse: 1 up, -1 down, 0 either, change over the window that alerts)
+TREND_CHANGE = {
+    "systolic_bp": (0, 25.0),
+    "diastolic_bp": (0, 15.0),
+    "heart_rate": (1, 25.0),
+    "temperature": (1, 2.0),
+    "spo2": (-1, 4.0),
+}
+TREND_MIN_READINGS = 6
+TREND_MIN_T = 4.0 # Slope / its standard error: the readings have to actually line up, not just start low and end high
+TREND_MIN_DAYS = 0.25 # Readings minutes apart are noise, not a trend
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise SystemExit("anomaly needs numpy: pip install numpy")
+    return numpy
+
+# Loading
+def load_chunk(conn, patient_ids, since: datetime, after_id: int, last_id: int, full: bool) -> dict:
+    """Readings of `patient_ids` as arrays, sorted by patient then time"""
+    np = _numpy()
+    # Timestamps as text: NumPy parses ISO strings several times faster than it converts datetime objects
+    columns = [models.Vitals.id, models.Vitals.patient_id, cast(models.Vitals.created_at, String)]
+    columns += [getattr(models.Vitals, metric) for metric in METRICS]
+    recent = models.Vitals.created_at >= since
+    rows = conn.execute(
+        select(*columns).where(
+            models.Vitals.patient_id.in_(patient_ids),
+            models.Vitals.id <= last_id,
+            recent if full else or_(recent, models.Vitals.id > after_id), # Back-dated new readings too
+        ).order_by(models.Vitals.patient_id, models.Vitals.created_at, models.Vitals.id)
+    ).all()
+    if not rows:
+        return {"ids": np.zeros(0, dtype=np.int64)}
+
+    columns = list(zip(*rows))
+    return {
+        "ids": np.array(columns[0], dtype=np.int64),
+        "patient_ids": np.array(columns[1], dtype=np.int64),
+        "times": np.array(columns[2], dtype="datetime64[us]"),
+        "values": np.array(columns[3:], dtype=np.float64).T, # None -> nan
+    }
+
+# Detection
+def _prefix(np, a):
+    """Cumulative sums with a leading zero row: sum of rows [lo, hi) is P[hi] - P[lo]"""
+    return np.concatenate([np.zeros((1,) + a.shape[1:]), np.cumsum(a, axis=0)])
+
+def detect(chunk: dict, after_id: int) -> list:
+    """Alert rows for the readings in `chunk` with ids above `after_id`"""
+    np = _numpy()
+    ids = chunk["ids"]
+    n = len(ids)
+    if not n:
+        return []
+    patient_ids, values = chunk["patient_ids"], chunk["values"]
+    days = (chunk["times"] - chunk["times"].min()).astype("timedelta64[us]").astype(np.float64) / 86400e6
+
+    index = np.arange(n)
+    boundary = np.r_[True, patient_ids[1:] != patient_ids[:-1]]
+    group_start = np.maximum.accumulate(np.where(boundary, index, 0))
+    valid = ~np.isnan(values)
+    new = (ids > after_id)[:, None] & valid
+
+    # Centre each metric so the running sums of squares don't swamp the differences taken from them
+    seen = valid.sum(axis=0)
+    centre = np.divide(np.where(valid, values, 0.0).sum(axis=0), seen, out=np.zeros(len(METRICS)), where=seen > 0)
+    x = np.where(valid, values - centre, 0.0)
+    t = np.where(valid, days[:, None], 0.0)
+    count, sx, sxx, st, stt, sxt = (_prefix(np, a) for a in (valid.astype(np.float64), x, x * x, t, t * t, x * t))
+
+    def window(prefix, lo, hi):
+        return prefix[hi] - prefix[lo]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Baseline: the previous ROLLING_READINGS readings of the same patient, not counting this one
+        lo = np.maximum(index - ROLLING_READINGS, group_start)
+        base_n = window(count, lo, index)
+        base_mean = window(sx, lo, index) / base_n
+        base_var = (window(sxx, lo, index) - base_n * base_mean ** 2) / (base_n - 1)
+        floor = np.array([MIN_STD[metric] for metric in METRICS])
+        base_std = np.maximum(np.sqrt(np.maximum(base_var, 0.0)), floor)
+        z = (x - base_mean) / base_std
+        deviation = np.array([MIN_DEVIATION[metric] for metric in METRICS])
+        z_ok = new & (base_n >= MIN_BASELINE_READINGS) & (np.abs(x - base_mean) >= deviation)
+
+        # Trend: least-squares slope (per day) over the last ROLLING_READINGS readings, this one included
+        lo = np.maximum(index - ROLLING_READINGS + 1, group_start)
+        hi = index + 1
+        tn, tsx, tst = window(count, lo, hi), window(sx, lo, hi), window(st, lo, hi)
+        ss_t = window(stt, lo, hi) - tst ** 2 / tn
+        ss_xt = window(sxt, lo, hi) - tst * tsx / tn
+        ss_x = window(sxx, lo, hi) - tsx ** 2 / tn
+        slope = ss_xt / ss_t
+        residual = np.maximum(ss_x - slope * ss_xt, 0.0)
+        t_stat = np.abs(slope) * np.sqrt(ss_t * (tn - 2) / residual) # inf for a perfect line
+        span = days - days[lo]
+        change = slope * span[:, None]
+        trend_ok = (new & (tn >= TREND_MIN_READINGS) & (span[:, None] >= TREND_MIN_DAYS) & (ss_t > 0)
+                    & (t_stat >= TREND_MIN_T))
+
+    alerts = []
+
+    def add(rows, column, kind, severity, baselines, message):
+        metric = METRICS[column]
+        for row in rows:
+            value = float(values[row, column])
+            baseline = None if baselines is None else float(baselines[row])
+            alerts.append({
+                "patient_id": int(patient_ids[row]),
+                "vitals_id": int(ids[row]),
+                "metric": metric,
+                "kind": kind,
+                "severity": severity,
+                "value": value,
+                "baseline": baseline,
+                "message": message(metric, value, baseline, row)[:200],
+                "created_at": chunk["times"][row].item(),
+            })
+
+    for column, metric in enumerate(METRICS):
+        v = values[:, column]
+        label, unit = LABELS[metric], UNITS[metric]
+        critical_low, warning_low, warning_high, critical_high = (np.nan if l is None else l for l in LIMITS[metric])
+
+        # Thresholds; nan limits compare false
+        with np.errstate(invalid="ignore"):
+            critical = new[:, column] & ((v <= critical_low) | (v >= critical_high))
+            warning = new[:, column] & ~critical & ((v <= warning_low) | (v >= warning_high))
+        for severity, rows in (("critical", critical), ("warning", warning)):
+            low, high = (critical_low, critical_high) if severity == "critical" else (warning_low, warning_high)
+            add(np.flatnonzero(rows), column, "threshold", severity, None,
+                lambda metric, value, _, row, low=low, high=high, severity=severity:
+                    f"{label} {value:g} {unit} is {'below' if value <= low else 'above'} the {severity} limit "
+                    f"of {low if value <= low else high:g}")
+
+        # Deviation from the patient's own recent readings
+        mean = base_mean[:, column] + centre[column]
+        zc = z[:, column]
+        for severity, rows in (("critical", z_ok[:, column] & (np.abs(zc) >= ZSCORE_CRITICAL)),
+                               ("warning", z_ok[:, column] & (np.abs(zc) >= ZSCORE_WARNING) & (np.abs(zc) < ZSCORE_CRITICAL))):
+            add(np.flatnonzero(rows), column, "zscore", severity, mean,
+                lambda metric, value, baseline, row:
+                    f"{label} {value:g} {unit} is {abs(z[row, column]):.1f} SD {'above' if z[row, column] > 0 else 'below'} "
+                    f"the recent average of {baseline:.1f}")
+
+        # Sustained worsening
+        direction, threshold = TREND_CHANGE[metric]
+        delta = change[:, column]
+        worse = np.abs(delta) if direction == 0 else delta * direction
+        add(np.flatnonzero(trend_ok[:, column] & (worse >= threshold)), column, "trend", "warning", delta,
+            lambda metric, value, baseline, row:
+                f"{label} {'rose' if baseline > 0 else 'fell'} {abs(baseline):.1f} {unit} over the last "
+                f"{int(tn[row, column])} readings ({span[row]:.1f} days), now {value:g}")
+    return alerts
+
+# Scan
+def scan(engine, full: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE, window_days: int = WINDOW_DAYS) -> dict:
+    _numpy()
+    started = time.monotonic()
+    now = datetime.utcnow()
+    since = now - timedelta(days=window_days)
+
+    # Short autocommit reads, like analytics_export: no transaction held open between chunks
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        after_id = 0 if full else conn.execute(
+            select(models.ScanWatermarks.last_id).where(models.ScanWatermarks.name == WATERMARK)
+        ).scalar() or 0
+        last_id = conn.execute(
+            select(func.max(models.Vitals.id)).where(models.Vitals.created_at < now - COMMIT_LAG)
+        ).scalar() or 0
+        last_id = max(last_id, after_id)
+
+        scope = models.Vitals.id > after_id
+        if full:
+            scope = scope & (models.Vitals.created_at >= since)
+        patient_ids = sorted(conn.execute(
+            select(distinct(models.Vitals.patient_id)).where(scope, models.Vitals.id <= last_id)
+        ).scalars())
+
+        alerts, readings = [], 0
+        for first in range(0, len(patient_ids), chunk_size):
+            chunk = load_chunk(conn, patient_ids[first:first + chunk_size], since, after_id, last_id, full)
+            readings += len(chunk["ids"])
+            alerts += detect(chunk, after_id)
+
+    with engine.begin() as conn:
+        if full:
+            conn.execute(delete(models.Alerts).where(models.Alerts.created_at >= since))
+        if alerts:
+            conn.execute(insert(models.Alerts), alerts)
+        values = {"last_id": last_id, "updated_at": datetime.utcnow()}
+        updated = conn.execute(
+            update(models.ScanWatermarks).where(models.ScanWatermarks.name == WATERMARK).values(**values)
+        ).rowcount
+        if not updated:
+            conn.execute(insert(models.ScanWatermarks).values(name=WATERMARK, **values))
+
+    return {
+        "patients": len(patient_ids),
+        "readings": readings,
+        "alerts": len(alerts),
+        "last_id": last_id,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+if __name__ == "__main__":
+    import sharding
+
+    parser = argparse.ArgumentParser(description="Flag anomalous vitals readings as alerts")
+    parser.add_argument("--full", action="store_true", help="rescan the whole window instead of new readings only")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="patients per query")
+    parser.add_argument("--window-days", type=int, default=WINDOW_DAYS, help="history used for baselines")
+    args = parser.parse_args()
+
+    # Each shard holds its own patients' vitals, alerts and watermark
+    for shard, engine in sharding.engines().items():
+        summary = scan(engine, full=args.full, chunk_size=args.chunk_size, window_days=args.window_days)
+        where = f" on shard {shard}" if sharding.enabled() else ""
+        print(f"Scanned {summary['readings']} readings of {summary['patients']} patients{where} in {summary['seconds']}s: "
+              f"{summary['alerts']} alerts (watermark {summary['last_id']})")
@@ -1,21 +1,53 @@
-from fastapi import FastAPI, HTTPException, Request, Query, Depends, UploadFile, File
-from database import Base, SessionLocal, engine, get_db
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi import FastAPI, HTTPException, Request, Response, Query, Depends, UploadFile, File
+import database
+from database import get_db
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-import schemas, models, crud
+import schemas, models, crud, search, responses, export, reports, utils, admission, audio, transcript_cache, static_assets, migrate, warmup
+import audit, entity_cache
+from audit import audit_log
+from config import settings
+from compression import CompressionMiddleware
 from sqlalchemy.orm import Session
+from realtime import hub, event_stream
 from auth import (
     get_current_user,
+    get_current_user_from_query,
     authenticate_user,
-    create_access_token,
-    get_password_hash
+    issue_tokens,
+    refresh_tokens,
+    logout as revoke_session,
+    get_password_hash_async,
+    CurrentUser
 )
+from revocation import revocations
+from transcript_cache import transcripts
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+import hmac
 
-app = FastAPI(title="VriddhaMitra", description="User-Patient Management System")
-Base.metadata.create_all(engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Nothing here runs at import, so the gunicorn master can preload the app without touching the database
+    if settings.auto_migrate:
+        await run_in_threadpool(migrate.init_schema, database.engine)
+    if settings.warmup:
+        # Before the first request rather than during it
+        await run_in_threadpool(warmup.run)
+        await run_in_threadpool(utils.warm_up)
+    yield
+    utils.shutdown() # Stop the password hashing workers
+    reports.shutdown()
+    revocations.stop()
+    audit_log.stop() # Write out buffered audit events
+
+app = FastAPI(title="VriddhaMitra", description="User-Patient Management System", lifespan=lifespan)
+
+# Concurrency limits for heavy endpoints; inside CORS so rejections still carry CORS headers
+app.add_middleware(admission.AdmissionMiddleware)
 
 # CORS Middleware
 app.add_middleware(
@@ -25,37 +57,56 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Mount static files: fingerprinted and precompressed copies of static/, built at startup if needed
+app.mount("/static", static_assets.AssetFiles(directory=static_assets.build_or_source()), name="static")
 
 # Root endpoint
 @app.get("/")
 def read_root():
     return RedirectResponse(url="/static/index.html")
 
+LOOPBACK = ("127.0.0.1", "::1")
+
+def metrics_allowed(request: Request) -> bool:
+    """Scrapers present METRICS_TOKEN as a bearer token; without one configured, only this host may scrape"""
+    if settings.metrics_token:
+        return hmac.compare_digest(request.headers.get("authorization", "").encode(), f"Bearer {settings.metrics_token}".encode())
+    return request.client is not None and request.client.host in LOOPBACK
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics(request: Request):
+    """Admission lane, audit buffer and entity cache gauges and counters for this worker, in Prometheus format"""
+    if not metrics_allowed(request):
+        raise HTTPException(status_code=403, detail="Not allowed")
+    return admission.render_metrics() + audit.render_metrics() + entity_cache.render_metrics()
+
 # Authentication endpoints
 @app.post('/register_user', response_model=schemas.UserOut)
-def register_user(user: schemas.RegisterUser, db: Session = Depends(get_db)):
+async def register_user(user: schemas.RegisterUser, db: Session = Depends(get_db)):
     """Register a new user (physician/staff)"""
-    if crud.check_user_exists(user.email, db):
+    # Async so hashing waits on the hashing pool without holding a threadpool thread;
+    # database calls still go through the threadpool
+    if await run_in_threadpool(crud.check_user_exists, user.email, db):
         raise HTTPException(status_code=400, detail='User already exists')
+    await run_in_threadpool(db.close) # Don't hold a pooled connection while hashing
     
     # Hash password
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     user_data = user.model_dump()
     user_data['password'] = hashed_password
     
     # Create user object
     new_user = schemas.RegisterUser(**user_data)
-    created_user = crud.register_user(new_user, db)
+    created_user = await run_in_threadpool(crud.register_user, new_user, db)
     
     return created_user
 
 @app.post('/register_patient')
 def register_patient(
     patient: schemas.RegisterPatient,
-    current_user: models.Users = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Register a new patient"""
@@ -83,9 +134,9 @@ def register_patient(
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.post('/login')
-def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
-    """Login endpoint - returns JWT token"""
-    user = authenticate_user(login_data.email, login_data.password, db)
+async def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
+    """Login endpoint - returns a short-lived JWT access token and a refresh token"""
+    user = await authenticate_user(login_data.email, login_data.password, db)
     
     if not user:
         raise HTTPException(
@@ -93,14 +144,24 @@ def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
             detail="Invalid email or password"
         )
     
-    # Create JWT token
-    access_token = create_access_token(
-        data={"sub": str(user.id), "email": user.email, "role": user.role}
-    )
+    tokens = await run_in_threadpool(issue_tokens, user, db)
     
     return {
-        "access_token": access_token,
-        "token_type": "bearer",
+        **tokens,
+        "user": {
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "role": user.role
+        }
+    }
+
+@app.post('/token/refresh')
+def refresh_access_token(data: schemas.RefreshRequest, db: Session = Depends(get_db)):
+    """Exchange a refresh token for a new access token and a new refresh token (the old one stops working)"""
+    user, tokens = refresh_tokens(data.refresh_token, db)
+    return {
+        **tokens,
         "user": {
             "id": user.id,
             "name": user.name,
@@ -109,11 +170,41 @@ def login(login_data: schemas.LoginRequest, db: Session = Depends(get_db)):
         }
     }
 
+@app.post('/logout')
+def logout(
+    data: Optional[schemas.LogoutRequest] = None,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Revoke the current access token and its refresh token"""
+    revoke_session(current_user, data.refresh_token if data else None, db)
+    return {"message": "Logged out"}
+
+# Conditional GET for patient record endpoints
+CACHE_CONTROL = "private, no-cache" # Browsers may keep the response but must revalidate it
+
+def patient_etag(patient: models.Patients, *parts) -> str:
+    """Strong ETag from the patient's data version, plus anything else the response depends on"""
+    return '"' + "-".join([f"p{patient.id}", f"v{patient.data_version}", *map(str, parts)]) + '"'
+
+def cache_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 response if the client already has `etag`"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # Weak comparison; compression marks tags weak (see compression.py)
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=cache_headers(etag))
+    return None
+
 # Patient Management
 @app.get('/users/{user_id}/patients', response_model=List[schemas.PatientListItem])
 def get_patients(
     user_id: int,
-    current_user: models.Users = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all patients assigned to OR shared with a user"""
@@ -121,26 +212,86 @@ def get_patients(
         raise HTTPException(status_code=403, detail="Access forbidden")
     
     patients = crud.get_user_patients(user_id, db)
-    return patients
+    return responses.from_orm(responses.PATIENT_LIST, patients)
+
+@app.get('/users/{user_id}/alerts', response_model=List[schemas.AlertOut])
+def get_alerts(
+    user_id: int,
+    since: Optional[datetime] = Query(None),
+    severity: Optional[str] = Query(None, enum=["warning", "critical"]),
+    patient_id: Optional[int] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Vitals alerts from the anomaly scan on the user's patients, newest first"""
+    if current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    return crud.get_user_alerts(user_id, db, since=since, severity=severity, patient_id=patient_id, limit=limit)
+
+# Audit trail
+@app.get('/patients/{patient_id}/audit', response_model=List[schemas.AuditEventOut])
+def get_patient_audit(
+    patient_id: int,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    action: Optional[str] = Query(None, enum=list(audit.ACTIONS)),
+    user_id: Optional[int] = Query(None),
+    before_id: Optional[int] = Query(None), # Next page: the last id of this one
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Who viewed or changed a patient, newest first (owner only)"""
+    patient = crud.get_patient_by_id(patient_id, db)
+    if not patient or patient.physician_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Only the patient owner can see its audit trail")
+
+    audit_log.flush() # Include this worker's buffered events
+    return crud.get_audit_events(db, patient_id=patient_id, user_id=user_id, since=since, until=until,
+                                 action=action, before_id=before_id, limit=limit)
+
+@app.get('/users/{user_id}/audit', response_model=List[schemas.AuditEventOut])
+def get_user_audit(
+    user_id: int,
+    since: Optional[datetime] = Query(None),
+    until: Optional[datetime] = Query(None),
+    action: Optional[str] = Query(None, enum=list(audit.ACTIONS)),
+    patient_id: Optional[int] = Query(None),
+    before_id: Optional[int] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """A user's own access history, newest first"""
+    if current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    audit_log.flush()
+    return crud.get_audit_events(db, patient_id=patient_id, user_id=user_id, since=since, until=until,
+                                 action=action, before_id=before_id, limit=limit)
 
 @app.get('/users/{user_id}/patients/search', response_model=List[schemas.PatientListItem])
 def search_patients(
     user_id: int,
     q: str = Query(...),
-    current_user: models.Users = Depends(get_current_user),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Search patients by name or phone"""
+    """Typeahead search of patients by name or phone"""
     if current_user.id != user_id:
         raise HTTPException(status_code=403, detail="Access forbidden")
     
-    patients = crud.search_patients(user_id, q, db)
-    return patients
+    patients = crud.search_patients(user_id, q, db, limit)
+    return responses.from_orm(responses.PATIENT_LIST, patients)
 
 @app.get('/patients/{patient_id}', response_model=schemas.PatientDetail)
 def get_patient(
     patient_id: int,
-    current_user: models.Users = Depends(get_current_user),
+    request: Request,
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get patient details (protected)"""
@@ -152,19 +303,26 @@ def get_patient(
     patient = crud.get_patient_by_id(patient_id, db)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
+    audit_log.record(current_user.id, patient_id, "view") # Revalidations too: the client shows the record again
+
+    # permission_level is part of the body, so it is part of the tag
+    etag = patient_etag(patient, "detail", getattr(permission, 'value', permission))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
         
     # Convert to schema manually to inject permission_level
     patient_data = schemas.PatientDetail.model_validate(patient)
     patient_data.permission_level = permission.value if hasattr(permission, 'value') else permission
     
-    return patient_data
+    return responses.from_models(responses.PATIENT_DETAIL, patient_data, headers=cache_headers(etag))
 
 # Sharing Endpoints
 @app.post('/patients/{patient_id}/share', response_model=schemas.SharedAccessResponse)
 def share_patient(
     patient_id: int,
     share_data: schemas.SharedAccessCreate,
-    current_user: models.Users = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Share a patient with another user"""
@@ -189,6 +347,9 @@ def share_patient(
         db=db
     )
     
+    publish_access([patient_id], [target_user.id], db) # The effective permission: a team grant may give more
+    audit_log.record(current_user.id, patient_id, "share", f"user {target_user.id} {share_data.permission}")
+
     # Populate response fields
     response = schemas.SharedAccessResponse.model_validate(access)
     response.user_name = target_user.name
@@ -199,7 +360,7 @@ def share_patient(
 def revoke_sharing(
     patient_id: int,
     user_id: int,
-    current_user: models.Users = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Revoke sharing access"""
@@ -208,31 +369,217 @@ def revoke_sharing(
         raise HTTPException(status_code=403, detail="Only the patient owner can revoke access")
         
     crud.revoke_access(patient_id, user_id, db)
+    publish_access([patient_id], [user_id], db) # Team grants may still give access
+    audit_log.record(current_user.id, patient_id, "revoke", f"user {user_id}")
     return {"message": "Access revoked"}
 
 @app.get('/patients/{patient_id}/access', response_model=List[schemas.SharedAccessResponse])
 def get_sharing_list(
     patient_id: int,
-    current_user: models.Users = Depends(get_current_user),
+    request: Request,
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get list of users with shared access"""
     permission = crud.check_access(patient_id, current_user.id, db)
     if not permission: # Basic access check
         raise HTTPException(status_code=403, detail="Access forbidden")
+
+    etag = patient_etag(crud.get_patient_by_id(patient_id, db), "access")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
         
     access_list = crud.get_patient_access_list(patient_id, db)
     
     # Populate extra fields
-    response = []
+    results = []
     for access in access_list:
         resp = schemas.SharedAccessResponse.model_validate(access)
         resp.user_name = access.user.name
         resp.user_email = access.user.email
-        response.append(resp)
+        results.append(resp)
         
+    return responses.from_models(responses.ACCESS_LIST, results, headers=cache_headers(etag))
+
+def publish_access(patient_ids, user_ids, db: Session):
+    """Tell each patient's open streams what each user's permission now is (None when revoked)"""
+    permissions = crud.effective_permissions(patient_ids, user_ids, db)
+    for patient_id in set(patient_ids):
+        for user_id in set(user_ids):
+            permission = permissions.get((patient_id, user_id))
+            hub.publish(patient_id, "access", {"user_id": user_id, "permission": getattr(permission, 'value', None)})
+
+def owned_patients_or_403(patient_ids, current_user: CurrentUser, db: Session) -> set:
+    patient_ids = set(patient_ids)
+    not_owned = patient_ids - crud.get_owned_patient_ids(patient_ids, current_user.id, db)
+    if not_owned:
+        raise HTTPException(status_code=403, detail=f"Only the patient owner can share these records: {sorted(not_owned)}")
+    return patient_ids
+
+@app.post('/patients/share/bulk', response_model=schemas.BulkShareResult)
+def bulk_share(
+    share: schemas.BulkShareRequest,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Share many patients with many users and teams in one transaction"""
+    if share.permission not in models.PermissionLevel.__members__:
+        raise HTTPException(status_code=400, detail="Permission must be VIEW or EDIT")
+    patient_ids = owned_patients_or_403(share.patient_ids, current_user, db)
+
+    users = crud.get_users_by_emails(share.user_emails, db)
+    missing = set(share.user_emails) - {user.email for user in users}
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Users with these emails not found: {sorted(missing)}")
+    user_ids = {user.id for user in users}
+    if current_user.id in user_ids:
+        raise HTTPException(status_code=400, detail="Cannot share with yourself")
+
+    team_ids = set(share.team_ids)
+    unknown = team_ids - crud.get_member_team_ids(team_ids, current_user.id, db)
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Teams not found: {sorted(unknown)}")
+
+    if not user_ids and not team_ids:
+        raise HTTPException(status_code=400, detail="No users or teams to share with")
+    if len(patient_ids) * (len(user_ids) + len(team_ids)) > crud.MAX_BULK_GRANTS:
+        raise HTTPException(status_code=400, detail=f"At most {crud.MAX_BULK_GRANTS} grants per request")
+
+    grants = crud.bulk_grant_access(patient_ids, user_ids, team_ids, current_user.id, share.permission, db)
+    publish_access(patient_ids, user_ids | set(crud.get_team_member_ids(team_ids, db)), db)
+    for user_id in user_ids:
+        audit_log.record_many(current_user.id, patient_ids, "share", f"user {user_id} {share.permission}")
+    for team_id in team_ids:
+        audit_log.record_many(current_user.id, patient_ids, "share", f"team {team_id} {share.permission}")
+    return schemas.BulkShareResult(patients=len(patient_ids), users=len(user_ids), teams=len(team_ids), grants=grants)
+
+@app.post('/patients/share/bulk-revoke', response_model=schemas.BulkShareResult)
+def bulk_revoke(
+    revoke: schemas.BulkRevokeRequest,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Revoke many patients from many users and teams in one transaction"""
+    patient_ids = owned_patients_or_403(revoke.patient_ids, current_user, db)
+    user_ids, team_ids = set(revoke.user_ids), set(revoke.team_ids)
+    if not user_ids and not team_ids:
+        raise HTTPException(status_code=400, detail="No users or teams to revoke")
+
+    revoked = crud.bulk_revoke_access(patient_ids, user_ids, team_ids, db)
+    publish_access(patient_ids, user_ids | set(crud.get_team_member_ids(team_ids, db)), db)
+    for user_id in user_ids:
+        audit_log.record_many(current_user.id, patient_ids, "revoke", f"user {user_id}")
+    for team_id in team_ids:
+        audit_log.record_many(current_user.id, patient_ids, "revoke", f"team {team_id}")
+    return schemas.BulkShareResult(patients=len(patient_ids), users=len(user_ids), teams=len(team_ids), grants=revoked)
+
+@app.get('/patients/{patient_id}/teams', response_model=List[schemas.TeamAccessResponse])
+def get_team_sharing_list(
+    patient_id: int,
+    request: Request,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Get list of teams the patient is shared with"""
+    if not crud.check_access(patient_id, current_user.id, db):
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    etag = patient_etag(crud.get_patient_by_id(patient_id, db), "teams")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    results = []
+    for access in crud.get_patient_team_access(patient_id, db):
+        resp = schemas.TeamAccessResponse.model_validate(access)
+        resp.team_name = access.team.name
+        results.append(resp)
+    return responses.from_models(responses.TEAM_ACCESS_LIST, results, headers=cache_headers(etag))
+
+# Teams
+def team_response(team: models.Teams) -> schemas.TeamOut:
+    response = schemas.TeamOut.model_validate(team)
+    for member, out in zip(team.members, response.members):
+        out.user_name = member.user.name
+        out.user_email = member.user.email
     return response
 
+def owned_team_or_404(team_id: int, current_user: CurrentUser, db: Session) -> models.Teams:
+    team = crud.get_team(team_id, db)
+    if not team or team.owner_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Team not found")
+    return team
+
+@app.post('/teams', response_model=schemas.TeamOut)
+def create_team(
+    team: schemas.TeamCreate,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Create a team; patients shared with it are accessible to all its members"""
+    return team_response(crud.create_team(team.name, current_user.id, db))
+
+@app.get('/teams', response_model=List[schemas.TeamOut])
+def get_teams(
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Teams the current user owns or belongs to"""
+    return [team_response(team) for team in crud.get_user_teams(current_user.id, db)]
+
+@app.post('/teams/{team_id}/members', response_model=schemas.TeamOut)
+def add_team_members(
+    team_id: int,
+    members: schemas.TeamMembersAdd,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Add users to a team (owner only)"""
+    team = owned_team_or_404(team_id, current_user, db)
+    users = crud.get_users_by_emails(members.user_emails, db)
+    missing = set(members.user_emails) - {user.email for user in users}
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Users with these emails not found: {sorted(missing)}")
+
+    user_ids = [user.id for user in users]
+    crud.add_team_members(team.id, user_ids, db)
+    publish_access(crud.get_team_patient_ids([team.id], db), user_ids, db)
+    db.refresh(team)
+    return team_response(team)
+
+@app.delete('/teams/{team_id}/members/{user_id}')
+def remove_team_member(
+    team_id: int,
+    user_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Remove a member (owner), or leave a team (the member themselves)"""
+    team = crud.get_team(team_id, db)
+    if not team or current_user.id not in (team.owner_id, user_id):
+        raise HTTPException(status_code=404, detail="Team not found")
+    if user_id == team.owner_id:
+        raise HTTPException(status_code=400, detail="The owner cannot leave the team; delete it instead")
+
+    crud.remove_team_member(team.id, user_id, db)
+    publish_access(crud.get_team_patient_ids([team.id], db), [user_id], db)
+    return {"message": "Member removed"}
+
+@app.delete('/teams/{team_id}')
+def delete_team(
+    team_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Delete a team; its members lose the access it gave them"""
+    team = owned_team_or_404(team_id, current_user, db)
+    member_ids = crud.get_team_member_ids([team.id], db)
+    patient_ids = crud.get_team_patient_ids([team.id], db)
+    crud.delete_team(team, db)
+    publish_access(patient_ids, member_ids, db)
+    return {"message": "Team deleted"}
+
 # Reporting Endpoints
 @app.get('/patients/{patient_id}/report')
 def generate_report(
@@ -240,7 +587,7 @@ def generate_report(
     period: str = Query("week", enum=["week", "month", "all", "custom"]),
     start_date: Optional[str] = Query(None), # YYYY-MM-DD
     end_date: Optional[str] = Query(None),   # YYYY-MM-DD
-    current_user: models.Users = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Generate a PDF summary report for a patient"""
@@ -249,169 +596,118 @@ def generate_report(
         raise HTTPException(status_code=403, detail="Access forbidden")
         
     now = datetime.now()
-    if period == "week":
-        s_date = now - timedelta(weeks=1)
-        e_date = now
-    elif period == "month":
-        s_date = now - timedelta(days=30)
-        e_date = now
-    elif period == "all":
-        s_date = datetime.min
-        e_date = now
-    elif period == "custom":
-        if not start_date or not end_date:
-            raise HTTPException(status_code=400, detail="Start and End dates required for custom period")
-        try:
-            s_date = datetime.strptime(start_date, "%Y-%m-%d")
-            e_date = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1) # inclusive
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
-    else:
-        s_date = now - timedelta(weeks=1)
-        e_date = now
-        
-    data = crud.get_patient_data_summary(patient_id, s_date, e_date, db)
-    patient = crud.get_patient_by_id(patient_id, db)
-    
-    # Generate PDF using Platypus
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-    from reportlab.pdfbase import pdfmetrics
-    from reportlab.pdfbase.ttfonts import TTFont
-    from io import BytesIO
-    from fastapi.responses import StreamingResponse
-    import os
-    import re
-    
-    # Register Hindi Font
-    font_path = "static/fonts/NotoSansDevanagari-Regular.ttf"
-    has_hindi_font = False
-    if os.path.exists(font_path):
-        pdfmetrics.registerFont(TTFont('Devanagari', font_path))
-        has_hindi_font = True
-        
-    def format_text(text):
-        """Wraps text in Hindi font tag if Devanagari chars detected"""
-        if not text: return "-"
-        if not has_hindi_font: return str(text)
-        
-        # Simple check for Devanagari block (U+0900 to U+097F)
-        # If text contains any Devanagari char, we wrap the whole thing or split?
-        # Safest for now: wrap the whole string in Devanagari font if it has Hindi.
-        # But wait, NotoSansDevanagari might NOT have English.
-        # So we should only wrap the HINDI parts.
-        
-        # Regex for Devanagari: [\u0900-\u097F]
-        # We replace any sequence of Devanagari chars with <font face="Devanagari">\g<0></font>
-        return re.sub(r'([\u0900-\u097F]+)', r'<font face="Devanagari">\1</font>', str(text))
+    try:
+        s_date, e_date = reports.period_range(period, start_date, end_date, now)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    elements = []
-    
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='HindiNormal', parent=styles['Normal'], fontName='Helvetica', leading=14))
-    styles.add(ParagraphStyle(name='HindiSmall', parent=styles['Normal'], fontName='Helvetica', fontSize=9, leading=12))
-    
-    # Header
-    elements.append(Paragraph(f"<b>Patient Summary Report</b>", styles['Heading1']))
-    elements.append(Spacer(1, 12))
-    
-    # Patient Info Table
-    header_data = [
-        [Paragraph(f"<b>Patient Name:</b> {format_text(patient.name)}", styles['HindiNormal']),
-         Paragraph(f"<b>Generated on:</b> {now.strftime('%d-%b-%Y %H:%M')}", styles['Normal'])],
-        [Paragraph(f"<b>Period:</b> {s_date.strftime('%d-%b-%Y')} to {e_date.strftime('%d-%b-%Y')}", styles['Normal']),
-         Paragraph(f"<b>Patient ID:</b> {patient.id}", styles['Normal'])]
-    ]
-    t = Table(header_data, colWidths=[300, 200])
-    t.setStyle(TableStyle([
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 10),
-    ]))
-    elements.append(t)
-    elements.append(Spacer(1, 20))
-    
-    # Vitals Section
-    elements.append(Paragraph("<b>Vitals Summary</b>", styles['Heading2']))
-    elements.append(Spacer(1, 10))
-    
-    if data['vitals']:
-        vitals_data = [['Date', 'BP (mmHg)', 'Heart Rate', 'Temp (F)', 'SpO2 (%)']]
-        for v in data['vitals'][:20]: # Limit for PDF
-            v_date = v.created_at.strftime('%d-%b-%Y %H:%M')
-            bp = f"{v.systolic_bp}/{v.diastolic_bp}" if v.systolic_bp else "-"
-            vitals_data.append([
-                v_date, 
-                bp, 
-                str(v.heart_rate or '-'), 
-                str(v.temperature or '-'), 
-                str(v.spo2 or '-')
-            ])
-            
-        t_vitals = Table(vitals_data, colWidths=[120, 100, 80, 80, 80])
-        t_vitals.setStyle(TableStyle([
-            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f3f4f6')),
-            ('TEXTCOLOR', (0,0), (-1,0), colors.black),
-            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0,0), (-1,0), 10),
-            ('BOTTOMPADDING', (0,0), (-1,0), 12),
-            ('BACKGROUND', (0,1), (-1,-1), colors.white),
-            ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
-        ]))
-        elements.append(t_vitals)
-    else:
-        elements.append(Paragraph("No vitals recorded in this period.", styles['Normal']))
-        
-    elements.append(Spacer(1, 20))
-    
-    # Notes Section
-    elements.append(Paragraph("<b>Clinical Notes</b>", styles['Heading2']))
-    elements.append(Spacer(1, 10))
-    
-    if data['notes']:
-        for n in data['notes']:
-            n_date = n.created_at.strftime('%d-%b-%Y %H:%M')
-            author_text = format_text(n.author.name)
-            
-            # Note Header
-            elements.append(Paragraph(f"<b>Note by {author_text} on {n_date}</b>", styles['HindiNormal']))
-            
-            # content
-            content_parts = []
-            if n.assessment: content_parts.append(f"<b>Assessment:</b> {format_text(n.assessment)}")
-            if n.plan: content_parts.append(f"<b>Plan:</b> {format_text(n.plan)}")
-            if n.raw_notes: content_parts.append(f"<b>Raw:</b> {format_text(n.raw_notes)}")
-            
-            for part in content_parts:
-                elements.append(Paragraph(part, styles['HindiSmall']))
-                
-            elements.append(Spacer(1, 15))
-            elements.append(Paragraph("<hr/>", styles['Normal'])) # Does hr work? using a line instead
-            # Drawing a line with Table or just spacer
-            elements.append(Spacer(1, 5))
-            
-    else:
-        elements.append(Paragraph("No notes recorded in this period.", styles['Normal']))
+    rows = crud.get_report_data([patient_id], s_date, e_date, db)
+    if patient_id not in rows:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    audit_log.record(current_user.id, patient_id, "report", period)
+    db.close() # Rendering takes longer than the queries; give the connection back
+    pdf = reports.render_pdf(reports.report_data(rows[patient_id], s_date, e_date, now))
 
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return StreamingResponse(
-        buffer, 
+    return Response(
+        pdf,
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename=report_{patient_id}_{period}.pdf"}
     )
 
+@app.post('/reports/batch')
+def generate_batch_reports(
+    batch: schemas.BatchReportRequest,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """ZIP of PDF summary reports for several patients (or all of the user's), streamed as they are rendered.
+
+    The X-Report-Job header holds the id to poll GET /reports/batch/{id} with for progress."""
+    if batch.period not in reports.PERIODS:
+        raise HTTPException(status_code=400, detail=f"Period must be one of: {', '.join(reports.PERIODS)}")
+    now = datetime.now()
+    try:
+        s_date, e_date = reports.period_range(batch.period, batch.start_date, batch.end_date, now)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if batch.patient_ids is None:
+        patient_ids = crud.get_accessible_patient_ids(current_user.id, db)
+    else:
+        requested = list(dict.fromkeys(batch.patient_ids))
+        if len(requested) > reports.MAX_BATCH_PATIENTS:
+            raise HTTPException(status_code=400, detail=f"At most {reports.MAX_BATCH_PATIENTS} patients per batch")
+        allowed = set(crud.get_accessible_patient_ids(current_user.id, db, requested))
+        forbidden = [patient_id for patient_id in requested if patient_id not in allowed]
+        if forbidden:
+            raise HTTPException(status_code=403, detail=f"Access forbidden for patients: {', '.join(map(str, forbidden))}")
+        patient_ids = requested
+    if not patient_ids:
+        raise HTTPException(status_code=400, detail="No patients to report on")
+    if len(patient_ids) > reports.MAX_BATCH_PATIENTS:
+        raise HTTPException(status_code=400, detail=f"At most {reports.MAX_BATCH_PATIENTS} patients per batch; select some")
+
+    job = crud.create_report_job(current_user.id, batch.period, len(patient_ids), db)
+    audit_log.record_many(current_user.id, patient_ids, "report", f"{batch.period}, batch {job.id}")
+    db.close() # The archive reads through its own sessions while streaming
+
+    return StreamingResponse(
+        reports.stream_batch(job.id, patient_ids, batch.period, s_date, e_date, now),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=reports_{batch.period}_{now.strftime('%Y%m%d')}.zip",
+            "X-Report-Job": str(job.id),
+            "X-Report-Count": str(len(patient_ids)),
+        }
+    )
+
+@app.get('/reports/batch/{job_id}', response_model=schemas.ReportJobOut)
+def get_batch_report_progress(
+    job_id: int,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Progress of a batch report download"""
+    job = db.get(models.ReportJobs, job_id)
+    if not job or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Report job not found")
+    return job
+
+@app.get('/patients/{patient_id}/export')
+def export_patient(
+    patient_id: int,
+    format: str = Query("ndjson", enum=["ndjson", "csv"]),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stream the patient's full history (notes, vitals, user and team grants, share/revoke history) as NDJSON or CSV"""
+    permission = crud.check_access(patient_id, current_user.id, db)
+    if not permission:
+        raise HTTPException(status_code=403, detail="Access forbidden")
+    if format not in export.MEDIA_TYPES:
+        format = "ndjson"
+    audit_log.record(current_user.id, patient_id, "export", format)
+    db.close() # The export reads through its own session while streaming
+
+    return StreamingResponse(
+        export.export_lines(patient_id, format),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename=patient_{patient_id}_export.{format}"}
+    )
+
 # Protected notes endpoints
+def note_payload(note: models.Notes) -> dict:
+    """JSON shape of a note in pushed events, same as the notes list"""
+    return schemas.NoteResponse.model_validate(note).model_dump(mode="json")
+
+def vitals_payload(vitals: models.Vitals) -> dict:
+    return schemas.VitalsResponse.model_validate(vitals).model_dump(mode="json")
+
 @app.post('/users/{user_id}/notes')
 def create_note(
     user_id: int,
     note: schemas.NoteCreate,
-    current_user: models.Users = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Create a new clinical note"""
@@ -423,50 +719,61 @@ def create_note(
     if permission != models.PermissionLevel.EDIT:
         raise HTTPException(status_code=403, detail="You do not have permission to add notes (Edit access required)")
     
-    created_note = crud.create_note(user_id, note, db)
+    try:
+        created_note, inserted = crud.create_note(user_id, note, db)
+    except crud.IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if inserted: # A retry gets the original note back, without announcing it again
+        hub.publish(created_note.patient_id, "note", note_payload(created_note))
+        audit_log.record(user_id, created_note.patient_id, "add_note", f"note {created_note.id}")
     return {
         "id": created_note.id,
         "message": "Note created successfully"
     }
 
-@app.get('/patients/{patient_id}/notes')
+@app.get('/users/{user_id}/notes/search', response_model=schemas.NoteSearchResponse)
+def search_notes(
+    user_id: int,
+    q: str = Query(..., min_length=1),
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=50),
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Full-text search over the notes of all patients the user can access"""
+    if current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    return search.search_notes(q, crud.accessible_patient_ids(user_id, db), db, page, page_size)
+
+@app.get('/patients/{patient_id}/notes', response_model=List[schemas.NoteResponse])
 def get_notes(
     patient_id: int,
-    current_user: models.Users = Depends(get_current_user),
+    request: Request,
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all notes for a patient"""
     permission = crud.check_access(patient_id, current_user.id, db)
     if not permission:
         raise HTTPException(status_code=403, detail="Access forbidden")
+
+    audit_log.record(current_user.id, patient_id, "view_notes")
+    etag = patient_etag(crud.get_patient_by_id(patient_id, db), "notes")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     
     notes = crud.get_patient_notes(patient_id, db)
     
-    # Format response
-    formatted_notes = []
-    for note in notes:
-        formatted_notes.append({
-            "id": note.id,
-            "physician_id": note.physician_id, # author
-            "physician_name": note.author.name,
-            "patient_id": note.patient_id,
-            "chief_complaint": note.chief_complaint,
-            "subjective": note.subjective,
-            "objective": note.objective,
-            "assessment": note.assessment,
-            "plan": note.plan,
-            "raw_notes": note.raw_notes,
-            "created_at": note.created_at.isoformat()
-        })
-    
-    return formatted_notes
+    return responses.from_orm(responses.NOTES, notes, headers=cache_headers(etag))
 
 # Protected vitals endpoints
 @app.post('/users/{user_id}/vitals')
 def create_vitals(
     user_id: int,
     vitals: schemas.VitalsCreate,
-    current_user: models.Users = Depends(get_current_user),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Log new vitals reading"""
@@ -477,77 +784,178 @@ def create_vitals(
     if permission != models.PermissionLevel.EDIT:
         raise HTTPException(status_code=403, detail="Edit access required")
     
-    created_vitals = crud.create_vitals(user_id, vitals, db)
+    try:
+        created_vitals, inserted = crud.create_vitals(user_id, vitals, db)
+    except crud.IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if inserted:
+        hub.publish(created_vitals.patient_id, "vitals", vitals_payload(created_vitals))
+        audit_log.record(user_id, created_vitals.patient_id, "add_vitals", f"vitals {created_vitals.id}")
     return {
         "id": created_vitals.id,
         "message": "Vitals logged successfully"
     }
 
+# Offline sync endpoint
+MAX_SYNC_ITEMS = 500
+
+@app.post('/users/{user_id}/sync', response_model=List[schemas.SyncItemResult])
+def sync_writes(
+    user_id: int,
+    batch: schemas.SyncRequest,
+    current_user: CurrentUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Replay queued offline note/vitals writes in one transaction"""
+    if current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    if len(batch.items) > MAX_SYNC_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_SYNC_ITEMS} writes per sync")
+
+    results = crud.apply_sync_batch(user_id, batch.items, db)
+
+    # Push the newly created writes to anyone watching these patients
+    created = [r for r in results if r["status"] == "created"]
+    for note in crud.get_notes_by_ids([r["id"] for r in created if r["kind"] == "note"], db):
+        hub.publish(note.patient_id, "note", note_payload(note))
+        audit_log.record(user_id, note.patient_id, "add_note", f"note {note.id}")
+    for vitals in crud.get_vitals_by_ids([r["id"] for r in created if r["kind"] == "vitals"], db):
+        hub.publish(vitals.patient_id, "vitals", vitals_payload(vitals))
+        audit_log.record(user_id, vitals.patient_id, "add_vitals", f"vitals {vitals.id}")
+
+    return results
+
+# Real-time updates
+@app.get('/patients/{patient_id}/events')
+def patient_events(
+    patient_id: int,
+    current_user: CurrentUser = Depends(get_current_user_from_query),
+    db: Session = Depends(get_db)
+):
+    """Server-Sent Events stream of new notes, vitals and permission changes for a patient"""
+    permission = crud.check_access(patient_id, current_user.id, db)
+    if not permission:
+        raise HTTPException(status_code=403, detail="Access forbidden")
+
+    patient = crud.get_patient_by_id(patient_id, db)
+    is_owner = patient.physician_id == current_user.id
+    user_id = current_user.id
+    expires_at = current_user.expires_at
+    db.close() # Release the connection before the long-lived stream
+
+    async def stream():
+        subscription = hub.subscribe(patient_id, user_id, is_owner)
+        # Ends when the access token expires; the client reconnects with a fresh one
+        async for frame in event_stream(hub, subscription, expires_at):
+            yield frame
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get('/patients/{patient_id}/vitals', response_model=List[schemas.VitalsResponse])
 def get_vitals(
     patient_id: int,
-    current_user: models.Users = Depends(get_current_user),
+    request: Request,
+    format: str = Query("rows", enum=["rows", "columns", "binary"]),
+    current_user: CurrentUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all vitals for a patient"""
+    """Get all vitals for a patient.
+
+    `format=columns` returns parallel arrays (schemas.VitalsColumns) for charting;
+    `format=binary` is the same data packed as typed arrays (see responses.vitals_binary).
+    """
     permission = crud.check_access(patient_id, current_user.id, db)
     if not permission:
         raise HTTPException(status_code=403, detail="Access forbidden")
+
+    audit_log.record(current_user.id, patient_id, "view_vitals")
+    etag = patient_etag(crud.get_patient_by_id(patient_id, db), "vitals", format)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    if format == "columns":
+        columns = crud.get_patient_vitals_columns(patient_id, db)
+        return responses.from_orm(responses.VITALS_COLUMNS, columns, headers=cache_headers(etag))
+    if format == "binary":
+        columns = crud.get_patient_vitals_columns(patient_id, db)
+        return responses.vitals_binary(columns, headers=cache_headers(etag))
     
     vitals = crud.get_patient_vitals(patient_id, db)
-    return vitals
+    return responses.from_orm(responses.VITALS, vitals, headers=cache_headers(etag))
 
 # Voice transcription endpoint
-@app.post('/transcribe')
+@app.post('/transcribe', openapi_extra=audio.UPLOAD_OPENAPI)
 async def transcribe_audio(
-    file: UploadFile = File(...),
-    current_user: models.Users = Depends(get_current_user)
+    request: Request,
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """Transcribe audio using Sarvam AI API"""
-    import requests
-    import os
-    from dotenv import load_dotenv
-    
-    load_dotenv()
-    
-    sarvam_api_key = os.getenv("SARVAM_API_KEY")
-    sarvam_api_url = "https://api.sarvam.ai/speech-to-text"
+    sarvam_api_key = settings.sarvam_api_key
     
     if not sarvam_api_key:
         raise HTTPException(status_code=500, detail="Sarvam API key not configured")
     
     try:
-        audio_content = await file.read()
-        headers = {"api-subscription-key": sarvam_api_key}
-        files = {"file": ("audio.wav", audio_content, "audio/wav")}
-        data = {"model": "saarika:v2.5", "language_code": "hi-IN", "with_diarization": "false"}
+        upload = await audio.receive_upload(request)
+    except audio.UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"Recording is larger than {audio.MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    if upload is None:
+        raise HTTPException(status_code=422, detail="No audio file uploaded")
+    
+    params = (audio.SARVAM_MODEL, audio.SARVAM_LANGUAGE)
+    processing = False
+    audio_cached = False
+    
+    async def transcribe():
+        nonlocal processing, audio_cached
+        processing = True # From here the upload is read by this task, which may outlive the request
+        try:
+            # Decoding and resampling are CPU-bound (and ffmpeg is a subprocess); keep them off the event loop
+            chunks, duration = await run_in_threadpool(audio.prepare_chunks, upload.file, upload.filename, upload.content_type)
+        finally:
+            await upload.close()
         
-        response = requests.post(sarvam_api_url, headers=headers, files=files, data=data, timeout=30)
+        async def call_provider():
+            result = await audio.transcribe_chunks(chunks, sarvam_api_key)
+            result["duration_seconds"] = round(duration, 1)
+            return result
         
-        if response.status_code == 200:
-            result = response.json()
-            return {"text": result.get("transcript", ""), "status": "success", "language": result.get("language_code", "hi-IN")}
-        else:
-            return {"text": "", "status": "error", "error": f"Sarvam API error: {response.status_code}", "detail": response.text}
+        # The same audio in a different container, or re-encoded by the browser
+        audio_key = transcript_cache.content_key((chunk[1] for chunk in chunks), *params)
+        result, audio_cached = await transcripts.get_or_create(audio_key, call_provider)
+        return result
+    
+    try:
+        # A retried upload is byte-identical: answer it without decoding anything
+        upload_key = await run_in_threadpool(transcript_cache.file_key, upload.file, *params)
+        result, cached = await transcripts.get_or_create(upload_key, transcribe)
+        result["cached"] = cached or audio_cached
+        return result
             
     except Exception as e:
         print(f"Transcription failed: {str(e)}")
         return {"text": "", "status": "error", "error": str(e)}
+    finally:
+        if not processing:
+            await upload.close()
 
 # AI Consultation Analysis endpoint
 @app.post('/analyze-consultation', response_model=schemas.SOAPResponse)
 async def analyze_consultation(
     data: schemas.ConsultationAnalysis,
-    current_user: models.Users = Depends(get_current_user)
+    current_user: CurrentUser = Depends(get_current_user)
 ):
     """Generate SOAP notes from transcript using OpenAI"""
     from openai import OpenAI
-    import os
     import json
-    from dotenv import load_dotenv
     
-    load_dotenv()
-    openai_api_key = os.getenv("OPENAI_API_KEY")
+    openai_api_key = settings.openai_api_key
     
     if not openai_api_key:
         raise HTTPException(status_code=500, detail="OpenAI API key not configured")
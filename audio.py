@@ -0,0 +1,162 @@
+"""Audio preprocessing and chunked transcription for /transcribe.
+
+The upload is parsed straight off the request stream into a spooled temp file
+(memory up to 1 MB, then disk) and refused once it passes MAX_UPLOAD_BYTES.
+pydub/ffmpeg decode it to 16 kHz mono, which is all speech recognition uses,
+and long recordings are cut at pauses into chunks of at most MAX_CHUNK_MS
+(Sarvam's synchronous API takes 30 s per request). Chunks are transcribed
+concurrently, TRANSCRIBE_CONCURRENCY at a time, and joined back in order.
+
+Without ffmpeg only WAV can be decoded; other formats are then forwarded
+unprocessed as a single request, as before.
+"""
+import asyncio
+import io
+from typing import List, Optional, Tuple
+
+import httpx
+from fastapi import Request
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from config import settings
+
+SARVAM_API_URL = "https://api.sarvam.ai/speech-to-text"
+SARVAM_MODEL = settings.sarvam_model
+SARVAM_LANGUAGE = settings.sarvam_language
+
+MAX_UPLOAD_BYTES = settings.transcribe_max_upload_mb * 1024 * 1024
+SAMPLE_RATE = 16000
+MAX_CHUNK_MS = settings.transcribe_chunk_seconds * 1000
+MIN_CHUNK_MS = 5000 # Don't cut at a pause closer than this to the chunk start
+MIN_SILENCE_MS = 400
+SILENCE_BELOW_AVERAGE_DB = 16 # A pause is this much quieter than the recording's average
+TRANSCRIBE_CONCURRENCY = settings.transcribe_concurrency
+REQUEST_TIMEOUT = 30
+
+# Documents the multipart body that receive_upload parses by hand
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    }
+}
+
+class UploadTooLarge(Exception):
+    pass
+
+# Upload
+async def _limited(stream, max_bytes: int):
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadTooLarge()
+        yield chunk
+
+async def receive_upload(request: Request, field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES) -> Optional[UploadFile]:
+    """The uploaded file, spooled to disk as it arrives. Raises UploadTooLarge past `max_bytes`"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise UploadTooLarge() # Refuse before reading anything
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        return None
+    parser = MultiPartParser(request.headers, _limited(request.stream(), max_bytes), max_files=1, max_fields=10)
+    try:
+        form = await parser.parse()
+    except MultiPartException:
+        return None
+    upload = form.get(field)
+    return upload if isinstance(upload, UploadFile) else None
+
+# Decoding and chunking
+def _is_wav(file) -> bool:
+    header = file.read(12)
+    file.seek(0)
+    return header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+
+def decode(file):
+    """16 kHz mono 16-bit AudioSegment, or None if the format can't be decoded here"""
+    from pydub import AudioSegment
+    from pydub.exceptions import CouldntDecodeError
+
+    try:
+        # ffmpeg downmixes and resamples while decoding, so a long stereo 48 kHz
+        # recording never sits in memory at full size
+        audio = AudioSegment.from_file(file, parameters=["-ac", "1", "-ar", str(SAMPLE_RATE)])
+    except (CouldntDecodeError, FileNotFoundError, OSError):
+        file.seek(0)
+        if not _is_wav(file):
+            return None
+        audio = AudioSegment.from_file(file, format="wav") # pydub reads WAV without ffmpeg
+    return audio.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+
+def split_on_pauses(audio, max_ms: int = MAX_CHUNK_MS):
+    """Cut into pieces of at most `max_ms`, at the last pause before each limit where there is one"""
+    if len(audio) <= max_ms:
+        return [audio]
+    from pydub.silence import detect_silence
+
+    threshold = audio.dBFS - SILENCE_BELOW_AVERAGE_DB
+    pauses = detect_silence(audio, min_silence_len=MIN_SILENCE_MS, silence_thresh=threshold, seek_step=10)
+    cuts = [(start + end) // 2 for start, end in pauses]
+
+    pieces, start = [], 0
+    while len(audio) - start > max_ms:
+        candidates = [cut for cut in cuts if start + MIN_CHUNK_MS < cut <= start + max_ms]
+        cut = candidates[-1] if candidates else start + max_ms # No pause: hard cut
+        pieces.append(audio[start:cut])
+        start = cut
+    pieces.append(audio[start:])
+    # Pieces that are nothing but silence would only come back as empty transcripts
+    return [piece for piece in pieces if piece.rms and piece.dBFS > threshold] or pieces[:1]
+
+def prepare_chunks(file, filename: str, content_type: str) -> Tuple[List[Tuple[str, bytes, str]], float]:
+    """(filename, bytes, content type) per chunk, in order, and the duration in seconds (0 if unknown)"""
+    audio = decode(file)
+    if audio is None:
+        file.seek(0)
+        return [(filename or "audio", file.read(), content_type or "application/octet-stream")], 0.0
+
+    chunks = []
+    for index, piece in enumerate(split_on_pauses(audio)):
+        buffer = io.BytesIO()
+        piece.export(buffer, format="wav")
+        chunks.append((f"chunk-{index:03d}.wav", buffer.getvalue(), "audio/wav"))
+    return chunks, len(audio) / 1000
+
+# Transcription
+async def transcribe_chunks(chunks: List[Tuple[str, bytes, str]], api_key: str) -> dict:
+    """Transcribe chunks concurrently and join the text in chunk order"""
+    semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+    headers = {"api-subscription-key": api_key}
+    data = {"model": SARVAM_MODEL, "language_code": SARVAM_LANGUAGE, "with_diarization": "false"}
+
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
+        async def transcribe_one(chunk):
+            async with semaphore:
+                response = await client.post(SARVAM_API_URL, headers=headers, files={"file": chunk}, data=data)
+                if response.status_code == 429 or response.status_code >= 500:
+                    # Rate limited or a blip upstream: one retry
+                    await asyncio.sleep(1)
+                    response = await client.post(SARVAM_API_URL, headers=headers, files={"file": chunk}, data=data)
+                return response
+
+        responses = await asyncio.gather(*(transcribe_one(chunk) for chunk in chunks))
+
+    failed = next((r for r in responses if r.status_code != 200), None)
+    if failed is not None:
+        return {"text": "", "status": "error", "error": f"Sarvam API error: {failed.status_code}", "detail": failed.text}
+
+    results = [r.json() for r in responses]
+    text = " ".join(result.get("transcript", "").strip() for result in results)
+    return {
+        "text": " ".join(text.split()),
+        "status": "success",
+        "language": results[0].get("language_code", SARVAM_LANGUAGE) if results else SARVAM_LANGUAGE,
+        "chunks": len(chunks),
+    }
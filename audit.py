@@ -0,0 +1,153 @@
+"""Write-behind audit trail of who viewed or changed which patient.
+
+record() appends the event to this worker's in-memory buffer and returns, so
+the request path never waits on the database. A background thread writes the
+buffer out in one transaction every FLUSH_SECONDS, or as soon as FLUSH_SIZE
+events are waiting, as a single executemany INSERT (batched multi-row VALUES
+on Postgres). Each event keeps the time it was recorded, not flushed.
+
+stop() at app shutdown, and an atexit hook for any other clean exit, flush
+what is left; a crash loses at most the last FLUSH_SECONDS of events. While
+the database is unavailable events stay buffered and are retried; past
+MAX_BUFFERED the oldest are dropped and counted rather than growing without
+bound.
+"""
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import insert
+
+import models
+from config import settings
+from database import SessionLocal
+
+FLUSH_SECONDS = settings.audit_flush_seconds
+FLUSH_SIZE = settings.audit_flush_size
+MAX_BUFFERED = settings.audit_max_buffered
+
+# What an event records; also the values the audit endpoints filter on
+ACTIONS = (
+    "view", "view_notes", "view_vitals", "report", "export",
+    "add_note", "add_vitals", "share", "revoke",
+)
+
+class AuditLog:
+    """This worker's buffer of audit events not yet written"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One writer at a time keeps events in order
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        atexit.register(self.stop)
+
+    def record(self, user_id: int, patient_id: int, action: str, detail: Optional[str] = None):
+        """Buffer one event; never touches the database"""
+        self.record_many(user_id, [patient_id], action, detail)
+
+    def record_many(self, user_id: int, patient_ids: Iterable[int], action: str, detail: Optional[str] = None):
+        """Buffer the same action on several patients"""
+        now = datetime.utcnow()
+        events = [
+            {"user_id": user_id, "patient_id": patient_id, "action": action, "detail": detail, "created_at": now}
+            for patient_id in patient_ids
+        ]
+        self._ensure_started()
+        with self._lock:
+            self._buffer.extend(events)
+            self.recorded += len(events)
+            self._trim()
+            full = len(self._buffer) >= FLUSH_SIZE
+        if full:
+            self._wake.set()
+
+    def _trim(self):
+        # Caller holds _lock
+        while len(self._buffer) > MAX_BUFFERED:
+            self._buffer.popleft()
+            self.dropped += 1
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def flush(self) -> int:
+        """Write out everything buffered so far; returns how many events were written"""
+        with self._flush_lock:
+            with self._lock:
+                events = list(self._buffer)
+                self._buffer.clear()
+            if not events:
+                return 0
+            try:
+                with self._session_factory.begin() as db:
+                    db.execute(insert(models.AuditEvents.__table__), events)
+            except Exception:
+                # Put them back in front of anything recorded meanwhile, to retry next round
+                with self._lock:
+                    self._buffer.extendleft(reversed(events))
+                    self._trim()
+                raise
+            self.flushed += len(events)
+            return len(events)
+
+    # Background flushing
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Started on first use, so a gunicorn master that preloads the app never owns the thread
+            self._stop.clear()
+            self._wake.clear() # Left set by a stop() with no thread to consume it
+            self._thread = threading.Thread(target=self._run, name="audit-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # Database unavailable: events stay buffered; back off before the next attempt
+                print(f"Audit flush failed: {e}")
+                self._stop.wait(FLUSH_SECONDS)
+
+    def stop(self):
+        """Stop the flusher and write out what is left"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=FLUSH_SECONDS + 10)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Audit flush at shutdown failed, {self.pending} events lost: {e}")
+
+audit_log = AuditLog()
+
+def render_metrics() -> str:
+    """Buffer counters in the Prometheus text format"""
+    lines = []
+    for name, kind, help_text, value in (
+        ("recorded_total", "counter", "Audit events recorded", audit_log.recorded),
+        ("flushed_total", "counter", "Audit events written to the database", audit_log.flushed),
+        ("dropped_total", "counter", "Audit events dropped from a full buffer", audit_log.dropped),
+        ("pending", "gauge", "Audit events waiting to be written", audit_log.pending),
+    ):
+        lines.append(f"# HELP vm_audit_{name} {help_text}")
+        lines.append(f"# TYPE vm_audit_{name} {kind}")
+        lines.append(f"vm_audit_{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,35 +1,53 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional
+import hashlib
+import secrets
+import uuid
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from database import get_db
-import models
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import models, utils
+from revocation import revocations
+from config import settings
 
 # JWT Configuration
-SECRET_KEY = os.getenv("SECRET_KEY", "vridhamitra_super_secret_key_change_in_production")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "43200"))  # 30 days
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+SECRET_KEY = settings.secret_key
+ALGORITHM = settings.algorithm
+# Access tokens are checked without a database query, so keep them short; refresh tokens renew them
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+REFRESH_TOKEN_EXPIRE_DAYS = settings.refresh_token_expire_days
+# Two tabs refreshing at once both present the same token; within this window that is not treated as theft
+REFRESH_REUSE_GRACE_SECONDS = settings.refresh_reuse_grace_seconds
 
 # HTTP Bearer token scheme
 security = HTTPBearer()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
-    return pwd_context.verify(plain_password, hashed_password)
+    return utils.verify_password(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
     """Hash a password"""
-    return pwd_context.hash(password)
+    return utils.hash_password(password)
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password in the hashing process pool"""
+    return await utils.hash_password_async(password)
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """The authenticated user, read from the access token's claims rather than the database"""
+    id: int
+    email: str
+    role: str
+    name: str
+    token_id: str
+    family_id: Optional[str]
+    expires_at: datetime
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
@@ -40,7 +58,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    # jti identifies this token for revocation
+    to_encode.update({"exp": expire, "iat": datetime.utcnow(), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -59,51 +78,153 @@ def decode_access_token(token: str) -> dict:
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
-) -> models.Users:
+) -> CurrentUser:
     """Get the current authenticated user from JWT token"""
-    token = credentials.credentials
-    
-    try:
-        payload = decode_access_token(token)
-        user_id_str = payload.get("sub")
-        
-        if user_id_str is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
-        # Convert string back to int
-        user_id = int(user_id_str)
-        
+    return get_user_from_token(credentials.credentials, db)
 
-    except JWTError:
+def get_current_user_from_query(
+    token: str = Query(...),
+    db: Session = Depends(get_db)
+) -> CurrentUser:
+    """Same as get_current_user, for clients that cannot set headers (EventSource)"""
+    return get_user_from_token(token, db)
+
+def get_user_from_token(token: str, db: Session) -> CurrentUser:
+    """Resolve the user a JWT token belongs to.
+
+    Only signature, expiry and the in-memory revocation filter are checked; `db`
+    is touched only when the filter reports a possible revocation.
+    """
+    payload = decode_access_token(token)
+    user_id_str = payload.get("sub")
+    token_id = payload.get("jti")
+    
+    # Tokens without a jti predate revocation support and can't be revoked
+    if user_id_str is None or token_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user = db.query(models.Users).filter(models.Users.id == user_id).first()
-    
-    if user is None:
+    family_id = payload.get("fam")
+    if revocations.is_revoked((token_id, family_id), db):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
+            detail="Token has been revoked",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return user
+    return CurrentUser(
+        id=int(user_id_str), # Convert string back to int
+        email=payload.get("email"),
+        role=payload.get("role"),
+        name=payload.get("name"),
+        token_id=token_id,
+        family_id=family_id,
+        expires_at=datetime.utcfromtimestamp(payload["exp"]),
+    )
+
+def hash_refresh_token(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+def issue_tokens(user: models.Users, db: Session, family_id: Optional[str] = None) -> dict:
+    """Access token plus a new refresh token in `family_id` (a new family on login)"""
+    family_id = family_id or uuid.uuid4().hex
+    refresh_token = secrets.token_urlsafe(32)
+    db.add(models.RefreshTokens(
+        user_id=user.id,
+        token_hash=hash_refresh_token(refresh_token),
+        family_id=family_id,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    db.commit()
+
+    access_token = create_access_token(
+        data={"sub": str(user.id), "email": user.email, "role": user.role, "name": user.name, "fam": family_id}
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+def revoke_family(family_id: str, db: Session):
+    """Log out a whole login session: its refresh tokens and every access token issued from them"""
+    now = datetime.utcnow()
+    db.query(models.RefreshTokens).filter(
+        models.RefreshTokens.family_id == family_id,
+        models.RefreshTokens.revoked_at.is_(None),
+    ).update({models.RefreshTokens.revoked_at: now}, synchronize_session=False)
+    # Access tokens carry their family id, so one entry covers all of them until they expire
+    revocations.revoke([family_id], now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES), db)
+    db.commit()
+
+def refresh_tokens(refresh_token: str, db: Session):
+    """Rotate a refresh token: returns (user, new tokens). Reusing an already rotated token revokes its family"""
+    invalid = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    now = datetime.utcnow()
+    stored = db.query(models.RefreshTokens).filter(
+        models.RefreshTokens.token_hash == hash_refresh_token(refresh_token)
+    ).with_for_update().first()
+    if stored is None or stored.revoked_at is not None or stored.expires_at <= now:
+        raise invalid
 
-def authenticate_user(email: str, password: str, db: Session) -> Optional[models.Users]:
-    """Authenticate a user with email and password"""
-    user = db.query(models.Users).filter(models.Users.email == email).first()
+    if stored.used_at is not None:
+        if now - stored.used_at > timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS):
+            # Someone else holds a copy of this token: end the session everywhere
+            revoke_family(stored.family_id, db)
+        raise invalid
+
+    stored.used_at = now
+    user = db.get(models.Users, stored.user_id)
+    if user is None:
+        raise invalid
+    # Role or name changes take effect here, at the latest ACCESS_TOKEN_EXPIRE_MINUTES after they are made
+    return user, issue_tokens(user, db, stored.family_id)
+
+def logout(current_user: CurrentUser, refresh_token: Optional[str], db: Session):
+    """Revoke the caller's access token and, through its family, the refresh token that came with it"""
+    if current_user.family_id:
+        revoke_family(current_user.family_id, db)
+    else:
+        revocations.revoke([current_user.token_id], current_user.expires_at, db)
+        db.commit()
+    if refresh_token:
+        stored = db.query(models.RefreshTokens).filter(
+            models.RefreshTokens.token_hash == hash_refresh_token(refresh_token)
+        ).first()
+        if stored is not None and stored.user_id == current_user.id and stored.family_id != current_user.family_id:
+            revoke_family(stored.family_id, db)
+
+async def authenticate_user(email: str, password: str, db: Session) -> Optional[models.Users]:
+    """Authenticate a user with email and password, upgrading an outdated hash on success"""
+    def lookup():
+        user = db.query(models.Users).filter(models.Users.email == email).first()
+        # Hand the pooled connection back while the hash is checked; the user stays loaded
+        db.close()
+        return user
+    user = await run_in_threadpool(lookup)
     
     if not user:
         return None
     
-    if not verify_password(password, user.hashed_password):
+    # Verification runs in the hashing process pool, not the request threadpool
+    valid, new_hash = await utils.verify_and_update_async(password, user.hashed_password)
+    if not valid:
         return None
+
+    if new_hash:
+        # e.g. bcrypt -> argon2, or a raised cost
+        def save():
+            db.query(models.Users).filter(models.Users.id == user.id).update({models.Users.hashed_password: new_hash})
+            db.commit()
+        await run_in_threadpool(save)
+        user.hashed_password = new_hash
     
     return user
@@ -0,0 +1,110 @@
+"""Anomaly scan time for a clinic-sized vitals table: a first full scan, then an incremental one.
+
+Fills a throwaway SQLite database (or DATABASE_URL, which must be empty) with
+PATIENTS patients and READINGS readings each over the last month, 1% of
+them steadily deteriorating, then times:
+
+- full scan: every reading in the window
+- incremental scan: after 1% of patients get one new reading each
+- loading and detection (NumPy, no database) for one chunk
+
+and counts how many deteriorating and how many stable patients the full scan flagged.
+
+    python benchmarks/bench_anomaly.py [--patients 100000] [--readings 10] [--chunk-size 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def fill(engine, patients: int, readings: int):
+    from sqlalchemy import insert
+    import models
+
+    rng = random.Random(42)
+    now = datetime.utcnow() - timedelta(hours=1)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Users).values(id=1, name="Bench", email="bench@example.com", hashed_password="-", role="physician"))
+        conn.execute(insert(models.Patients), [
+            {"id": i, "name": f"Patient {i}", "phone_number": f"9{i:09d}", "membership_price": 0, "physician_id": 1}
+            for i in range(1, patients + 1)
+        ])
+    batch = []
+    for patient in range(1, patients + 1):
+        worsening = patient % 100 == 0
+        for r in range(readings):
+            drift = r * 4 if worsening else 0
+            batch.append({
+                "patient_id": patient, "physician_id": 1,
+                "created_at": now - timedelta(days=30 * (readings - r) / readings),
+                "systolic_bp": int(rng.gauss(125, 8)) + drift, "diastolic_bp": int(rng.gauss(80, 5)),
+                "heart_rate": int(rng.gauss(75, 6)) + drift, "temperature": round(rng.gauss(98.4, 0.4), 1),
+                "spo2": min(100, int(rng.gauss(97, 1))) - drift // 4,
+            })
+        if len(batch) >= 50_000:
+            with engine.begin() as conn:
+                conn.execute(insert(models.Vitals), batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(insert(models.Vitals), batch)
+
+def add_new_readings(engine, patients: int):
+    from sqlalchemy import insert
+    import models
+
+    rows = [{"patient_id": p, "physician_id": 1, "created_at": datetime.utcnow() - timedelta(minutes=5),
+             "systolic_bp": 185, "heart_rate": 120, "spo2": 90, "temperature": 101.0}
+            for p in range(1, patients + 1, 100)]
+    with engine.begin() as conn:
+        conn.execute(insert(models.Vitals), rows)
+    return len(rows)
+
+def main(patients: int, readings: int, chunk_size: int):
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    from database import engine
+    from sqlalchemy import select
+    import anomaly, migrate, models
+
+    migrate.init_schema(engine)
+    started = time.perf_counter()
+    fill(engine, patients, readings)
+    print(f"filled {patients} patients x {readings} readings in {time.perf_counter() - started:.1f}s")
+
+    summary = anomaly.scan(engine, chunk_size=chunk_size)
+    with engine.connect() as conn:
+        flagged = set(conn.execute(select(models.Alerts.patient_id).distinct()).scalars())
+    worsening = {p for p in range(100, patients + 1, 100)}
+    print(f"full scan          {summary['seconds']:>6.2f}s  {summary['readings']} readings, {summary['alerts']} alerts")
+    print(f"  flagged {len(flagged & worsening)} of {len(worsening)} deteriorating patients, "
+          f"{len(flagged - worsening)} of {patients - len(worsening)} stable ones")
+
+    added = add_new_readings(engine, patients)
+    summary = anomaly.scan(engine, chunk_size=chunk_size)
+    print(f"incremental scan   {summary['seconds']:>6.2f}s  {added} new readings ({summary['readings']} read with history), "
+          f"{summary['alerts']} alerts")
+
+    since = datetime.utcnow() - timedelta(days=anomaly.WINDOW_DAYS)
+    with engine.connect() as conn:
+        last_id = conn.execute(select(models.Vitals.id).order_by(models.Vitals.id.desc()).limit(1)).scalar()
+        started = time.perf_counter()
+        chunk = anomaly.load_chunk(conn, list(range(1, chunk_size + 1)), since, 0, last_id, True)
+        loaded = time.perf_counter() - started
+    started = time.perf_counter()
+    anomaly.detect(chunk, 0)
+    detected = time.perf_counter() - started
+    print(f"one chunk of {chunk_size} patients: load {loaded * 1000:.0f} ms, detect {detected * 1000:.0f} ms "
+          f"({len(chunk['ids'])} readings)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=100_000)
+    parser.add_argument("--readings", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.patients, args.readings, args.chunk_size)
@@ -0,0 +1,93 @@
+"""Cost of auditing on the read path: write-behind buffer against no audit and a synchronous insert.
+
+Runs the app in-process on a throwaway SQLite database (or DATABASE_URL, which
+must be empty) and times REQUESTS calls of GET /patients/{id} in each mode:
+
+- off: audit_log.record does nothing (the baseline)
+- synchronous: every event is inserted and committed before the response
+- write-behind: the real audit_log, flushed in the background
+
+then the bare cost of one record() call and how fast flush() writes a full buffer.
+
+    python benchmarks/bench_audit.py [--requests 2000] [--events 100000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main(requests: int, events: int):
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    os.environ.setdefault("WARMUP", "0")
+    from fastapi.testclient import TestClient
+    from sqlalchemy import insert
+    import app as application
+    import audit, models
+    from database import engine
+
+    def synchronous(user_id, patient_id, action, detail=None):
+        with engine.begin() as conn:
+            conn.execute(insert(models.AuditEvents.__table__).values(
+                user_id=user_id, patient_id=patient_id, action=action, detail=detail, created_at=datetime.utcnow()
+            ))
+
+    real = audit.audit_log.record
+    modes = {"off": lambda *args, **kwargs: None, "synchronous": synchronous, "write-behind": real}
+
+    with TestClient(application.app) as client:
+        client.post("/register_user", json={
+            "name": "Bench", "email": "bench@example.com", "password": "bench-password", "role": "physician"
+        })
+        login = client.post("/login", json={"email": "bench@example.com", "password": "bench-password"}).json()
+        headers = {"Authorization": f"Bearer {login['access_token']}"}
+        patient = client.post("/register_patient", headers=headers, json={
+            "name": "Bench Patient", "phone_number": "9000000000", "membership_price": 0, "physician_id": 0
+        }).json()
+        path = f"/patients/{patient['id']}"
+
+        print(f"GET {path}, {requests} requests per mode; latencies in ms")
+        print(f"{'mode':<14} {'p50':>7} {'p95':>7} {'p99':>7} {'req/s':>8}")
+        for mode, record in modes.items():
+            audit.audit_log.record = record
+            for _ in range(50):
+                client.get(path, headers=headers)
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(requests):
+                began = time.perf_counter()
+                client.get(path, headers=headers).raise_for_status()
+                latencies.append(time.perf_counter() - began)
+            elapsed = time.perf_counter() - started
+            print(f"{mode:<14} {percentile(latencies, 0.5) * 1000:>7.2f} {percentile(latencies, 0.95) * 1000:>7.2f}"
+                  f" {percentile(latencies, 0.99) * 1000:>7.2f} {requests / elapsed:>8.0f}")
+        audit.audit_log.record = real
+        audit.audit_log.flush()
+
+    # The buffer on its own, without the flusher racing it
+    log = audit.AuditLog()
+    log._ensure_started = lambda: None
+    started = time.perf_counter()
+    for i in range(events):
+        log.record(1, i, "view")
+    per_record = (time.perf_counter() - started) / events
+    started = time.perf_counter()
+    log.flush()
+    flush_seconds = time.perf_counter() - started
+    print(f"record(): {per_record * 1e6:.2f} us per event")
+    print(f"flush(): {events} events in {flush_seconds:.2f}s ({events / flush_seconds:,.0f} events/s)")
+    print(f"recorded {audit.audit_log.recorded}, flushed {audit.audit_log.flushed}, dropped {audit.audit_log.dropped}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+    main(args.requests, args.events)
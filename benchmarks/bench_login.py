@@ -0,0 +1,91 @@
+"""Logins/sec under concurrency, and how much a login burst slows other API requests.
+
+Starts the app with uvicorn on a throwaway SQLite database, then runs
+CONCURRENCY parallel login loops for DURATION seconds while a probe loop
+keeps calling GET /users/{id}/patients and records its latency.
+
+    python benchmarks/bench_login.py [--concurrency 64] [--duration 10] [--app-dir .]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+PORT = 8766
+
+async def wait_for_server(client: httpx.AsyncClient):
+    for _ in range(100):
+        try:
+            await client.get("/docs")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("server did not start")
+
+async def login_loop(client: httpx.AsyncClient, deadline: float, counts: dict):
+    while time.monotonic() < deadline:
+        response = await client.post("/login", json={"email": "bench@example.com", "password": "bench-password"})
+        counts["ok" if response.status_code == 200 else "failed"] += 1
+
+async def probe_loop(client: httpx.AsyncClient, deadline: float, headers: dict, user_id: int, latencies: list):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        await client.get(f"/users/{user_id}/patients", headers=headers)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+
+async def main(concurrency: int, duration: float):
+    limits = httpx.Limits(max_connections=concurrency + 8)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", timeout=120, limits=limits) as client:
+        await wait_for_server(client)
+        await client.post("/register_user", json={
+            "name": "Bench", "email": "bench@example.com", "password": "bench-password", "role": "physician"
+        })
+        login = (await client.post("/login", json={"email": "bench@example.com", "password": "bench-password"})).json()
+        headers = {"Authorization": f"Bearer {login['access_token']}"}
+
+        idle = []
+        await probe_loop(client, time.monotonic() + 2, headers, login["user"]["id"], idle)
+
+        counts = {"ok": 0, "failed": 0}
+        busy = []
+        deadline = time.monotonic() + duration
+        started = time.monotonic()
+        await asyncio.gather(
+            probe_loop(client, deadline, headers, login["user"]["id"], busy),
+            *(login_loop(client, deadline, counts) for _ in range(concurrency)),
+        )
+        elapsed = time.monotonic() - started
+
+    def ms(values, q):
+        return statistics.quantiles(values, n=100)[q - 1] * 1000 if len(values) > 1 else float("nan")
+
+    print(f"concurrency {concurrency}, {elapsed:.1f}s, {os.cpu_count()} cores")
+    print(f"logins/sec               {counts['ok'] / elapsed:8.1f}   (failed: {counts['failed']})")
+    print(f"probe p50 / p95 idle     {ms(idle, 50):8.1f} / {ms(idle, 95):.1f} ms")
+    print(f"probe p50 / p95 in burst {ms(busy, 50):8.1f} / {ms(busy, 95):.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--app-dir", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(PORT), "--log-level", "warning"],
+        cwd=args.app_dir, env=env,
+    )
+    try:
+        asyncio.run(main(args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
@@ -0,0 +1,80 @@
+"""Serialise a 10k-note payload the old way and through responses.py, with and without compression.
+
+    python benchmarks/bench_serialization.py
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite:////tmp/bench.db") # Nothing is queried; models just need an engine
+
+from fastapi.encoders import jsonable_encoder
+
+import compression, models, responses
+
+NOTE_COUNT = 10_000
+ROUNDS = 5
+
+def make_notes():
+    author = models.Users(id=1, name="Dr. Sharma", email="sharma@example.com", role="physician")
+    start = datetime(2025, 1, 1)
+    return [
+        models.Notes(
+            id=i, physician_id=1, patient_id=1, author=author,
+            chief_complaint="Knee pain / घुटने में दर्द",
+            subjective="Pain on climbing stairs for two weeks, worse in the morning. सुबह दर्द ज़्यादा होता है।",
+            objective="Mild effusion, ROM 0-110, quadriceps weakness 4/5.",
+            assessment="Early osteoarthritis, right knee.",
+            plan="Quadriceps strengthening, heat therapy, review in 2 weeks.",
+            raw_notes="Patient reports knee pain while climbing stairs " * 3,
+            created_at=start + timedelta(minutes=i),
+        )
+        for i in range(NOTE_COUNT)
+    ]
+
+def old_path(notes) -> bytes:
+    """Hand-built dicts -> jsonable_encoder -> json.dumps, as get_notes did through JSONResponse"""
+    payload = [{
+        "id": note.id,
+        "physician_id": note.physician_id,
+        "physician_name": note.author.name,
+        "patient_id": note.patient_id,
+        "chief_complaint": note.chief_complaint,
+        "subjective": note.subjective,
+        "objective": note.objective,
+        "assessment": note.assessment,
+        "plan": note.plan,
+        "raw_notes": note.raw_notes,
+        "created_at": note.created_at.isoformat()
+    } for note in notes]
+    content = jsonable_encoder(payload)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def new_path(notes) -> bytes:
+    return responses.from_orm(responses.NOTES, notes).body
+
+def timed(label, fn):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    print(f"{label:<28} {best * 1000:8.1f} ms")
+    return result
+
+if __name__ == "__main__":
+    notes = make_notes()
+    print(f"{NOTE_COUNT} notes, best of {ROUNDS}")
+    old = timed("jsonable_encoder + json", lambda: old_path(notes))
+    new = timed("TypeAdapter.dump_json", lambda: new_path(notes))
+    assert json.loads(old) == json.loads(new)
+
+    gzipped = timed("gzip (level 6)", lambda: compression.compress(new, "gzip"))
+    print(f"{'identity size':<28} {len(new) / 1024:8.1f} KiB")
+    print(f"{'gzip size':<28} {len(gzipped) / 1024:8.1f} KiB")
+    if compression.brotli is not None:
+        brotlied = timed("brotli (quality 5)", lambda: compression.compress(new, "br"))
+        print(f"{'brotli size':<28} {len(brotlied) / 1024:8.1f} KiB")
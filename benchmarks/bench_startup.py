@@ -0,0 +1,136 @@
+"""Startup time, per-worker memory and first-request latency of each server mode.
+
+Starts the app on a throwaway SQLite database in each mode, waits until every
+worker has finished its startup, and reports:
+
+- ready: seconds from launch until all workers accept requests
+- RSS / USS / PSS per worker (Linux; PSS counts shared pages fractionally, so it
+  shows what preloading saves), and total PSS including the gunicorn master
+- first report: the slowest of one concurrent /report request per worker,
+  against the median of the requests after it (lazy imports land on the first)
+
+    python benchmarks/bench_startup.py [--workers 4] [--app-dir .]
+
+Modes: uvicorn without warmup (the old behaviour), uvicorn with warmup,
+gunicorn without preload and gunicorn with preload (the production config).
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import psutil
+
+PORT = 8767
+
+def launch(mode: str, workers: int, app_dir: str):
+    database = os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database}", HASH_WORKERS="1")
+    if mode == "uvicorn, no warmup":
+        env["WARMUP"] = "0"
+    if mode.startswith("uvicorn"):
+        command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(PORT)]
+        workers = 1
+    else:
+        env.update(WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{PORT}",
+                   GUNICORN_PRELOAD="1" if mode == "gunicorn, preload" else "0")
+        command = [sys.executable, "-m", "gunicorn", "app:app", "-c", "gunicorn.conf.py"]
+
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=app_dir, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+    ready = threading.Event()
+    count = [0]
+
+    def watch():
+        for line in server.stderr:
+            if "Application startup complete" in line:
+                count[0] += 1
+                if count[0] == workers:
+                    ready.set()
+
+    threading.Thread(target=watch, daemon=True).start()
+    if not ready.wait(120):
+        server.kill()
+        raise RuntimeError(f"{mode}: server did not start")
+    return server, time.perf_counter() - started, workers
+
+def worker_processes(mode: str, server) -> list:
+    master = psutil.Process(server.pid)
+    # uvicorn serves from the launched process, gunicorn from its direct children.
+    # Their own children are password hashing pools, not web workers
+    if mode.startswith("gunicorn"):
+        return master.children()
+    return [master]
+
+def memory(process) -> dict:
+    info = process.memory_full_info()
+    return {"rss": info.rss, "uss": info.uss, "pss": getattr(info, "pss", 0)}
+
+def report_latencies(workers: int) -> tuple:
+    base = f"http://127.0.0.1:{PORT}"
+    with httpx.Client(base_url=base, timeout=120) as client:
+        client.post("/register_user", json={
+            "name": "Bench", "email": "bench@example.com", "password": "bench-password", "role": "physician"
+        })
+        login = client.post("/login", json={"email": "bench@example.com", "password": "bench-password"}).json()
+        headers = {"Authorization": f"Bearer {login['access_token']}"}
+        patient = client.post("/register_patient", headers=headers, json={
+            "name": "Bench Patient", "phone_number": "9000000000", "membership_price": 0, "physician_id": 0
+        }).json()
+        path = f"/patients/{patient['id']}/report"
+
+    first = []
+    def fetch():
+        # A fresh connection each, so the kernel spreads them over the workers
+        with httpx.Client(base_url=base, timeout=120) as own:
+            began = time.perf_counter()
+            own.get(path, headers=headers).raise_for_status()
+            first.append(time.perf_counter() - began)
+
+    threads = [threading.Thread(target=fetch) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    after = []
+    with httpx.Client(base_url=base, timeout=120) as client:
+        for _ in range(10):
+            began = time.perf_counter()
+            client.get(path, headers=headers).raise_for_status()
+            after.append(time.perf_counter() - began)
+    return max(first), statistics.median(after)
+
+def run(mode: str, workers: int, app_dir: str):
+    server, ready, workers = launch(mode, workers, app_dir)
+    try:
+        processes = worker_processes(mode, server)
+        per_worker = [memory(process) for process in processes]
+        total_pss = sum(m["pss"] for m in per_worker)
+        if processes[0].pid != server.pid:
+            total_pss += memory(psutil.Process(server.pid))["pss"]
+        first, warm = report_latencies(workers)
+    finally:
+        server.terminate()
+        server.wait()
+
+    mb = lambda key: statistics.mean(m[key] for m in per_worker) / 1024 / 1024
+    print(f"{mode:<22} {workers:>3} {ready:>7.2f}s {mb('rss'):>8.1f} {mb('uss'):>8.1f} {mb('pss'):>8.1f}"
+          f" {total_pss / 1024 / 1024:>10.1f} {first * 1000:>10.0f} {warm * 1000:>8.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--app-dir", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} cores; memory in MB per worker, latencies in ms")
+    print(f"{'mode':<22} {'wrk':>3} {'ready':>8} {'RSS':>8} {'USS':>8} {'PSS':>8} {'total PSS':>10} {'1st report':>10} {'report':>8}")
+    for mode in ("uvicorn, no warmup", "uvicorn", "gunicorn, no preload", "gunicorn, preload"):
+        run(mode, args.workers, args.app_dir)
@@ -0,0 +1,110 @@
+"""Response compression negotiated per request (brotli when installed, else gzip).
+
+Only complete, single-body responses above a size threshold are compressed.
+Streaming responses (SSE, PDF reports, exports) pass through untouched so they
+are never buffered. Large bodies are compressed in the threadpool so the event
+loop keeps serving other requests meanwhile.
+"""
+import gzip
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError: # Optional; gzip is always available
+    brotli = None
+
+MINIMUM_SIZE = 1024 # Smaller bodies gain less than the headers and CPU cost
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # Dynamic content: close to gzip -9 size at gzip -6 speed
+THREAD_MINIMUM_SIZE = 64 * 1024 # Around a millisecond of compression; below it a thread hop costs more
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/javascript", "application/x-ndjson",
+    "image/svg+xml", "text/css", "text/csv", "text/html", "text/javascript", "text/plain",
+)
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Encoding -> q value from an Accept-Encoding header"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    return accepted
+
+def negotiate(accept_encoding: str) -> str:
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, or '' for identity"""
+    accepted = accepted_encodings(accept_encoding)
+
+    def q_of(encoding):
+        return accepted.get(encoding, accepted.get("*", 0.0))
+
+    if brotli is not None and q_of("br") > 0 and q_of("br") >= q_of("gzip"):
+        return "br"
+    if q_of("gzip") > 0:
+        return "gzip"
+    return ""
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message # Held back until the body shows whether to compress
+                return
+            if start_message is None: # Already decided; rest of a streamed body
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            compressible = headers.get("content-type", "").split(";")[0].strip() in COMPRESSIBLE_TYPES
+            if compressible and "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+
+            if (
+                not encoding or not compressible or message.get("more_body")
+                or "content-encoding" in headers or len(body) < self.minimum_size
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= THREAD_MINIMUM_SIZE:
+                body = await run_in_threadpool(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                # Different bytes than the identity representation, same semantics
+                headers["ETag"] = "W/" + etag
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,137 @@
+"""Settings read from the environment (and .env) once, at import.
+
+Modules take what they need from `settings` instead of calling load_dotenv()
+and os.getenv() themselves, so configuration is resolved in one place, and in
+the gunicorn master before workers fork. The exceptions are gunicorn.conf.py,
+which gunicorn reads before the app, and the TEST_* variables of testing.py.
+"""
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+def _flag(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ("0", "false", "no", "off", "")
+
+def _int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+def _float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+CPUS = os.cpu_count() or 2
+
+@dataclass(frozen=True)
+class Settings:
+    database_url: str
+    shard_urls: Tuple[str, ...] # Shards besides database_url (see sharding.py); empty: one database
+    secret_key: str
+    algorithm: str
+    access_token_expire_minutes: int
+    refresh_token_expire_days: int
+    refresh_reuse_grace_seconds: int
+    sarvam_api_key: Optional[str]
+    openai_api_key: Optional[str]
+    auto_migrate: bool # Create/upgrade the schema at startup; off when a deploy step or the gunicorn master does it
+    warmup: bool # Import heavy libraries and start the hashing pool before serving
+    metrics_token: Optional[str] # Bearer token for /metrics; unset: only loopback clients may scrape it
+
+    # Password hashing (utils.py)
+    argon2_time_cost: int
+    argon2_memory_cost: int # KiB
+    argon2_parallelism: int # Cores come from the pool instead
+    bcrypt_rounds: int
+    hash_workers: int
+    hash_nice: int # Lower priority than the API processes on a saturated host
+    hash_max_pending: int # Beyond this, callers wait
+
+    # Transcription (audio.py, transcript_cache.py)
+    sarvam_model: str
+    sarvam_language: str
+    transcribe_max_upload_mb: int
+    transcribe_chunk_seconds: int
+    transcribe_concurrency: int
+    transcript_cache_dir: str
+    transcript_cache_ttl_hours: float
+    transcript_cache_max_mb: int
+
+    # Reports (reports.py)
+    report_workers: int
+    report_nice: int # Below the API processes, like password hashing
+    report_batch_max_patients: int
+
+    # Background work and caches
+    revocation_sync_seconds: float
+    revocation_rebuild_seconds: float
+    audit_flush_seconds: float
+    audit_flush_size: int
+    audit_max_buffered: int
+    entity_cache_ttl_seconds: float
+    entity_cache_max_entries: int # Per model
+
+    # Storage layout
+    shard_id_span: int # Ids per shard; 21 shards fit in a 32-bit id
+    shard_fan_out_workers: int
+    partition_months_ahead: int
+    archive_after_months: int
+    archive_tablespace: Optional[str] # Unset: archived partitions stay where they are
+    static_build_dir: str
+
+    admission: Dict[str, str] # ADMISSION_<LANE>_<SETTING> overrides, read by admission.py
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        load_dotenv()
+        return cls(
+            database_url=os.getenv("DATABASE_URL"),
+            shard_urls=tuple(url.strip() for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()),
+            secret_key=os.getenv("SECRET_KEY", "vridhamitra_super_secret_key_change_in_production"),
+            algorithm=os.getenv("ALGORITHM", "HS256"),
+            access_token_expire_minutes=int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15")),
+            refresh_token_expire_days=int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30")),
+            refresh_reuse_grace_seconds=int(os.getenv("REFRESH_REUSE_GRACE_SECONDS", "10")),
+            sarvam_api_key=os.getenv("SARVAM_API_KEY"),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            auto_migrate=_flag("AUTO_MIGRATE", True),
+            warmup=_flag("WARMUP", True),
+            metrics_token=os.getenv("METRICS_TOKEN") or None,
+            argon2_time_cost=_int("ARGON2_TIME_COST", 3),
+            argon2_memory_cost=_int("ARGON2_MEMORY_COST", 65536),
+            argon2_parallelism=_int("ARGON2_PARALLELISM", 1),
+            bcrypt_rounds=_int("BCRYPT_ROUNDS", 12),
+            hash_workers=_int("HASH_WORKERS", CPUS),
+            hash_nice=_int("HASH_NICE", 5),
+            hash_max_pending=_int("HASH_MAX_PENDING", _int("HASH_WORKERS", CPUS) * 8),
+            sarvam_model=os.getenv("SARVAM_MODEL", "saarika:v2.5"),
+            sarvam_language=os.getenv("SARVAM_LANGUAGE", "hi-IN"),
+            transcribe_max_upload_mb=_int("TRANSCRIBE_MAX_UPLOAD_MB", 50),
+            transcribe_chunk_seconds=_int("TRANSCRIBE_CHUNK_SECONDS", 25),
+            transcribe_concurrency=_int("TRANSCRIBE_CONCURRENCY", 4),
+            transcript_cache_dir=os.getenv("TRANSCRIPT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "vriddhamitra-transcripts")),
+            transcript_cache_ttl_hours=_float("TRANSCRIPT_CACHE_TTL_HOURS", 24),
+            transcript_cache_max_mb=_int("TRANSCRIPT_CACHE_MAX_MB", 200),
+            report_workers=_int("REPORT_WORKERS", CPUS),
+            report_nice=_int("REPORT_NICE", 5),
+            report_batch_max_patients=_int("REPORT_BATCH_MAX_PATIENTS", 1000),
+            revocation_sync_seconds=_float("REVOCATION_SYNC_SECONDS", 5),
+            revocation_rebuild_seconds=_float("REVOCATION_REBUILD_SECONDS", 3600),
+            audit_flush_seconds=_float("AUDIT_FLUSH_SECONDS", 2),
+            audit_flush_size=_int("AUDIT_FLUSH_SIZE", 500),
+            audit_max_buffered=_int("AUDIT_MAX_BUFFERED", 100000),
+            entity_cache_ttl_seconds=_float("ENTITY_CACHE_TTL_SECONDS", 5),
+            entity_cache_max_entries=_int("ENTITY_CACHE_MAX_ENTRIES", 10000),
+            shard_id_span=_int("SHARD_ID_SPAN", 100000000),
+            shard_fan_out_workers=_int("SHARD_FAN_OUT_WORKERS", 16),
+            partition_months_ahead=_int("PARTITION_MONTHS_AHEAD", 3),
+            archive_after_months=_int("ARCHIVE_AFTER_MONTHS", 24),
+            archive_tablespace=os.getenv("ARCHIVE_TABLESPACE"),
+            static_build_dir=os.getenv("STATIC_BUILD_DIR", "static_build"),
+            admission={name: value for name, value in os.environ.items() if name.startswith("ADMISSION_")},
+        )
+
+settings = Settings.from_env()
@@ -1,7 +1,10 @@
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import or_, desc
-from datetime import datetime
-import models, schemas
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import or_, desc, select, func, union, update, delete, literal, true, Integer, DateTime
+from sqlalchemy.exc import IntegrityError
+from pydantic import ValidationError
+from datetime import datetime, timedelta, timezone
+import heapq, json
+import models, schemas, search, sharding, typeahead, entity_cache
 from typing import List, Optional
 
 def register_user(user : schemas.RegisterUser, db : Session):
@@ -18,6 +21,7 @@ def register_user(user : schemas.RegisterUser, db : Session):
     return new_user
 
 def register_patient(patient : schemas.RegisterPatient, db : Session):
+    db = sharding.for_owner(patient.physician_id, db)
     user = models.Patients(
         name = patient.name,
         phone_number = patient.phone_number,
@@ -27,20 +31,19 @@ def register_patient(patient : schemas.RegisterPatient, db : Session):
     db.add(user)
     db.commit()
     db.refresh(user)
+    typeahead.indexes.add_patient(user.physician_id, user)
     return user
 
 def check_user_exists(email, db : Session):
-    if db.query(models.Users).filter(models.Users.email == email).first():
-        return True
-    else: return False
+    return get_user_by_email(email, db) is not None
 
 def get_user_by_email(email: str, db: Session):
-    return db.query(models.Users).filter(models.Users.email == email).first()
+    return entity_cache.users.get_by("email", email, db)
 
 def check_patient_exists(phone_number, db : Session):
-    if db.query(models.Patients).filter(models.Patients.phone_number == phone_number).first():
-        return True
-    else: return False
+    return any(sharding.fan_out(
+        lambda session, shard: entity_cache.patients.get_by("phone_number", phone_number, session) is not None, db
+    ))
 
 def login_user(email : str, password : str, db : Session):
     user = db.query(models.Users).filter(models.Users.email == email).first()
@@ -50,42 +53,67 @@ def login_user(email : str, password : str, db : Session):
 
 # Patient Management
 def get_user_patients(user_id : int, db : Session) -> List[models.Patients]:
-    """Get all patients assigned to OR shared with a user"""
-    # Owned patients
-    owned = db.query(models.Patients).filter(
-        models.Patients.physician_id == user_id
-    ).all()
-    
-    # Shared patients
-    shared_records = db.query(models.SharedAccess).filter(
-        models.SharedAccess.user_id == user_id
-    ).options(joinedload(models.SharedAccess.patient)).all()
-    
-    shared_patients = [record.patient for record in shared_records]
-    
-    # Combine and deduplicate (though they shouldn't overlap if logic is correct)
-    all_patients = list({p.id: p for p in (owned + shared_patients)}.values())
+    """Get all patients assigned to OR shared with a user (directly or through a team), from every shard at once"""
+    team_ids = _user_team_ids(user_id, db)
+
+    def load(session, shard):
+        # Owned patients
+        owned = session.query(models.Patients).filter(
+            models.Patients.physician_id == user_id
+        ).all()
+
+        # Shared patients; the union deduplicates a patient shared both ways
+        shared_ids = union(_shared_patient_ids(user_id), _team_patient_ids(team_ids))
+        shared_patients = session.query(models.Patients).filter(models.Patients.id.in_(shared_ids)).all()
+        return owned + shared_patients
+
+    # Combine and deduplicate (an owner can also be in a team the patient is shared with)
+    all_patients = list({p.id: p for patients in sharding.fan_out(load, db) for p in patients}.values())
     return all_patients
 
-def search_patients(user_id : int, query : str, db : Session) -> List[models.Patients]:
-    """Search patients by name or phone number (owned or shared)"""
-    # This is a bit more complex with sharing. simpler to get all and filter in python if list is small,
-    # or write a complex query. For MVP, fetch all associated and filter.
-    all_patients = get_user_patients(user_id, db)
-    
-    query = query.lower()
-    return [
-        p for p in all_patients 
-        if query in p.name.lower() or query in p.phone_number.lower()
-    ]
+def _user_team_ids(user_id : int, db : Session):
+    """The teams a user belongs to: a subquery on a single database, otherwise a list read from the primary"""
+    member_of = select(models.TeamMembers.team_id).where(models.TeamMembers.user_id == user_id)
+    if not sharding.enabled():
+        return member_of
+    return list(db.scalars(member_of))
+
+def _shared_patient_ids(user_id : int):
+    return select(models.SharedAccess.patient_id).where(models.SharedAccess.user_id == user_id)
+
+def _team_patient_ids(team_ids):
+    return select(models.TeamAccess.patient_id).where(models.TeamAccess.team_id.in_(team_ids))
+
+def accessible_patient_ids(user_id : int, db : Session):
+    """Select of the ids of patients a user owns or has been shared, for use in IN (...) filters on any shard"""
+    owned = select(models.Patients.id).where(models.Patients.physician_id == user_id)
+    return union(owned, _shared_patient_ids(user_id), _team_patient_ids(_user_team_ids(user_id, db)))
+
+def search_patients(user_id : int, query : str, db : Session, limit : int = typeahead.DEFAULT_LIMIT) -> List[dict]:
+    """Typeahead search by name, transliterated name or phone number (owned or shared)"""
+    return typeahead.indexes.search(user_id, query, lambda: get_user_patients(user_id, db), limit)
 
 def get_patient_by_id(patient_id : int, db : Session) -> Optional[models.Patients]:
-    """Get patient by ID"""
-    return db.query(models.Patients).filter(models.Patients.id == patient_id).first()
+    """Get patient by ID (from the session's identity map or the entity cache when possible)"""
+    return entity_cache.patients.get(patient_id, sharding.for_patient(patient_id, db))
+
+def bump_patient_versions(patient_ids, db : Session):
+    """Invalidate the ETags of the patients' responses; commits with the caller's transaction (on their shard)"""
+    patient_ids = set(patient_ids)
+    if not patient_ids:
+        return
+    db.execute(
+        update(models.Patients)
+        .where(models.Patients.id.in_(patient_ids))
+        .values(data_version=models.Patients.data_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    entity_cache.invalidate_patients(patient_ids, db)
 
 # Sharing Management
 def grant_access(patient_id: int, user_id: int, granted_by: int, permission: str, db: Session):
     """Grant access to a patient for a user"""
+    db = sharding.for_patient(patient_id, db)
     # Check if access already exists
     existing = db.query(models.SharedAccess).filter(
         models.SharedAccess.patient_id == patient_id,
@@ -94,6 +122,7 @@ def grant_access(patient_id: int, user_id: int, granted_by: int, permission: str
     
     if existing:
         existing.permission = permission # Update permission
+        bump_patient_versions([patient_id], db)
         db.commit()
         db.refresh(existing)
         return existing
@@ -105,23 +134,30 @@ def grant_access(patient_id: int, user_id: int, granted_by: int, permission: str
         permission=permission
     )
     db.add(access)
+    bump_patient_versions([patient_id], db)
     db.commit()
     db.refresh(access)
+    typeahead.indexes.add_patient(user_id, access.patient)
     return access
 
 def revoke_access(patient_id: int, user_id: int, db: Session):
     """Revoke access"""
+    db = sharding.for_patient(patient_id, db)
     db.query(models.SharedAccess).filter(
         models.SharedAccess.patient_id == patient_id,
         models.SharedAccess.user_id == user_id
     ).delete()
+    bump_patient_versions([patient_id], db)
     db.commit()
+    if not check_access(patient_id, user_id, db): # Still accessible through a team
+        typeahead.indexes.remove_patient(user_id, patient_id)
 
 def get_patient_access_list(patient_id: int, db: Session):
     """Get list of users who have access to this patient"""
-    return db.query(models.SharedAccess).filter(
+    # Users are read separately: they are on the primary, the grants on the patient's shard
+    return sharding.for_patient(patient_id, db).query(models.SharedAccess).filter(
         models.SharedAccess.patient_id == patient_id
-    ).options(joinedload(models.SharedAccess.user)).all()
+    ).options(selectinload(models.SharedAccess.user)).all()
 
 def check_access(patient_id: int, user_id: int, db: Session):
     """Check if user has access to patient. Returns permission level or None."""
@@ -130,20 +166,304 @@ def check_access(patient_id: int, user_id: int, db: Session):
     if patient and patient.physician_id == user_id:
         return models.PermissionLevel.EDIT # Owner has full access
         
-    # Check shared access
-    access = db.query(models.SharedAccess).filter(
-        models.SharedAccess.patient_id == patient_id,
-        models.SharedAccess.user_id == user_id
-    ).first()
-    
-    if access:
-        return access.permission
-        
-    return None
+    # Check shared access, direct or through a team
+    return _granted_permissions([patient_id], [user_id], db).get((patient_id, user_id))
+
+def _granted_permissions(patient_ids, user_ids, db: Session) -> dict:
+    """{(patient_id, user_id): highest permission} from direct and team grants"""
+    # Team memberships are on the primary, team grants on each patient's shard
+    members = {}
+    for team_id, user_id in db.execute(select(models.TeamMembers.team_id, models.TeamMembers.user_id).where(
+        models.TeamMembers.user_id.in_(user_ids)
+    )):
+        members.setdefault(team_id, []).append(user_id)
+    groups = sharding.by_shard(patient_ids)
+
+    def grants(session, shard):
+        # Two ORM selects rather than one UNION: a compound select names no mapper, so a shard's
+        # Session would send it to the primary. Direct grants name the user, team grants the team
+        rows = [(patient_id, user_id, None, permission) for patient_id, user_id, permission in session.execute(select(
+            models.SharedAccess.patient_id, models.SharedAccess.user_id, models.SharedAccess.permission
+        ).where(
+            models.SharedAccess.patient_id.in_(groups[shard]),
+            models.SharedAccess.user_id.in_(user_ids)
+        ))]
+        if members:
+            rows += [(patient_id, None, team_id, permission) for patient_id, team_id, permission in session.execute(select(
+                models.TeamAccess.patient_id, models.TeamAccess.team_id, models.TeamAccess.permission
+            ).where(
+                models.TeamAccess.patient_id.in_(groups[shard]),
+                models.TeamAccess.team_id.in_(members)
+            ))]
+        return rows
+
+    permissions = {}
+    for rows in sharding.fan_out(grants, db, groups):
+        for patient_id, user_id, team_id, permission in rows:
+            permission = models.PermissionLevel(permission)
+            for user_id in ([user_id] if team_id is None else members[team_id]):
+                if permissions.get((patient_id, user_id)) != models.PermissionLevel.EDIT:
+                    permissions[(patient_id, user_id)] = permission
+    return permissions
+
+def effective_permissions(patient_ids, user_ids, db: Session) -> dict:
+    """{(patient_id, user_id): permission} for every pair that has access, owners included"""
+    patient_ids, user_ids = list(set(patient_ids)), list(set(user_ids))
+    if not patient_ids or not user_ids:
+        return {}
+    permissions = _granted_permissions(patient_ids, user_ids, db)
+    groups = sharding.by_shard(patient_ids)
+    owned = sharding.fan_out(lambda session, shard: session.query(models.Patients.id, models.Patients.physician_id).filter(
+        models.Patients.id.in_(groups[shard]),
+        models.Patients.physician_id.in_(user_ids)
+    ).all(), db, groups)
+    for patient_id, owner_id in (row for rows in owned for row in rows):
+        permissions[(patient_id, owner_id)] = models.PermissionLevel.EDIT
+    return permissions
+
+# Bulk sharing
+MAX_BULK_GRANTS = 100_000 # patient x recipient pairs per request
+
+def _upsert(table, columns: List[str], rows, keys: List[str], update_columns: List[str], db: Session) -> int:
+    """INSERT ... SELECT ... ON CONFLICT (keys) DO UPDATE (or DO NOTHING): one statement however many rows"""
+    dialect = db.get_bind(clause=table).dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {dialect}")
+    statement = insert(table).from_select(columns, rows)
+    if update_columns:
+        statement = statement.on_conflict_do_update(
+            index_elements=keys, set_={column: statement.excluded[column] for column in update_columns}
+        )
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=keys)
+    return db.execute(statement).rowcount
+
+def _id_table(ids, table, db: Session):
+    """The ids as a one-column table (`value`) in `table`'s database, to build rows from a list sent once"""
+    ids = sorted(ids)
+    if db.get_bind(clause=table).dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import ARRAY
+        return func.unnest(literal(ids, ARRAY(Integer))).table_valued("value").render_derived()
+    return func.json_each(json.dumps(ids)).table_valued("value")
+
+def get_owned_patient_ids(patient_ids, user_id: int, db: Session) -> set:
+    """The subset of `patient_ids` the user owns"""
+    groups = sharding.by_shard(set(patient_ids))
+    return set().union(*sharding.fan_out(lambda session, shard: set(session.scalars(select(models.Patients.id).where(
+        models.Patients.id.in_(groups[shard]),
+        models.Patients.physician_id == user_id
+    ))), db, groups))
+
+def get_users_by_emails(emails, db: Session) -> List[models.Users]:
+    return db.query(models.Users).filter(models.Users.email.in_(set(emails))).all()
+
+def bulk_grant_access(patient_ids, user_ids, team_ids, granted_by: int, permission: str, db: Session) -> int:
+    """Share every patient with every (existing) user and team in one transaction per shard; existing grants get the new permission.
+
+    The (patient x recipient) rows are built by the database from the two id lists, so the request only sends the ids.
+    """
+    patient_ids, user_ids, team_ids = set(patient_ids), set(user_ids), set(team_ids)
+    granted = (
+        literal(granted_by, Integer),
+        literal(models.PermissionLevel(permission), models.SharedAccess.permission.type),
+        literal(datetime.utcnow(), DateTime),
+    )
+    columns = ["granted_by", "permission", "created_at"]
+    update_columns = ["permission", "granted_by"]
+    count = 0
+    for shard, shard_patient_ids in sharding.by_shard(patient_ids).items():
+        shard_db = sharding.session(shard, db)
+        for table, recipient_column, recipient_ids, keys in (
+            (models.SharedAccess.__table__, "user_id", user_ids, ["patient_id", "user_id"]),
+            (models.TeamAccess.__table__, "team_id", team_ids, ["team_id", "patient_id"]),
+        ):
+            if not recipient_ids:
+                continue
+            recipients = _id_table(recipient_ids, table, shard_db)
+            rows = select(models.Patients.id, recipients.c.value, *granted).join(recipients, true()).where(
+                models.Patients.id.in_(shard_patient_ids)
+            )
+            count += _upsert(table, ["patient_id", recipient_column, *columns], rows, keys, update_columns, shard_db)
+        bump_patient_versions(shard_patient_ids, shard_db)
+        shard_db.commit()
+    for user_id in user_ids | set(get_team_member_ids(team_ids, db)):
+        typeahead.indexes.invalidate(user_id)
+    return count
+
+def bulk_revoke_access(patient_ids, user_ids, team_ids, db: Session) -> int:
+    """Remove the grants of every patient to every user and team; returns how many existed"""
+    patient_ids, user_ids, team_ids = set(patient_ids), set(user_ids), set(team_ids)
+    revoked = 0
+    for shard, shard_patient_ids in sharding.by_shard(patient_ids).items():
+        shard_db = sharding.session(shard, db)
+        if user_ids:
+            revoked += shard_db.execute(delete(models.SharedAccess).where(
+                models.SharedAccess.patient_id.in_(shard_patient_ids),
+                models.SharedAccess.user_id.in_(user_ids)
+            )).rowcount
+        if team_ids:
+            revoked += shard_db.execute(delete(models.TeamAccess).where(
+                models.TeamAccess.patient_id.in_(shard_patient_ids),
+                models.TeamAccess.team_id.in_(team_ids)
+            )).rowcount
+        bump_patient_versions(shard_patient_ids, shard_db)
+        shard_db.commit()
+    for user_id in user_ids | set(get_team_member_ids(team_ids, db)):
+        typeahead.indexes.invalidate(user_id)
+    return revoked
+
+# Teams
+def create_team(name: str, owner_id: int, db: Session) -> models.Teams:
+    """Create a team; its owner is its first member"""
+    team = models.Teams(name=name, owner_id=owner_id)
+    team.members.append(models.TeamMembers(user_id=owner_id))
+    db.add(team)
+    db.commit()
+    db.refresh(team)
+    return team
+
+def get_team(team_id: int, db: Session) -> Optional[models.Teams]:
+    return db.get(models.Teams, team_id)
+
+def get_user_teams(user_id: int, db: Session) -> List[models.Teams]:
+    """Teams a user owns or belongs to, with their members"""
+    member_of = select(models.TeamMembers.team_id).where(models.TeamMembers.user_id == user_id)
+    return db.query(models.Teams).filter(
+        or_(models.Teams.owner_id == user_id, models.Teams.id.in_(member_of))
+    ).options(
+        selectinload(models.Teams.members).joinedload(models.TeamMembers.user)
+    ).order_by(models.Teams.name).all()
+
+def get_member_team_ids(team_ids, user_id: int, db: Session) -> set:
+    """The subset of `team_ids` the user owns or belongs to"""
+    member_of = select(models.TeamMembers.team_id).where(models.TeamMembers.user_id == user_id)
+    return set(db.scalars(select(models.Teams.id).where(
+        models.Teams.id.in_(set(team_ids)),
+        or_(models.Teams.owner_id == user_id, models.Teams.id.in_(member_of))
+    )))
+
+def get_team_member_ids(team_ids, db: Session) -> List[int]:
+    if not team_ids:
+        return []
+    return list(db.scalars(select(models.TeamMembers.user_id).where(
+        models.TeamMembers.team_id.in_(set(team_ids))
+    ).distinct()))
+
+def get_team_patient_ids(team_ids, db: Session) -> List[int]:
+    return [patient_id for patient_ids in sharding.fan_out(
+        lambda session, shard: list(session.scalars(select(models.TeamAccess.patient_id).where(
+            models.TeamAccess.team_id.in_(set(team_ids))
+        ).distinct())), db
+    ) for patient_id in patient_ids]
+
+def add_team_members(team_id: int, user_ids, db: Session):
+    """Add users to a team; users already in it are left as they are"""
+    user_ids = set(user_ids)
+    rows = select(literal(team_id, Integer), models.Users.id, literal(datetime.utcnow(), DateTime)).where(
+        models.Users.id.in_(user_ids)
+    )
+    _upsert(models.TeamMembers.__table__, ["team_id", "user_id", "created_at"], rows, ["team_id", "user_id"], [], db)
+    db.commit()
+    for user_id in user_ids:
+        typeahead.indexes.invalidate(user_id)
+
+def remove_team_member(team_id: int, user_id: int, db: Session):
+    db.execute(delete(models.TeamMembers).where(
+        models.TeamMembers.team_id == team_id,
+        models.TeamMembers.user_id == user_id
+    ))
+    db.commit()
+    typeahead.indexes.invalidate(user_id)
+
+def delete_team(team: models.Teams, db: Session):
+    """Delete a team with its memberships and grants"""
+    member_ids = get_team_member_ids([team.id], db)
+    patient_ids = get_team_patient_ids([team.id], db)
+    # Grants first, each shard in its own transaction, so a failure leaves the team to delete again
+    for shard, shard_patient_ids in sharding.by_shard(patient_ids).items():
+        shard_db = sharding.session(shard, db)
+        shard_db.execute(delete(models.TeamAccess).where(models.TeamAccess.team_id == team.id))
+        bump_patient_versions(shard_patient_ids, shard_db)
+        if shard != sharding.PRIMARY:
+            shard_db.commit()
+    db.delete(team) # Members go with it (delete-orphan)
+    db.commit()
+    for user_id in member_ids:
+        typeahead.indexes.invalidate(user_id)
+
+def get_patient_team_access(patient_id: int, db: Session) -> List[models.TeamAccess]:
+    """Teams a patient is shared with"""
+    return sharding.for_patient(patient_id, db).query(models.TeamAccess).filter(
+        models.TeamAccess.patient_id == patient_id
+    ).options(selectinload(models.TeamAccess.team)).all()
+
+# Idempotent writes
+IDEMPOTENCY_CONFLICT = "Idempotency key already used for a different write"
+
+class IdempotencyConflict(Exception):
+    """An idempotency key already used for another kind of write or another patient"""
+
+def _conflicts(existing: models.IdempotencyKeys, kind: str, patient_id: int) -> bool:
+    # Keys stored before their patient was kept can only be checked by kind
+    return existing.kind != kind or existing.patient_id not in (None, patient_id)
+
+def get_idempotency_records(user_id: int, keys: List[str], db: Session):
+    """Map already-used idempotency keys of a user to their records (kept on the shard of the record's patient)"""
+    if not keys:
+        return {}
+    records = sharding.fan_out(lambda session, shard: session.query(models.IdempotencyKeys).filter(
+        models.IdempotencyKeys.user_id == user_id,
+        models.IdempotencyKeys.key.in_(keys)
+    ).all(), db)
+    return {record.key: record for shard_records in records for record in shard_records}
+
+def _create_idempotent(user_id: int, kind: str, record, key: Optional[str], db: Session):
+    """Insert a note/vitals row together with its idempotency key in one transaction; returns (row, inserted).
+
+    A retry with a key that was already applied returns the original row instead of a duplicate.
+    Raises IdempotencyConflict if the key was used for another kind of write or another patient.
+    """
+    model, patient_id = type(record), record.patient_id
+    db = sharding.for_patient(patient_id, db)
+    if key:
+        # Keys of every shard: the key may have been used for a patient elsewhere
+        existing = get_idempotency_records(user_id, [key], db).get(key)
+        if existing:
+            return _replayed(existing, model, kind, patient_id, db), False
+
+    db.add(record)
+    try:
+        if key:
+            db.flush()
+            db.add(models.IdempotencyKeys(user_id=user_id, key=key, kind=kind, patient_id=patient_id, record_id=record.id))
+        bump_patient_versions([patient_id], db)
+        db.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key won the race
+        db.rollback()
+        if not key:
+            raise
+        existing = get_idempotency_records(user_id, [key], db).get(key)
+        if not existing:
+            raise
+        return _replayed(existing, model, kind, patient_id, db), False
+
+    db.refresh(record)
+    return record, True
+
+def _replayed(existing: models.IdempotencyKeys, model, kind: str, patient_id: int, db: Session):
+    """The row an already-used key created, if this write is the same kind and for the same patient"""
+    if _conflicts(existing, kind, patient_id):
+        raise IdempotencyConflict(IDEMPOTENCY_CONFLICT)
+    # Not conflicting: the record is this patient's, so it is on their shard
+    return sharding.for_patient(patient_id, db).get(model, existing.record_id)
 
 # Notes Management
-def create_note(user_id : int, note_data : schemas.NoteCreate, db : Session):
-    """Create a new clinical note"""
+def _build_note(user_id: int, note_data: schemas.NoteCreate) -> models.Notes:
     note = models.Notes(
         physician_id = user_id, # author
         patient_id = note_data.patient_id,
@@ -154,24 +474,36 @@ def create_note(user_id : int, note_data : schemas.NoteCreate, db : Session):
         plan = note_data.plan,
         raw_notes = note_data.raw_notes
     )
-    db.add(note)
-    db.commit()
-    db.refresh(note)
+    note.search_text = search.build_search_text(note)
     return note
 
+def create_note(user_id : int, note_data : schemas.NoteCreate, db : Session):
+    """Create a new clinical note; returns (note, inserted), see _create_idempotent"""
+    note = _build_note(user_id, note_data)
+    return _create_idempotent(user_id, 'note', note, note_data.idempotency_key, db)
+
 def get_patient_notes(patient_id : int, db : Session):
     """Get all notes for a patient, ordered by most recent first"""
-    # Update to load 'author' (which was 'physicians')
-    return db.query(models.Notes).options(
-        joinedload(models.Notes.author)
+    # Authors are users, on the primary: loaded in a second query rather than joined
+    return sharding.for_patient(patient_id, db).query(models.Notes).options(
+        selectinload(models.Notes.author)
     ).filter(
         models.Notes.patient_id == patient_id
     ).order_by(desc(models.Notes.created_at)).all()
 
+def get_notes_by_ids(note_ids: List[int], db: Session):
+    """Get notes (with authors) by id"""
+    if not note_ids:
+        return []
+    groups = sharding.by_shard(note_ids)
+    notes = sharding.fan_out(lambda session, shard: session.query(models.Notes).options(
+        selectinload(models.Notes.author)
+    ).filter(models.Notes.id.in_(groups[shard])).all(), db, groups)
+    return [note for shard_notes in notes for note in shard_notes]
+
 # Vitals Management
-def create_vitals(user_id : int, vitals_data : schemas.VitalsCreate, db : Session):
-    """Log new vitals reading"""
-    vitals = models.Vitals(
+def _build_vitals(user_id: int, vitals_data: schemas.VitalsCreate) -> models.Vitals:
+    return models.Vitals(
         physician_id = user_id, # author
         patient_id = vitals_data.patient_id,
         systolic_bp = vitals_data.systolic_bp,
@@ -180,30 +512,265 @@ def create_vitals(user_id : int, vitals_data : schemas.VitalsCreate, db : Sessio
         temperature = vitals_data.temperature,
         spo2 = vitals_data.spo2
     )
-    db.add(vitals)
-    db.commit()
-    db.refresh(vitals)
-    return vitals
+
+def create_vitals(user_id : int, vitals_data : schemas.VitalsCreate, db : Session):
+    """Log new vitals reading; returns (vitals, inserted), see _create_idempotent"""
+    vitals = _build_vitals(user_id, vitals_data)
+    return _create_idempotent(user_id, 'vitals', vitals, vitals_data.idempotency_key, db)
 
 def get_patient_vitals(patient_id : int, db : Session):
     """Get all vitals for a patient, ordered by most recent first"""
-    return db.query(models.Vitals).filter(
+    return sharding.for_patient(patient_id, db).query(models.Vitals).filter(
         models.Vitals.patient_id == patient_id
     ).order_by(desc(models.Vitals.created_at)).all()
 
-# Reporting
-def get_patient_data_summary(patient_id: int, start_date: datetime, end_date: datetime, db: Session):
-    """Get aggregated data for report"""
-    notes = db.query(models.Notes).filter(
-        models.Notes.patient_id == patient_id,
-        models.Notes.created_at >= start_date,
-        models.Notes.created_at <= end_date
+def get_patient_vitals_columns(patient_id : int, db : Session) -> dict:
+    """Vitals as parallel arrays, oldest first (chart order), read as plain tuples without ORM objects"""
+    rows = sharding.for_patient(patient_id, db).execute(
+        select(
+            models.Vitals.id, models.Vitals.created_at, models.Vitals.systolic_bp, models.Vitals.diastolic_bp,
+            models.Vitals.heart_rate, models.Vitals.temperature, models.Vitals.spo2
+        ).where(
+            models.Vitals.patient_id == patient_id
+        ).order_by(models.Vitals.created_at, models.Vitals.id)
     ).all()
-    
-    vitals = db.query(models.Vitals).filter(
-        models.Vitals.patient_id == patient_id,
-        models.Vitals.created_at >= start_date,
-        models.Vitals.created_at <= end_date
-    ).all()
-    
-    return {"notes": notes, "vitals": vitals}
\ No newline at end of file
+    ids, created, systolic, diastolic, heart_rate, temperature, spo2 = zip(*rows) if rows else ((),) * 7
+    return {
+        "count": len(rows),
+        "id": list(ids),
+        # created_at is stored as naive UTC
+        "timestamps": [int(t.replace(tzinfo=timezone.utc).timestamp() * 1000) for t in created],
+        "systolic_bp": list(systolic),
+        "diastolic_bp": list(diastolic),
+        "heart_rate": list(heart_rate),
+        "temperature": list(temperature),
+        "spo2": list(spo2),
+    }
+
+def get_vitals_by_ids(vitals_ids: List[int], db: Session):
+    """Get vitals readings by id"""
+    if not vitals_ids:
+        return []
+    groups = sharding.by_shard(vitals_ids)
+    vitals = sharding.fan_out(lambda session, shard: session.query(models.Vitals).filter(
+        models.Vitals.id.in_(groups[shard])
+    ).all(), db, groups)
+    return [reading for shard_vitals in vitals for reading in shard_vitals]
+
+# Offline sync
+SYNC_KINDS = {
+    'note': (schemas.NoteCreate, _build_note),
+    'vitals': (schemas.VitalsCreate, _build_vitals),
+}
+
+def apply_sync_batch(user_id: int, items: List[schemas.SyncItem], db: Session, _retry: bool = True):
+    """Apply queued note/vitals writes in one transaction (per shard), deduplicated on idempotency key.
+
+    Returns one result dict per item, in order. Items that fail validation or
+    permission checks are reported as errors without aborting the rest of the batch.
+    """
+    existing = get_idempotency_records(user_id, [item.idempotency_key for item in items], db)
+    permissions = {}
+    results = []
+    pending = [] # (key, kind) of new writes, in order
+    pending_by_key = {}
+
+    for item in items:
+        result = {"idempotency_key": item.idempotency_key, "kind": item.kind, "status": "error", "id": None, "detail": None}
+        results.append(result)
+
+        if item.kind not in SYNC_KINDS:
+            result["detail"] = f"Unknown kind '{item.kind}'"
+            continue
+
+        schema, build = SYNC_KINDS[item.kind]
+        try:
+            data = schema.model_validate(item.data)
+        except ValidationError as e:
+            result["detail"] = f"Invalid {item.kind}: {e.errors()[0]['msg']}"
+            continue
+
+        # A key names one write: a replay has to be the same kind of write for the same patient
+        if item.idempotency_key in existing:
+            record = existing[item.idempotency_key]
+            if _conflicts(record, item.kind, data.patient_id):
+                result["detail"] = IDEMPOTENCY_CONFLICT
+                continue
+            result["status"] = "duplicate"
+            result["id"] = record.record_id
+            continue
+        if item.idempotency_key in pending_by_key:
+            # Same write queued twice in this batch; resolved once ids are assigned
+            record, waiting = pending_by_key[item.idempotency_key]
+            if waiting[0]["kind"] != item.kind or record.patient_id != data.patient_id:
+                result["detail"] = IDEMPOTENCY_CONFLICT
+                continue
+            result["status"] = "duplicate"
+            waiting.append(result)
+            continue
+
+        if data.patient_id not in permissions:
+            permissions[data.patient_id] = check_access(data.patient_id, user_id, db)
+        if permissions[data.patient_id] != models.PermissionLevel.EDIT:
+            result["detail"] = "Edit access required"
+            continue
+
+        record = build(user_id, data)
+        sharding.for_patient(data.patient_id, db).add(record)
+        pending_by_key[item.idempotency_key] = (record, [result])
+        pending.append((item.idempotency_key, item.kind))
+
+    if not pending:
+        return results
+
+    by_session = {} # Session of each patient's shard -> its pending (key, kind)
+    for key, kind in pending:
+        session = sharding.for_patient(pending_by_key[key][0].patient_id, db)
+        by_session.setdefault(session, []).append((key, kind))
+    try:
+        for session, session_pending in by_session.items():
+            session.flush()
+            for key, kind in session_pending:
+                record, waiting = pending_by_key[key]
+                session.add(models.IdempotencyKeys(
+                    user_id=user_id, key=key, kind=kind, patient_id=record.patient_id, record_id=record.id
+                ))
+            bump_patient_versions([pending_by_key[key][0].patient_id for key, _ in session_pending], session)
+            session.commit()
+    except IntegrityError:
+        # Another replay of the same queue committed first; redo the batch against its keys
+        for session in by_session:
+            session.rollback()
+        if not _retry:
+            raise
+        return apply_sync_batch(user_id, items, db, _retry=False)
+
+    for key, kind in pending:
+        record, waiting = pending_by_key[key]
+        waiting[0]["status"] = "created"
+        for result in waiting:
+            result["id"] = record.id
+    return results
+
+# Alerts
+def get_user_alerts(user_id : int, db : Session, since : Optional[datetime] = None, severity : Optional[str] = None,
+                    patient_id : Optional[int] = None, limit : int = 100) -> List[dict]:
+    """Newest alerts on the patients a user owns or has been shared, the newest `limit` of every shard merged"""
+    query = select(
+        models.Alerts.id, models.Alerts.patient_id, models.Patients.name.label("patient_name"),
+        models.Alerts.vitals_id, models.Alerts.metric, models.Alerts.kind, models.Alerts.severity,
+        models.Alerts.value, models.Alerts.baseline, models.Alerts.message,
+        models.Alerts.created_at, models.Alerts.detected_at,
+    ).join(models.Patients, models.Patients.id == models.Alerts.patient_id).where(
+        models.Alerts.patient_id.in_(accessible_patient_ids(user_id, db))
+    )
+    if since is not None:
+        query = query.where(models.Alerts.created_at >= since)
+    if severity is not None:
+        query = query.where(models.Alerts.severity == severity)
+    if patient_id is not None:
+        query = query.where(models.Alerts.patient_id == patient_id)
+    query = query.order_by(desc(models.Alerts.created_at), desc(models.Alerts.id)).limit(limit)
+    rows = sharding.fan_out(lambda session, shard: [row._asdict() for row in session.execute(query)], db)
+    newest = heapq.merge(*rows, key=lambda row: (row["created_at"], row["id"]), reverse=True)
+    return list(newest)[:limit]
+
+# Audit trail
+def get_audit_events(db : Session, patient_id : Optional[int] = None, user_id : Optional[int] = None,
+                     since : Optional[datetime] = None, until : Optional[datetime] = None, action : Optional[str] = None,
+                     before_id : Optional[int] = None, limit : int = 100) -> List[models.AuditEvents]:
+    """Newest audit events of a patient and/or a user; page with before_id = the last id of the previous page"""
+    query = db.query(models.AuditEvents)
+    if patient_id is not None:
+        query = query.filter(models.AuditEvents.patient_id == patient_id)
+    if user_id is not None:
+        query = query.filter(models.AuditEvents.user_id == user_id)
+    if since is not None:
+        query = query.filter(models.AuditEvents.created_at >= since)
+    if until is not None:
+        query = query.filter(models.AuditEvents.created_at < until)
+    if action is not None:
+        query = query.filter(models.AuditEvents.action == action)
+    if before_id is not None:
+        query = query.filter(models.AuditEvents.id < before_id)
+    return query.order_by(desc(models.AuditEvents.id)).limit(limit).all()
+
+# Reporting
+def get_report_data(patient_ids : List[int], start_date : datetime, end_date : datetime, db : Session) -> dict:
+    """Plain rows for the reports of several patients, in three queries per shard: {patient_id: {patient, notes, vitals}}"""
+    groups = sharding.by_shard(patient_ids)
+
+    def read(session, shard):
+        patients = session.execute(
+            select(models.Patients.id, models.Patients.name).where(models.Patients.id.in_(groups[shard]))
+        ).all()
+        data = {p.id: {"patient": p._asdict(), "notes": [], "vitals": []} for p in patients}
+        if not data:
+            return data
+
+        # Authors are users, on the primary: named afterwards
+        notes = session.execute(
+            select(
+                models.Notes.patient_id, models.Notes.created_at, models.Notes.physician_id,
+                models.Notes.assessment, models.Notes.plan, models.Notes.raw_notes,
+            ).where(
+                models.Notes.patient_id.in_(data),
+                models.Notes.created_at >= start_date,
+                models.Notes.created_at <= end_date
+            ).order_by(models.Notes.patient_id, models.Notes.created_at, models.Notes.id)
+        )
+        for row in notes:
+            data[row.patient_id]["notes"].append(row._asdict())
+
+        vitals = session.execute(
+            select(
+                models.Vitals.patient_id, models.Vitals.created_at, models.Vitals.systolic_bp, models.Vitals.diastolic_bp,
+                models.Vitals.heart_rate, models.Vitals.temperature, models.Vitals.spo2,
+            ).where(
+                models.Vitals.patient_id.in_(data),
+                models.Vitals.created_at >= start_date,
+                models.Vitals.created_at <= end_date
+            ).order_by(models.Vitals.patient_id, models.Vitals.created_at, models.Vitals.id)
+        )
+        for row in vitals:
+            data[row.patient_id]["vitals"].append(row._asdict())
+        return data
+
+    data = {}
+    for shard_data in sharding.fan_out(read, db, groups):
+        data.update(shard_data)
+    notes = [note for patient in data.values() for note in patient["notes"]]
+    names = dict(db.execute(select(models.Users.id, models.Users.name).where(
+        models.Users.id.in_({note["physician_id"] for note in notes})
+    )).all()) if notes else {}
+    for note in notes:
+        note["author_name"] = names.get(note.pop("physician_id"))
+    return data
+
+def get_accessible_patient_ids(user_id : int, db : Session, patient_ids : Optional[List[int]] = None) -> List[int]:
+    """Ids of the user's patients (owned or shared) ordered by name, optionally restricted to `patient_ids`"""
+    query = select(models.Patients.id, models.Patients.name).where(
+        models.Patients.id.in_(accessible_patient_ids(user_id, db))
+    )
+    if patient_ids is not None:
+        query = query.where(models.Patients.id.in_(patient_ids))
+    query = query.order_by(models.Patients.name, models.Patients.id)
+    rows = sharding.fan_out(lambda session, shard: session.execute(query).all(), db)
+    return [row.id for row in heapq.merge(*rows, key=lambda row: (row.name, row.id))]
+
+def create_report_job(user_id : int, period : str, total : int, db : Session) -> models.ReportJobs:
+    # Progress is only interesting while a download runs; drop week-old jobs as new ones start
+    db.query(models.ReportJobs).filter(
+        models.ReportJobs.created_at < datetime.utcnow() - timedelta(days=7)
+    ).delete(synchronize_session=False)
+    job = models.ReportJobs(user_id=user_id, period=period, total=total)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+def update_report_job(job_id : int, values : dict, db : Session):
+    db.query(models.ReportJobs).filter(models.ReportJobs.id == job_id).update(
+        {**values, "updated_at": datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
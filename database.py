@@ -1,12 +1,11 @@
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
+import itertools
 
-load_dotenv()
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, sessionmaker
+from config import settings
 
-DATABASE_URL = os.getenv('DATABASE_URL')
+DATABASE_URL = settings.database_url
 engine = create_engine(DATABASE_URL, 
                        pool_pre_ping=True,
                        pool_recycle=3600,
@@ -14,7 +13,26 @@ engine = create_engine(DATABASE_URL,
                        max_overflow=20,
                        echo=False)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_begins = itertools.count()
+
+class AppSession(Session):
+    """Session that also closes the sessions it opened on other shards (see sharding.py)"""
+
+    def close(self):
+        # Latest to begin on the primary first: under testing.py they all nest savepoints on one connection
+        sessions = [*self.info.pop("shard_sessions", {}).values(), self]
+        for session in sorted(sessions, key=lambda s: s.info.get("primary_begun", -1), reverse=True):
+            if session is self:
+                super().close()
+            else:
+                session.close()
+
+@event.listens_for(AppSession, "after_begin")
+def _primary_begun(session, transaction, connection):
+    if connection.engine is session.bind.engine:
+        session.info["primary_begun"] = next(_begins)
+
+SessionLocal = sessionmaker(class_=AppSession, autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 def get_db():
@@ -22,4 +40,55 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def use_engine(new_engine):
+    """Point the app at another database (test clones, see testing.py); returns the previous engine.
+
+    Modules that open their own sessions share SessionLocal, so rebinding it moves them too.
+    """
+    global engine
+    previous, engine = engine, new_engine
+    SessionLocal.configure(bind=new_engine)
+    return previous
+
+def add_missing_columns(engine):
+    """Add model columns missing from existing tables (create_all only creates missing tables)"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT {column.server_default.arg}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                conn.execute(text(ddl))
+
+def widen_string_columns(engine):
+    """Grow VARCHAR columns whose model length was raised (SQLite does not enforce lengths)"""
+    if engine.dialect.name != "postgresql":
+        return
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"]: column["type"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                length = getattr(column.type, "length", None)
+                current = getattr(existing.get(column.name), "length", None)
+                if length and current and current < length:
+                    conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE VARCHAR({length})"))
+
+def add_missing_indexes(engine, metadata=None):
+    """Create model indexes missing from existing tables"""
+    with engine.begin() as conn:
+        for table in (metadata or Base.metadata).sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
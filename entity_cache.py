@@ -0,0 +1,189 @@
+"""Read-through cache of Patients and Users rows, within a request and across requests.
+
+Within a request the Session's identity map already answers a second lookup
+by id; lookups by email or phone number note the id they resolved to in
+session.info, so they end up at the same object. Across requests each worker
+keeps an LRU of column snapshots per model (MAX_ENTRIES, each kept for at
+most TTL_SECONDS); a hit is attached to the session as a persistent object
+without a SELECT.
+
+Invalidation is versioned. A miss takes a fill token for its key before it
+reads the database, and the row is only stored if the token is still current,
+so a read that raced a write never caches the row the write replaced. Writes
+invalidate their keys when they are made and again after their transaction
+commits or rolls back. Writes on this worker are seen at once; writes on
+other workers after the TTL, like the typeahead index, or sooner with their
+events if the realtime hub has a backend shared between workers (the default
+LocalBackend is in-process only). A patient's data_version is never cached:
+ETags are built from it, and a stale one would answer 304 to a client that
+just wrote through another worker. Misses are never cached, so a user or
+patient registered anywhere is found straight away.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+
+import models
+from config import settings
+from realtime import hub
+
+TTL_SECONDS = settings.entity_cache_ttl_seconds
+MAX_ENTRIES = settings.entity_cache_max_entries # Per model
+
+PENDING_KEY = "entity_cache_pending" # session.info: keys to invalidate again when the transaction ends
+LOOKUPS_KEY = "entity_cache_lookups" # session.info: (model, column, value) -> id resolved in this request
+
+class EntityCache:
+    """Column snapshots of one model by primary key, plus unique-column -> id lookups"""
+
+    def __init__(self, model, exclude: Iterable[str] = (), max_entries: int = MAX_ENTRIES, ttl_seconds: float = TTL_SECONDS):
+        self.model = model
+        self.columns = [attr.key for attr in model.__mapper__.column_attrs if attr.key not in set(exclude)]
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict() # key -> (stored_at, value)
+        self._fills: Dict[tuple, object] = {} # key -> token of the newest read in flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Entries
+    def _get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _begin_fill(self, key: tuple) -> object:
+        token = object()
+        with self._lock:
+            self._fills[key] = token
+        return token
+
+    def _finish_fill(self, key: tuple, token: object, value):
+        with self._lock:
+            if self._fills.get(key) is not token:
+                return # Invalidated (or read again) meanwhile
+            del self._fills[key]
+            if value is None:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys: Iterable[tuple]):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._fills.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._fills.clear()
+
+    # ORM
+    def _snapshot(self, obj) -> dict:
+        return {column: getattr(obj, column) for column in self.columns}
+
+    def _attach(self, row: dict, db: Session):
+        obj = self.model(**row)
+        make_transient_to_detached(obj) # Persistent as if loaded; excluded columns load on first access
+        db.add(obj)
+        return obj
+
+    def get(self, pk: int, db: Session):
+        """The row with primary key `pk`, or None"""
+        obj = db.identity_map.get(identity_key(self.model, pk))
+        if obj is not None:
+            return obj
+        key = ("id", pk)
+        row = self._get(key)
+        if row is not None:
+            return self._attach(row, db)
+
+        token = self._begin_fill(key)
+        obj = db.get(self.model, pk)
+        # Uncommitted changes of this session are not for other requests
+        cacheable = obj is not None and obj not in db.dirty and obj not in db.new and not self._written(key, db)
+        self._finish_fill(key, token, self._snapshot(obj) if cacheable else None)
+        return obj
+
+    def get_by(self, column: str, value, db: Session):
+        """The row whose unique `column` equals `value`, or None"""
+        lookups = db.info.setdefault(LOOKUPS_KEY, {})
+        request_key, key = (self.model, column, value), (column, value)
+        pk = lookups.get(request_key) or self._get(key)
+        if pk is not None:
+            obj = self.get(pk, db)
+            if obj is not None and getattr(obj, column) == value:
+                lookups[request_key] = pk
+                return obj
+            # The id went to another row (an insert rolled back and its id reused)
+            lookups.pop(request_key, None)
+            self.invalidate([key])
+
+        token = self._begin_fill(key)
+        obj = db.query(self.model).filter(getattr(self.model, column) == value).first()
+        self._finish_fill(key, token, obj.id if obj is not None else None)
+        if obj is not None:
+            lookups[request_key] = obj.id
+        return obj
+
+    def _written(self, key: tuple, db: Session) -> bool:
+        return any(cache is self and key in keys for cache, keys in db.info.get(PENDING_KEY, ()))
+
+    def invalidate_on_commit(self, keys: Iterable[tuple], db: Session):
+        """Invalidate now, and again when `db`'s transaction ends"""
+        keys = list(keys)
+        self.invalidate(keys)
+        db.info.setdefault(PENDING_KEY, []).append((self, keys))
+
+patients = EntityCache(models.Patients, exclude=("data_version",)) # Loaded fresh when read, for ETags
+users = EntityCache(models.Users, exclude=("hashed_password",)) # Login reads the hash itself, fresh
+
+def invalidate_patients(patient_ids, db: Session):
+    patients.invalidate_on_commit([("id", patient_id) for patient_id in patient_ids], db)
+
+def clear():
+    patients.clear()
+    users.clear()
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _transaction_ended(session: Session):
+    for cache, keys in session.info.pop(PENDING_KEY, ()):
+        cache.invalidate(keys)
+
+def _patient_event(published: dict):
+    # Every patient write publishes an event after committing; with a shared backend this runs on every worker
+    patients.invalidate([("id", published["patient_id"])])
+
+hub.add_listener(_patient_event)
+
+def render_metrics() -> str:
+    """Hit and miss counters in the Prometheus text format"""
+    lines = []
+    for name, kind, help_text, attribute in (
+        ("hits_total", "counter", "Entity lookups answered from the cache", "hits"),
+        ("misses_total", "counter", "Entity lookups that read the database", "misses"),
+    ):
+        lines.append(f"# HELP vm_entity_cache_{name} {help_text}")
+        lines.append(f"# TYPE vm_entity_cache_{name} {kind}")
+        for model, cache in (("patients", patients), ("users", users)):
+            lines.append(f'vm_entity_cache_{name}{{model="{model}"}} {getattr(cache, attribute)}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,168 @@
+"""Streaming export of a patient's full record (patient, notes, vitals, sharing) as NDJSON or CSV.
+
+Rows are read as plain tuples through server-side cursors (`yield_per`) and
+written out as they arrive, so memory stays flat however long the history is.
+They come from the patient's shard; user and team names are looked up on the
+primary a batch at a time. Sharing covers the current user and team grants
+plus the share/revoke history from the audit trail, which is on the primary.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+
+import models, sharding
+from audit import audit_log
+from database import SessionLocal
+
+BATCH_SIZE = 500 # Rows fetched per round trip
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+PATIENT_FIELDS = ("id", "name", "phone_number", "membership_price", "physician_id")
+NOTE_FIELDS = (
+    "id", "patient_id", "physician_id", "physician_name", "created_at",
+    "chief_complaint", "subjective", "objective", "assessment", "plan", "raw_notes",
+)
+VITALS_FIELDS = (
+    "id", "patient_id", "physician_id", "created_at",
+    "systolic_bp", "diastolic_bp", "heart_rate", "temperature", "spo2",
+)
+ACCESS_FIELDS = (
+    "id", "patient_id", "user_id", "user_name", "user_email", "permission",
+    "granted_by", "granted_by_name", "created_at",
+)
+TEAM_ACCESS_FIELDS = (
+    "id", "patient_id", "team_id", "team_name", "permission", "granted_by", "granted_by_name", "created_at",
+)
+SHARING_HISTORY_FIELDS = ("id", "patient_id", "user_id", "user_name", "action", "detail", "created_at")
+SHARING_ACTIONS = ("share", "revoke") # see audit.ACTIONS
+
+# One CSV holds every record type; each row fills the columns of its type
+CSV_FIELDS = ("record_type",) + tuple(dict.fromkeys(
+    PATIENT_FIELDS + NOTE_FIELDS + VITALS_FIELDS + ACCESS_FIELDS + TEAM_ACCESS_FIELDS + SHARING_HISTORY_FIELDS
+))
+
+def _streamed(db, stmt):
+    return db.execute(stmt.execution_options(yield_per=BATCH_SIZE))
+
+def _with_users(db, result, fields, users_of: dict, teams: bool = False):
+    """The rows of `result` as dicts of `fields`, filling "<name>_name" / "<name>_email" from the user ids in
+    `users_of` (id column -> name prefix), and "team_name" from "team_id" if `teams`. Users and teams are on
+    the primary, so they are read per batch rather than joined.
+    """
+    users, team_names = {}, {}
+    for batch in result.partitions():
+        rows = [row._asdict() for row in batch]
+        missing = {row[column] for row in rows for column in users_of} - users.keys() - {None}
+        if missing:
+            users.update((user.id, user) for user in db.execute(
+                select(models.Users.id, models.Users.name, models.Users.email).where(models.Users.id.in_(missing))
+            ))
+        missing = {row["team_id"] for row in rows} - team_names.keys() if teams else set()
+        if missing:
+            team_names.update(db.execute(
+                select(models.Teams.id, models.Teams.name).where(models.Teams.id.in_(missing))
+            ).tuples().all())
+        for row in rows:
+            for column, prefix in users_of.items():
+                user = users.get(row[column])
+                row[f"{prefix}_name"] = user.name if user else None
+                row[f"{prefix}_email"] = user.email if user else None
+            if teams:
+                row["team_name"] = team_names.get(row["team_id"])
+            yield {field: row[field] for field in fields}
+
+def iter_records(patient_id: int):
+    """(record_type, dict) for everything stored about a patient, oldest first per type"""
+    with SessionLocal() as root:
+        db = sharding.for_patient(patient_id, root)
+        patient = db.execute(
+            select(*(getattr(models.Patients, f) for f in PATIENT_FIELDS)).where(models.Patients.id == patient_id)
+        ).first()
+        if patient is None:
+            return
+        yield "patient", patient._asdict()
+
+        notes = _streamed(db, select(
+            models.Notes.id, models.Notes.patient_id, models.Notes.physician_id, models.Notes.created_at,
+            models.Notes.chief_complaint, models.Notes.subjective, models.Notes.objective,
+            models.Notes.assessment, models.Notes.plan, models.Notes.raw_notes,
+        ).where(
+            models.Notes.patient_id == patient_id
+        ).order_by(models.Notes.created_at, models.Notes.id))
+        for record in _with_users(root, notes, NOTE_FIELDS, {"physician_id": "physician"}):
+            yield "note", record
+
+        vitals = _streamed(db, select(
+            *(getattr(models.Vitals, f) for f in VITALS_FIELDS)
+        ).where(
+            models.Vitals.patient_id == patient_id
+        ).order_by(models.Vitals.created_at, models.Vitals.id))
+        for row in vitals:
+            yield "vitals", row._asdict()
+
+        access = _streamed(db, select(
+            models.SharedAccess.id, models.SharedAccess.patient_id, models.SharedAccess.user_id,
+            models.SharedAccess.permission, models.SharedAccess.granted_by, models.SharedAccess.created_at,
+        ).where(
+            models.SharedAccess.patient_id == patient_id
+        ).order_by(models.SharedAccess.created_at, models.SharedAccess.id))
+        for record in _with_users(root, access, ACCESS_FIELDS, {"user_id": "user", "granted_by": "granted_by"}):
+            yield "access", record
+
+        team_access = _streamed(db, select(
+            models.TeamAccess.id, models.TeamAccess.patient_id, models.TeamAccess.team_id,
+            models.TeamAccess.permission, models.TeamAccess.granted_by, models.TeamAccess.created_at,
+        ).where(
+            models.TeamAccess.patient_id == patient_id
+        ).order_by(models.TeamAccess.created_at, models.TeamAccess.id))
+        for record in _with_users(root, team_access, TEAM_ACCESS_FIELDS, {"granted_by": "granted_by"}, teams=True):
+            yield "team_access", record
+
+        audit_log.flush() # Shares and revokes still buffered belong in the history too
+        history = _streamed(root, select(
+            models.AuditEvents.id, models.AuditEvents.patient_id, models.AuditEvents.user_id,
+            models.AuditEvents.action, models.AuditEvents.detail, models.AuditEvents.created_at,
+        ).where(
+            models.AuditEvents.patient_id == patient_id,
+            models.AuditEvents.action.in_(SHARING_ACTIONS)
+        ).order_by(models.AuditEvents.created_at, models.AuditEvents.id))
+        for record in _with_users(root, history, SHARING_HISTORY_FIELDS, {"user_id": "user"}):
+            yield "sharing_history", record
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return getattr(value, "value", value) # Enums
+
+def ndjson_lines(patient_id: int):
+    """One JSON object per line, tagged with its record_type"""
+    yield json.dumps({"record_type": "export", "patient_id": patient_id, "exported_at": datetime.utcnow().isoformat()}) + "\n"
+    for record_type, record in iter_records(patient_id):
+        record = {k: _plain(v) for k, v in record.items()}
+        yield json.dumps({"record_type": record_type, **record}, ensure_ascii=False) + "\n"
+
+def csv_lines(patient_id: int, flush_every: int = 100):
+    """CSV rows, flushed to the client every `flush_every` rows"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+
+    for count, (record_type, record) in enumerate(iter_records(patient_id), 1):
+        writer.writerow({"record_type": record_type, **{k: _plain(v) for k, v in record.items()}})
+        if count % flush_every == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_lines(patient_id: int, format: str):
+    if format == "csv":
+        return csv_lines(patient_id)
+    return ndjson_lines(patient_id)
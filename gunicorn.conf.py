@@ -0,0 +1,50 @@
+"""Production server: gunicorn managing uvicorn workers.
+
+    gunicorn app:app -c gunicorn.conf.py
+
+The master imports the app once (preload_app), migrates the schema, loads the
+heavy libraries and then forks the workers, which share all of that as
+copy-on-write memory instead of each importing it again. Connections are never
+carried across the fork: the master disposes of its pool before forking, and
+each worker starts with a fresh one.
+
+Settings: WEB_CONCURRENCY (workers, default one per CPU), PORT or BIND,
+GUNICORN_TIMEOUT, GUNICORN_PRELOAD. Worker and connection counts multiply: keep
+WEB_CONCURRENCY x (pool_size + max_overflow) under the database's max_connections.
+"""
+import gc
+import os
+
+# Schema changes run once, below, instead of in every worker's startup
+os.environ.setdefault("AUTO_MIGRATE", "0")
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 2)))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0" # 0 only to measure the difference
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120")) # Reports and transcription can take a while
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+
+def on_starting(server):
+    """Runs once in the master, after the app is imported and before any worker is forked"""
+    from database import engine
+    import migrate, sharding, warmup
+
+    migrate.init_schema(engine)
+    warmup.run()
+    engine.dispose() # Close the master's connections; a socket shared across processes corrupts both ends
+    sharding.dispose()
+
+    # Move everything loaded so far out of the collector's reach. Otherwise the first collection
+    # in each worker writes to every object's header and un-shares the pages holding them
+    gc.freeze()
+
+def post_fork(server, worker):
+    from database import engine
+    import sharding
+
+    # Forget any pooled connections inherited from the master without closing them under it
+    engine.dispose(close=False)
+    sharding.dispose(close=False)
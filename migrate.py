@@ -0,0 +1,67 @@
+"""Create and upgrade the database schema.
+
+    python migrate.py    # as a deploy step, before starting the new version
+
+Every step is idempotent. The app runs init_schema() at startup unless
+AUTO_MIGRATE=0; the gunicorn config turns that off and runs it once in the
+master instead, so workers starting together don't all issue the same DDL.
+With SHARD_URLS set it also upgrades every shard (see sharding.py).
+"""
+from sqlalchemy import inspect, text
+from database import Base, add_missing_columns, add_missing_indexes, widen_string_columns
+import models, partitioning, search, sharding
+
+def dedupe_shared_access(engine):
+    """Keep the latest of duplicate (patient, user) grants so their unique index can be built"""
+    indexes = inspect(engine).get_indexes("shared_access")
+    if any(index["name"] == "ix_shared_access_patient_user" for index in indexes):
+        return
+    with engine.begin() as conn:
+        conn.execute(text(
+            "DELETE FROM shared_access WHERE id NOT IN "
+            "(SELECT MAX(id) FROM shared_access GROUP BY patient_id, user_id)"
+        ))
+
+def init_schema(engine):
+    Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    widen_string_columns(engine)
+    dedupe_shared_access(engine)
+    add_missing_indexes(engine)
+    search.install(engine)
+    partitioning.ensure_partitions(engine)
+    if sharding.enabled():
+        init_shards(engine)
+
+def init_shard_schema(engine, shard):
+    """Schema of an extra shard: the sharded tables only, issuing ids from the shard's range"""
+    metadata = sharding.shard_metadata()
+    metadata.create_all(engine)
+    add_missing_columns(engine)
+    widen_string_columns(engine)
+    add_missing_indexes(engine, metadata)
+    search.install(engine)
+    partitioning.ensure_partitions(engine)
+    sharding.reserve_ids(engine, shard)
+
+def place_existing_owners(engine):
+    """Directory entries for owners who had patients on the primary before it was sharded"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO physician_shards (physician_id, shard, created_at) "
+            "SELECT DISTINCT physician_id, 0, CURRENT_TIMESTAMP FROM patients "
+            "WHERE physician_id NOT IN (SELECT physician_id FROM physician_shards)"
+        ))
+
+def init_shards(engine):
+    sharding.reserve_ids(engine, sharding.PRIMARY)
+    place_existing_owners(engine)
+    for shard, shard_engine in sharding.engines().items():
+        if shard != sharding.PRIMARY:
+            init_shard_schema(shard_engine, shard)
+
+if __name__ == "__main__":
+    from database import engine
+
+    init_schema(engine)
+    print("Schema is up to date.")
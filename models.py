@@ -1,6 +1,6 @@
 from sqlalchemy.orm import mapped_column, relationship, Mapped
 from database import Base
-from sqlalchemy import String, ForeignKey, DateTime, Text, Integer, Float, Enum
+from sqlalchemy import String, ForeignKey, DateTime, Text, Integer, Float, Enum, Index
 from typing import List
 from datetime import datetime
 import enum
@@ -15,7 +15,7 @@ class Users(Base):
     id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name : Mapped[str] = mapped_column(String(50), nullable=False, index=True)
     email : Mapped[str] = mapped_column(String(100), nullable=False, index=True)
-    hashed_password : Mapped[str] = mapped_column(String(100), nullable=False)
+    hashed_password : Mapped[str] = mapped_column(String(255), nullable=False) # argon2 hashes grow with their parameters
     role : Mapped[str] = mapped_column(String(20), default='physician')
 
     # Relationships
@@ -51,6 +51,9 @@ class Patients(Base):
     # Keeping physician_id to minimize refactor, but pointing to users.id
     physician_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"))
 
+    # Bumped on every change to the patient's notes, vitals or sharing; used for ETags
+    data_version : Mapped[int] = mapped_column(Integer, default=0, server_default='0', nullable=False)
+
     owner : Mapped["Users"] = relationship(
         back_populates = 'owned_patients',
         foreign_keys=[physician_id]
@@ -71,6 +74,11 @@ class Patients(Base):
 
 class SharedAccess(Base):
     __tablename__ = 'shared_access'
+    __table_args__ = (
+        # One grant per (patient, user): the target of the bulk share upsert
+        Index('ix_shared_access_patient_user', 'patient_id', 'user_id', unique=True),
+        Index('ix_shared_access_user', 'user_id'),
+    )
     
     id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     patient_id : Mapped[int] = mapped_column(ForeignKey('patients.id', ondelete="CASCADE"))
@@ -87,6 +95,10 @@ class SharedAccess(Base):
 
 class Notes(Base):
     __tablename__ = 'notes'
+    __table_args__ = (
+        # Per-patient history and date-range reads; on Postgres also the partition key (see partitioning.py)
+        Index('ix_notes_patient_created', 'patient_id', 'created_at'),
+    )
 
     id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     physician_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE")) # The author
@@ -101,6 +113,9 @@ class Notes(Base):
     
     # Raw transcription from voice
     raw_notes : Mapped[str] = mapped_column(Text, nullable=True)
+
+    # Normalised tokens of all text fields, indexed for full-text search (see search.py)
+    search_text : Mapped[str] = mapped_column(Text, nullable=True)
     
     # Timestamp
     created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -112,8 +127,16 @@ class Notes(Base):
         back_populates = 'notes'
     )
 
+    @property
+    def physician_name(self) -> str:
+        """Author's name, as serialised by schemas.NoteResponse"""
+        return self.author.name
+
 class Vitals(Base):
     __tablename__ = 'vitals'
+    __table_args__ = (
+        Index('ix_vitals_patient_created', 'patient_id', 'created_at'),
+    )
 
     id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     physician_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE")) # The author
@@ -135,3 +158,150 @@ class Vitals(Base):
     patient : Mapped['Patients'] = relationship(
         back_populates = 'vitals'
     )
+
+class IdempotencyKeys(Base):
+    """Client-generated keys for note/vitals writes, so retried or replayed writes are applied once"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        Index('ix_idempotency_keys_user_key', 'user_id', 'key', unique=True),
+    )
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE")) # The author
+    key : Mapped[str] = mapped_column(String(64), nullable=False)
+    kind : Mapped[str] = mapped_column(String(10), nullable=False) # 'note' or 'vitals'
+    patient_id : Mapped[int] = mapped_column(Integer, nullable=True) # Patient of the record; NULL on keys from before it was kept
+    record_id : Mapped[int] = mapped_column(Integer, nullable=False) # Id of the created note/vitals row
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class RefreshTokens(Base):
+    """Refresh tokens, stored as sha256 hashes. A login starts a family; each refresh rotates to a new token in it"""
+    __tablename__ = 'refresh_tokens'
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"), index=True)
+    token_hash : Mapped[str] = mapped_column(String(64), nullable=False, unique=True)
+    family_id : Mapped[str] = mapped_column(String(32), nullable=False, index=True)
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    expires_at : Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    used_at : Mapped[datetime] = mapped_column(DateTime, nullable=True) # Set when rotated; a second use means the token leaked
+    revoked_at : Mapped[datetime] = mapped_column(DateTime, nullable=True)
+
+class TokenRevocations(Base):
+    """Revoked access-token ids (jti) and refresh-token families, mirrored into every worker's in-memory filter"""
+    __tablename__ = 'token_revocations'
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    token_id : Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+    expires_at : Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True) # After this the token is dead anyway
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+
+class ReportJobs(Base):
+    """Progress of a batch report download, readable from any worker while the archive streams"""
+    __tablename__ = 'report_jobs'
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"), index=True)
+    period : Mapped[str] = mapped_column(String(10), nullable=False)
+    total : Mapped[int] = mapped_column(Integer, nullable=False)
+    done : Mapped[int] = mapped_column(Integer, nullable=False, default=0) # Reports written to the archive, failed ones included
+    failed : Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    status : Mapped[str] = mapped_column(String(10), nullable=False, default="running") # running, complete, cancelled, error
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, index=True)
+    updated_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class Alerts(Base):
+    """Vitals readings flagged by the anomaly scan (see anomaly.py)"""
+    __tablename__ = 'alerts'
+    __table_args__ = (
+        Index('ix_alerts_patient_created', 'patient_id', 'created_at'),
+        Index('ix_alerts_vitals_metric_kind', 'vitals_id', 'metric', 'kind', unique=True),
+    )
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    patient_id : Mapped[int] = mapped_column(ForeignKey('patients.id', ondelete="CASCADE"))
+    vitals_id : Mapped[int] = mapped_column(Integer, nullable=False) # The reading; not a foreign key, vitals may be partitioned
+    metric : Mapped[str] = mapped_column(String(20), nullable=False) # systolic_bp, diastolic_bp, heart_rate, temperature, spo2
+    kind : Mapped[str] = mapped_column(String(10), nullable=False) # threshold, zscore, trend
+    severity : Mapped[str] = mapped_column(String(10), nullable=False) # warning, critical
+    value : Mapped[float] = mapped_column(Float, nullable=False)
+    baseline : Mapped[float] = mapped_column(Float, nullable=True) # Recent mean (zscore) or change over the window (trend)
+    message : Mapped[str] = mapped_column(String(200), nullable=False)
+    created_at : Mapped[datetime] = mapped_column(DateTime, nullable=False) # When the reading was taken
+    detected_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class ScanWatermarks(Base):
+    """Highest row id a background scan has processed, so the next run only reads newer rows"""
+    __tablename__ = 'scan_watermarks'
+
+    name : Mapped[str] = mapped_column(String(50), primary_key=True)
+    last_id : Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    updated_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+class Teams(Base):
+    """A group of users; patients shared with a team are accessible to all its members"""
+    __tablename__ = 'teams'
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    name : Mapped[str] = mapped_column(String(100), nullable=False)
+    owner_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"), index=True) # Manages the members
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    members : Mapped[List['TeamMembers']] = relationship(back_populates='team', cascade="all, delete-orphan")
+
+class TeamMembers(Base):
+    __tablename__ = 'team_members'
+    __table_args__ = (
+        Index('ix_team_members_team_user', 'team_id', 'user_id', unique=True),
+        Index('ix_team_members_user', 'user_id'),
+    )
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    team_id : Mapped[int] = mapped_column(ForeignKey('teams.id', ondelete="CASCADE"))
+    user_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"))
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    team : Mapped['Teams'] = relationship(back_populates='members')
+    user : Mapped['Users'] = relationship()
+
+class TeamAccess(Base):
+    """A patient shared with a whole team: one row however many members the team has"""
+    __tablename__ = 'team_access'
+    __table_args__ = (
+        Index('ix_team_access_team_patient', 'team_id', 'patient_id', unique=True),
+        Index('ix_team_access_patient', 'patient_id'),
+    )
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    team_id : Mapped[int] = mapped_column(ForeignKey('teams.id', ondelete="CASCADE"))
+    patient_id : Mapped[int] = mapped_column(ForeignKey('patients.id', ondelete="CASCADE"))
+    granted_by : Mapped[int] = mapped_column(ForeignKey('users.id'))
+    permission : Mapped[PermissionLevel] = mapped_column(Enum(PermissionLevel), default=PermissionLevel.VIEW)
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+    team : Mapped['Teams'] = relationship()
+
+class AuditEvents(Base):
+    """Who viewed or changed which patient (see audit.py)"""
+    __tablename__ = 'audit_events'
+    __table_args__ = (
+        # Newest first per patient or per user, paged by id
+        Index('ix_audit_events_patient_id', 'patient_id', 'id'),
+        Index('ix_audit_events_user_id', 'user_id', 'id'),
+    )
+
+    id : Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # Not foreign keys: the trail outlives deleted users and patients
+    user_id : Mapped[int] = mapped_column(Integer, nullable=False)
+    patient_id : Mapped[int] = mapped_column(Integer, nullable=False)
+    action : Mapped[str] = mapped_column(String(20), nullable=False) # see audit.ACTIONS
+    detail : Mapped[str] = mapped_column(String(200), nullable=True) # e.g. the user a share went to
+    created_at : Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True) # When it happened, not when it was written
+
+class PhysicianShards(Base):
+    """Which shard holds each physician's patients (see sharding.py); only written when there are several"""
+    __tablename__ = 'physician_shards'
+
+    physician_id : Mapped[int] = mapped_column(ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    shard : Mapped[int] = mapped_column(Integer, nullable=False, index=True) # 0 is the primary database
+    created_at : Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,205 @@
+"""Monthly range partitioning of notes and vitals on created_at, with an archive tier (Postgres only).
+
+    python partitioning.py convert    # one-off, in a maintenance window: partition the existing tables
+    python partitioning.py maintain   # daily from cron: create upcoming partitions, archive old ones
+
+Partitions are named notes_2025_01 etc.; rows outside every monthly range
+land in notes_default. The app calls ensure_partitions() at startup, so a
+missed cron run only means new rows wait in the default partition until the
+next run moves them into their month. Both commands cover every shard.
+
+Archiving keeps old partitions attached, so crud, exports and reports read
+them through the parent table as before. An archived partition is rewritten
+fully packed and frozen and, if ARCHIVE_TABLESPACE is set, moved with its
+indexes to that tablespace (put it on cheaper, compressed storage such as a
+ZFS/btrfs volume with compression on). Row-level TOAST compression would not
+help here: note and vitals rows are far below the TOAST threshold.
+
+On SQLite everything here is a no-op.
+"""
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+import models, sharding
+from config import settings
+
+PARTITIONED_TABLES = {"notes": models.Notes, "vitals": models.Vitals}
+
+MONTHS_AHEAD = settings.partition_months_ahead
+ARCHIVE_AFTER_MONTHS = settings.archive_after_months
+ARCHIVE_TABLESPACE = settings.archive_tablespace # Unset: archived partitions stay where they are
+ARCHIVED_COMMENT = "archived"
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+def _columns(table: str) -> str:
+    """Model columns, i.e. everything except generated ones like notes.search_vector"""
+    return ", ".join(column.name for column in PARTITIONED_TABLES[table].__table__.columns)
+
+def is_partitioned(conn, table: str) -> bool:
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    ).scalar() == "p"
+
+def partitions(conn, table: str):
+    """Names of the monthly partitions of a table"""
+    return [
+        name for name in conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+        ), {"table": table}).scalars()
+        if name != f"{table}_default"
+    ]
+
+def create_partition(conn, table: str, month: date) -> bool:
+    """Add the partition for `month`, moving any of its rows out of the default partition"""
+    name = partition_name(table, month)
+    if name in partitions(conn, table):
+        return False
+
+    start, end = month.isoformat(), add_months(month, 1).isoformat()
+    columns = _columns(table)
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMPRESSION)"
+    ))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {table}_default WHERE created_at >= '{start}' AND created_at < '{end}' RETURNING {columns}) "
+        f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved"
+    ))
+    # Indexes, the primary key and foreign keys are cloned from the parent on attach
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    return True
+
+def ensure_partitions(engine, months_ahead: int = MONTHS_AHEAD):
+    """Create partitions from the current month to `months_ahead` months out"""
+    if engine.dialect.name != "postgresql":
+        return []
+    created = []
+    this_month = month_start(datetime.utcnow())
+    with engine.begin() as conn:
+        for table in PARTITIONED_TABLES:
+            if not is_partitioned(conn, table):
+                continue
+            for offset in range(months_ahead + 1):
+                month = add_months(this_month, offset)
+                if create_partition(conn, table, month):
+                    created.append(partition_name(table, month))
+    return created
+
+def convert(engine, shard: int = sharding.PRIMARY):
+    """Rebuild notes and vitals as partitioned tables, keeping ids, data and constraints.
+
+    `shard` is the shard `engine` belongs to: extra shards have no users table to reference.
+    """
+    if engine.dialect.name != "postgresql":
+        print("Partitioning is only supported on Postgres; nothing to do.")
+        return
+
+    shard_tables = sharding.shard_metadata().tables
+    for table, model in PARTITIONED_TABLES.items():
+        definition = model.__table__ if shard == sharding.PRIMARY else shard_tables[table]
+        with engine.begin() as conn:
+            if is_partitioned(conn, table):
+                print(f"{table} is already partitioned")
+                continue
+
+            old = f"{table}_unpartitioned"
+            columns = _columns(table)
+            sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}).scalar()
+            first = conn.execute(text(f"SELECT min(created_at) FROM {table}")).scalar()
+
+            conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+            conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+            conn.execute(text(
+                f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMPRESSION) "
+                f"PARTITION BY RANGE (created_at)"
+            ))
+            # The id sequence would otherwise be dropped along with the old table
+            conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+
+            conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+            month = month_start(first or datetime.utcnow())
+            last = add_months(month_start(datetime.utcnow()), MONTHS_AHEAD)
+            while month <= last:
+                create_partition(conn, table, month)
+                month = add_months(month, 1)
+
+            conn.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old}"))
+            conn.execute(text(f"DROP TABLE {old}"))
+
+            # Unique constraints on a partitioned table must include the partition key
+            conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)"))
+            for fk in definition.foreign_key_constraints:
+                element = fk.elements[0]
+                on_delete = f" ON DELETE {fk.ondelete}" if fk.ondelete else ""
+                conn.execute(text(
+                    f"ALTER TABLE {table} ADD FOREIGN KEY ({element.parent.name}) "
+                    f"REFERENCES {element.column.table.name} ({element.column.name}){on_delete}"
+                ))
+            for index in definition.indexes:
+                index.create(conn)
+            print(f"{table}: partitioned by month")
+
+    # Full-text index on the new notes table
+    import search
+    search.install(engine)
+
+def archive_partitions(engine, after_months: int = ARCHIVE_AFTER_MONTHS, tablespace: str = ARCHIVE_TABLESPACE):
+    """Move partitions older than `after_months` to the cold tier; they stay attached and readable"""
+    if engine.dialect.name != "postgresql":
+        return []
+    cutoff = add_months(month_start(datetime.utcnow()), -after_months)
+    archived = []
+    for table in PARTITIONED_TABLES:
+        with engine.begin() as conn:
+            if not is_partitioned(conn, table):
+                continue
+            candidates = [
+                name for name in partitions(conn, table)
+                if name < partition_name(table, cutoff)
+                and conn.execute(text("SELECT obj_description(to_regclass(:name), 'pg_class')"), {"name": name}).scalar() != ARCHIVED_COMMENT
+            ]
+        for name in candidates:
+            with engine.begin() as conn:
+                # Archived months are no longer written, so pack pages completely
+                conn.execute(text(f"ALTER TABLE {name} SET (fillfactor = 100)"))
+                if tablespace:
+                    conn.execute(text(f"ALTER TABLE {name} SET TABLESPACE {tablespace}"))
+                    for index in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :name"), {"name": name}).scalars():
+                        conn.execute(text(f"ALTER INDEX {index} SET TABLESPACE {tablespace}"))
+                conn.execute(text(f"COMMENT ON TABLE {name} IS '{ARCHIVED_COMMENT}'"))
+            # Rewrite compactly and freeze so the partition never needs vacuuming again.
+            # VACUUM can't run in a transaction; the lock only covers this partition
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(f"VACUUM (FULL, FREEZE, ANALYZE) {name}"))
+            archived.append(name)
+    return archived
+
+def maintain(engine):
+    created = ensure_partitions(engine)
+    archived = archive_partitions(engine)
+    print(f"Created partitions: {', '.join(created) or 'none'}")
+    print(f"Archived partitions: {', '.join(archived) or 'none'}")
+
+if __name__ == "__main__":
+    commands = ("convert", "maintain")
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        raise SystemExit(f"usage: python partitioning.py {{{'|'.join(commands)}}}")
+    # Notes and vitals live on their patient's shard
+    for shard, engine in sharding.engines().items():
+        if sharding.enabled():
+            print(f"Shard {shard}:")
+        if sys.argv[1] == "convert":
+            convert(engine, shard)
+        else:
+            maintain(engine)
@@ -0,0 +1,142 @@
+"""Real-time patient events (new notes, vitals, permission changes) pushed over Server-Sent Events.
+
+Endpoints publish to the hub; every worker's hub fans events out to the streams
+subscribed to that patient. Cross-worker delivery goes through a pluggable backend.
+"""
+import asyncio
+import json
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+HEARTBEAT_SECONDS = 20
+MAX_PENDING_EVENTS = 100
+
+class LocalBackend:
+    """In-process stand-in for a cross-worker pub/sub backend.
+
+    A shared backend (Redis pub/sub, Postgres LISTEN/NOTIFY) implements the same
+    three methods and calls `deliver` on every worker, including the publisher.
+    """
+
+    def start(self, deliver: Callable[[str], None]):
+        self._deliver = deliver
+
+    def publish(self, message: str):
+        self._deliver(message)
+
+    def stop(self):
+        pass
+
+class Subscription:
+    """One connected stream for one patient"""
+
+    def __init__(self, patient_id: int, user_id: int, is_owner: bool):
+        self.patient_id = patient_id
+        self.user_id = user_id
+        self.is_owner = is_owner
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+        self.overflowed = False
+
+    def wants(self, event: dict) -> bool:
+        """Permission changes only go to the owner and the user they affect"""
+        if event["type"] != "access":
+            return True
+        return self.is_owner or event["data"]["user_id"] == self.user_id
+
+    def put(self, event: dict):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client: drop the stream and let it resync with a full reload
+            self.overflowed = True
+
+class PatientEventHub:
+    """Fans patient events out to subscribed streams"""
+
+    def __init__(self, backend=None):
+        self._subscriptions: Dict[int, Set[Subscription]] = {}
+        self._listeners: List[Callable[[dict], None]] = []
+        self._lock = threading.Lock()
+        self.backend = backend or LocalBackend()
+        self.backend.start(self._deliver)
+
+    def subscribe(self, patient_id: int, user_id: int, is_owner: bool) -> Subscription:
+        subscription = Subscription(patient_id, user_id, is_owner)
+        with self._lock:
+            self._subscriptions.setdefault(patient_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.patient_id)
+            if subscribers:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.patient_id]
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """Call `listener` with every event delivered to this worker, e.g. to invalidate caches"""
+        self._listeners.append(listener)
+
+    def publish(self, patient_id: int, event_type: str, data: dict):
+        """Publish an event; safe to call from sync endpoints running in the threadpool"""
+        message = json.dumps({"patient_id": patient_id, "type": event_type, "data": data}, default=str)
+        self.backend.publish(message)
+
+    def _deliver(self, message: str):
+        event = json.loads(message)
+        for listener in self._listeners:
+            listener(event)
+        with self._lock:
+            subscribers = list(self._subscriptions.get(event["patient_id"], ()))
+
+        for subscription in subscribers:
+            if not subscription.wants(event):
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # Loop already closed (worker shutting down)
+                self.unsubscribe(subscription)
+
+def format_sse(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def event_stream(hub: PatientEventHub, subscription: Subscription, expires_at: Optional[datetime] = None):
+    """Yield SSE frames for a subscription until the client disconnects, loses access or its token expires"""
+    try:
+        yield "retry: 5000\n\n"
+        yield format_sse("ready", {"patient_id": subscription.patient_id})
+
+        while True:
+            if subscription.overflowed:
+                yield format_sse("resync", {})
+                return
+
+            timeout = HEARTBEAT_SECONDS
+            if expires_at is not None:
+                remaining = (expires_at - datetime.utcnow()).total_seconds()
+                if remaining <= 0:
+                    yield format_sse("expired", {})
+                    return
+                timeout = min(timeout, remaining)
+
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+
+            data = event["data"]
+            if event["type"] == "access" and data["user_id"] == subscription.user_id and not data["permission"]:
+                yield format_sse("revoked", data)
+                return
+
+            yield format_sse(event["type"], data)
+    finally:
+        hub.unsubscribe(subscription)
+
+hub = PatientEventHub(LocalBackend())
@@ -0,0 +1,303 @@
+"""PDF patient summary reports, one at a time or as a streamed ZIP of many.
+
+render_pdf() takes plain, picklable data (built by report_data() from
+crud.get_report_data() rows), so the same function renders a single report in
+the request thread and batch reports in a process pool, where reportlab's
+CPU-bound layout runs on every core instead of contending for one GIL.
+
+A batch is read in groups of GROUP_SIZE patients (three queries per group),
+rendered REPORT_WORKERS at a time, and written to the ZIP in the order the
+PDFs finish, so the download starts with the first finished file. The archive
+ends with manifest.json listing every patient and any report that failed.
+Progress is kept in report_jobs, readable from any worker while it streams.
+"""
+import asyncio
+import io
+import json
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+from typing import List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+import crud, warmup
+from config import settings
+from database import SessionLocal
+
+PERIODS = ("week", "month", "all", "custom")
+
+REPORT_WORKERS = settings.report_workers
+REPORT_NICE = settings.report_nice # Below the API processes, like password hashing
+MAX_BATCH_PATIENTS = settings.report_batch_max_patients
+GROUP_SIZE = 50 # Patients read per round of queries
+MAX_IN_FLIGHT = REPORT_WORKERS * 2 # Rendered reports waiting to be written, bounds memory
+PROGRESS_INTERVAL = 1.0 # Seconds between progress writes
+
+def period_range(period: str, start_date: Optional[str], end_date: Optional[str], now: datetime) -> Tuple[datetime, datetime]:
+    """Start and end of a report period. Raises ValueError for a bad custom range"""
+    if period == "month":
+        return now - timedelta(days=30), now
+    if period == "all":
+        return datetime.min, now
+    if period == "custom":
+        if not start_date or not end_date:
+            raise ValueError("Start and End dates required for custom period")
+        try:
+            return (datetime.strptime(start_date, "%Y-%m-%d"),
+                    datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)) # inclusive
+        except ValueError:
+            raise ValueError("Invalid date format. Use YYYY-MM-DD")
+    return now - timedelta(weeks=1), now
+
+def report_data(rows: dict, start: datetime, end: datetime, generated: datetime) -> dict:
+    """Everything render_pdf needs, from one patient's crud.get_report_data() entry"""
+    return {**rows, "start": start, "end": end, "generated": generated}
+
+def filename(report: dict, period: str) -> str:
+    patient = report["patient"]
+    name = re.sub(r'[\s\\/:*?"<>|]+', "_", patient["name"] or "").strip("_.") # Keep Devanagari names readable
+    return f"report_{patient['id']}_{name}_{period}.pdf" if name else f"report_{patient['id']}_{period}.pdf"
+
+# Rendering
+def render_pdf(report: dict) -> bytes:
+    """A patient summary report as PDF bytes. Runs in the request thread or a pool process"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    # Register Hindi Font (once per process)
+    has_hindi_font = warmup.devanagari_font()
+
+    def format_text(text):
+        """Wraps runs of Devanagari characters (U+0900 to U+097F) in the Hindi font; the font has no Latin glyphs"""
+        if not text: return "-"
+        if not has_hindi_font: return str(text)
+        return re.sub(r'([\u0900-\u097F]+)', r'<font face="Devanagari">\1</font>', str(text))
+
+    patient = report["patient"]
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    elements = []
+
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(name='HindiNormal', parent=styles['Normal'], fontName='Helvetica', leading=14))
+    styles.add(ParagraphStyle(name='HindiSmall', parent=styles['Normal'], fontName='Helvetica', fontSize=9, leading=12))
+
+    # Header
+    elements.append(Paragraph(f"<b>Patient Summary Report</b>", styles['Heading1']))
+    elements.append(Spacer(1, 12))
+
+    # Patient Info Table
+    header_data = [
+        [Paragraph(f"<b>Patient Name:</b> {format_text(patient['name'])}", styles['HindiNormal']),
+         Paragraph(f"<b>Generated on:</b> {report['generated'].strftime('%d-%b-%Y %H:%M')}", styles['Normal'])],
+        [Paragraph(f"<b>Period:</b> {report['start'].strftime('%d-%b-%Y')} to {report['end'].strftime('%d-%b-%Y')}", styles['Normal']),
+         Paragraph(f"<b>Patient ID:</b> {patient['id']}", styles['Normal'])]
+    ]
+    t = Table(header_data, colWidths=[300, 200])
+    t.setStyle(TableStyle([
+        ('VALIGN', (0,0), (-1,-1), 'TOP'),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 10),
+    ]))
+    elements.append(t)
+    elements.append(Spacer(1, 20))
+
+    # Vitals Section
+    elements.append(Paragraph("<b>Vitals Summary</b>", styles['Heading2']))
+    elements.append(Spacer(1, 10))
+
+    if report['vitals']:
+        vitals_data = [['Date', 'BP (mmHg)', 'Heart Rate', 'Temp (F)', 'SpO2 (%)']]
+        for v in report['vitals'][:20]: # Limit for PDF
+            bp = f"{v['systolic_bp']}/{v['diastolic_bp']}" if v['systolic_bp'] else "-"
+            vitals_data.append([
+                v['created_at'].strftime('%d-%b-%Y %H:%M'),
+                bp,
+                str(v['heart_rate'] or '-'),
+                str(v['temperature'] or '-'),
+                str(v['spo2'] or '-')
+            ])
+
+        t_vitals = Table(vitals_data, colWidths=[120, 100, 80, 80, 80])
+        t_vitals.setStyle(TableStyle([
+            ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#f3f4f6')),
+            ('TEXTCOLOR', (0,0), (-1,0), colors.black),
+            ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+            ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0,0), (-1,0), 10),
+            ('BOTTOMPADDING', (0,0), (-1,0), 12),
+            ('BACKGROUND', (0,1), (-1,-1), colors.white),
+            ('GRID', (0,0), (-1,-1), 0.5, colors.grey),
+        ]))
+        elements.append(t_vitals)
+    else:
+        elements.append(Paragraph("No vitals recorded in this period.", styles['Normal']))
+
+    elements.append(Spacer(1, 20))
+
+    # Notes Section
+    elements.append(Paragraph("<b>Clinical Notes</b>", styles['Heading2']))
+    elements.append(Spacer(1, 10))
+
+    if report['notes']:
+        for n in report['notes']:
+            n_date = n['created_at'].strftime('%d-%b-%Y %H:%M')
+            elements.append(Paragraph(f"<b>Note by {format_text(n['author_name'])} on {n_date}</b>", styles['HindiNormal']))
+
+            content_parts = []
+            if n['assessment']: content_parts.append(f"<b>Assessment:</b> {format_text(n['assessment'])}")
+            if n['plan']: content_parts.append(f"<b>Plan:</b> {format_text(n['plan'])}")
+            if n['raw_notes']: content_parts.append(f"<b>Raw:</b> {format_text(n['raw_notes'])}")
+
+            for part in content_parts:
+                elements.append(Paragraph(part, styles['HindiSmall']))
+
+            elements.append(Spacer(1, 15))
+            elements.append(Paragraph("<hr/>", styles['Normal']))
+            elements.append(Spacer(1, 5))
+    else:
+        elements.append(Paragraph("No notes recorded in this period.", styles['Normal']))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+# Process pool
+def _init_worker():
+    os.nice(REPORT_NICE)
+    warmup.devanagari_font()
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: workers must not inherit the server's sockets and database connections
+        _pool = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=get_context("spawn"), initializer=_init_worker)
+    return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Forget a pool whose worker died (e.g. OOM-killed); the next report starts a fresh one"""
+    global _pool
+    if _pool is pool:
+        _pool = None
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+# Batch
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink for ZipFile (which then writes data descriptors); take() drains it"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _load_group(patient_ids: List[int], start: datetime, end: datetime, generated: datetime) -> List[dict]:
+    with SessionLocal() as db:
+        rows = crud.get_report_data(patient_ids, start, end, db)
+    return [report_data(rows[patient_id], start, end, generated) for patient_id in patient_ids if patient_id in rows]
+
+def _save_progress(job_id: int, values: dict):
+    with SessionLocal() as db:
+        crud.update_report_job(job_id, values, db)
+
+async def stream_batch(job_id: int, patient_ids: List[int], period: str, start: datetime, end: datetime, generated: datetime):
+    """ZIP archive bytes of the patients' reports, yielded as each PDF finishes"""
+    loop = asyncio.get_running_loop()
+    sink = _ZipStream()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) # PDFs are already compressed
+    pending = {} # render future -> report
+    entries = []
+    progress = {"done": 0, "failed": 0}
+    saved_at = time.monotonic()
+
+    def submit(report):
+        pool = _get_pool()
+        try:
+            future = loop.run_in_executor(pool, render_pdf, report)
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            future = loop.run_in_executor(_get_pool(), render_pdf, report)
+        pending[future] = report
+
+    async def write_finished(wait_for_all: bool):
+        nonlocal saved_at
+        while pending and (wait_for_all or len(pending) >= MAX_IN_FLIGHT):
+            finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                report = pending.pop(future)
+                entry = {"patient_id": report["patient"]["id"], "name": report["patient"]["name"]}
+                try:
+                    pdf = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        _discard_pool(_pool)
+                    print(f"Report for patient {entry['patient_id']} failed: {e!r}")
+                    entry.update(status="failed", error=str(e) or type(e).__name__)
+                    progress["failed"] += 1
+                else:
+                    entry.update(status="ok", file=filename(report, period))
+                    archive.writestr(entry["file"], pdf)
+                entries.append(entry)
+                progress["done"] += 1
+            data = sink.take()
+            if data:
+                yield data
+            if time.monotonic() - saved_at >= PROGRESS_INTERVAL:
+                saved_at = time.monotonic()
+                await run_in_threadpool(_save_progress, job_id, dict(progress))
+
+    status = "error"
+    try:
+        for index in range(0, len(patient_ids), GROUP_SIZE):
+            for report in await run_in_threadpool(_load_group, patient_ids[index:index + GROUP_SIZE], start, end, generated):
+                submit(report)
+                async for chunk in write_finished(wait_for_all=False):
+                    yield chunk
+        async for chunk in write_finished(wait_for_all=True):
+            yield chunk
+
+        archive.writestr("manifest.json", json.dumps({
+            "job_id": job_id,
+            "period": period,
+            "start": start.isoformat() if start != datetime.min else None,
+            "end": end.isoformat(),
+            "generated_at": generated.isoformat(),
+            "reports": entries,
+        }, ensure_ascii=False, indent=2))
+        archive.close()
+        yield sink.take()
+        status = "complete"
+    except (asyncio.CancelledError, GeneratorExit):
+        status = "cancelled" # The client went away
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+        await asyncio.shield(run_in_threadpool(_save_progress, job_id, {**progress, "status": status}))
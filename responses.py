@@ -0,0 +1,71 @@
+"""Fast JSON responses for the hot read endpoints.
+
+FastAPI's default path validates the returned objects against `response_model`,
+runs them through `jsonable_encoder` and then `json.dumps`. Here ORM rows are
+validated once by a cached TypeAdapter and serialised to bytes in pydantic-core,
+and the endpoint returns the finished Response so FastAPI skips its own pass.
+`response_model` stays on the routes for the OpenAPI schema.
+"""
+import math
+import struct
+import sys
+from array import array
+from typing import List, Optional
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+import schemas
+
+class JSONBytesResponse(Response):
+    media_type = "application/json"
+
+# Built once; constructing adapters per request would rebuild the validators
+PATIENT_DETAIL = TypeAdapter(schemas.PatientDetail)
+PATIENT_LIST = TypeAdapter(List[schemas.PatientListItem])
+NOTES = TypeAdapter(List[schemas.NoteResponse])
+VITALS = TypeAdapter(List[schemas.VitalsResponse])
+VITALS_COLUMNS = TypeAdapter(schemas.VitalsColumns)
+ACCESS_LIST = TypeAdapter(List[schemas.SharedAccessResponse])
+TEAM_ACCESS_LIST = TypeAdapter(List[schemas.TeamAccessResponse])
+
+def from_orm(adapter: TypeAdapter, rows, headers: Optional[dict] = None) -> JSONBytesResponse:
+    """Validate ORM rows (or plain dicts) once and serialise them straight to bytes"""
+    return JSONBytesResponse(adapter.dump_json(adapter.validate_python(rows, from_attributes=True)), headers=headers)
+
+def from_models(adapter: TypeAdapter, data, headers: Optional[dict] = None) -> JSONBytesResponse:
+    """Serialise already-validated pydantic models without validating them again"""
+    return JSONBytesResponse(adapter.dump_json(data), headers=headers)
+
+# Binary vitals (?format=binary)
+VITALS_BINARY_MEDIA_TYPE = "application/vnd.vriddhamitra.vitals"
+VITALS_BINARY_MAGIC = b"VTL1"
+MISSING_INT = -2**31
+
+def vitals_binary(columns: dict, headers: Optional[dict] = None) -> Response:
+    """Little-endian encoding of VitalsColumns for large ranges.
+
+    Layout: magic b"VTL1", uint32 count, then `count` values each of
+    float64 timestamps (epoch ms), float32 temperature (NaN = missing) and
+    int32 id, systolic_bp, diastolic_bp, heart_rate, spo2 (-2**31 = missing).
+    Every array starts aligned for its type, so browsers can wrap the buffer
+    in typed arrays without copying.
+    """
+    def ints(values):
+        return array("i", (MISSING_INT if v is None else v for v in values))
+
+    arrays = [
+        array("d", columns["timestamps"]),
+        array("f", (math.nan if v is None else v for v in columns["temperature"])),
+        ints(columns["id"]),
+        ints(columns["systolic_bp"]),
+        ints(columns["diastolic_bp"]),
+        ints(columns["heart_rate"]),
+        ints(columns["spo2"]),
+    ]
+    if sys.byteorder == "big":
+        for values in arrays:
+            values.byteswap()
+
+    body = VITALS_BINARY_MAGIC + struct.pack("<I", columns["count"]) + b"".join(a.tobytes() for a in arrays)
+    return Response(body, media_type=VITALS_BINARY_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,158 @@
+"""Revoked token ids held in memory, so authorising a request needs no database query.
+
+Revoking a token writes its id (an access token's jti, or a refresh-token
+family id) to the token_revocations table and adds it to this worker's bloom
+filter. A background thread polls the table every SYNC_SECONDS, so a
+revocation made by another worker is seen here within that window, and
+rebuilds the filter from unexpired rows every REBUILD_SECONDS so it never
+fills up with dead ids.
+
+A filter miss means the id is certainly not revoked. A hit is confirmed
+against the table, so a false positive costs one query, never a wrongful 401.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+import models
+from config import settings
+from database import SessionLocal
+
+SYNC_SECONDS = settings.revocation_sync_seconds
+REBUILD_SECONDS = settings.revocation_rebuild_seconds
+SYNC_OVERLAP = timedelta(seconds=60) # Re-read recent rows: a slow transaction may commit behind the watermark
+MIN_CAPACITY = 10_000
+ERROR_RATE = 0.001
+
+class BloomFilter:
+    """Fixed-size bloom filter over strings"""
+
+    def __init__(self, capacity: int, error_rate: float = ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2)) # Bits
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class RevocationList:
+    """This worker's view of token_revocations"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._filter: Optional[BloomFilter] = None
+        self._synced_through: Optional[datetime] = None
+        self._rebuilt_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def revoke(self, token_ids: Iterable[str], expires_at: datetime, db: Session):
+        """Record revoked ids; the caller commits"""
+        token_ids = list(token_ids)
+        db.add_all([models.TokenRevocations(token_id=token_id, expires_at=expires_at) for token_id in token_ids])
+        self._ensure_started()
+        with self._lock:
+            for token_id in token_ids:
+                self._filter.add(token_id)
+
+    def is_revoked(self, token_ids: Iterable[str], db: Session) -> bool:
+        """True if any of the ids has been revoked. Only queries the database on a filter hit"""
+        self._ensure_started()
+        hits = [token_id for token_id in token_ids if token_id and token_id in self._filter]
+        if not hits:
+            return False
+        return db.execute(
+            select(models.TokenRevocations.id).where(
+                models.TokenRevocations.token_id.in_(hits),
+                models.TokenRevocations.expires_at > datetime.utcnow(),
+            ).limit(1)
+        ).first() is not None
+
+    # Syncing
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            # Load synchronously once, so tokens revoked before a restart are rejected from the first request
+            self._rebuild()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="token-revocations", daemon=True)
+            self._thread.start()
+
+    def _rebuild(self):
+        """Replace the filter with one built from every unexpired revocation"""
+        now = datetime.utcnow()
+        with self._session_factory() as db:
+            token_ids = db.execute(
+                select(models.TokenRevocations.token_id).where(models.TokenRevocations.expires_at > now)
+            ).scalars().all()
+        bloom = BloomFilter(max(MIN_CAPACITY, 2 * len(token_ids)))
+        for token_id in token_ids:
+            bloom.add(token_id)
+        self._filter = bloom
+        self._synced_through = now
+        self._rebuilt_at = time.monotonic()
+
+    def _sync(self):
+        """Add revocations written since the last sync, by any worker"""
+        now = datetime.utcnow()
+        with self._session_factory() as db:
+            token_ids = db.execute(
+                select(models.TokenRevocations.token_id).where(
+                    models.TokenRevocations.created_at > self._synced_through - SYNC_OVERLAP
+                )
+            ).scalars().all()
+        with self._lock:
+            for token_id in token_ids:
+                self._filter.add(token_id)
+            self._synced_through = now
+
+    def _prune(self):
+        with self._session_factory() as db:
+            db.execute(delete(models.TokenRevocations).where(models.TokenRevocations.expires_at <= datetime.utcnow()))
+            db.execute(delete(models.RefreshTokens).where(models.RefreshTokens.expires_at <= datetime.utcnow()))
+            db.commit()
+
+    def _run(self):
+        while not self._stop.wait(SYNC_SECONDS):
+            try:
+                overfull = self._filter.count > self._filter.capacity
+                if overfull or time.monotonic() - self._rebuilt_at > REBUILD_SECONDS:
+                    self._prune()
+                    self._rebuild() # Revocations added meanwhile are picked up again by the sync overlap
+                else:
+                    self._sync()
+            except Exception as e:
+                # Database unavailable: keep the current filter and try again next round
+                print(f"Token revocation sync failed: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=SYNC_SECONDS)
+            self._thread = None
+
+revocations = RevocationList()
@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List, Dict
 
 class RegisterUser(BaseModel):
     name : str
@@ -28,6 +28,60 @@ class SharedAccessResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class BulkShareRequest(BaseModel):
+    patient_ids : List[int] = Field(min_length=1)
+    user_emails : List[EmailStr] = []
+    team_ids : List[int] = []
+    permission : str = 'VIEW' # VIEW or EDIT
+
+class BulkRevokeRequest(BaseModel):
+    patient_ids : List[int] = Field(min_length=1)
+    user_ids : List[int] = []
+    team_ids : List[int] = []
+
+class BulkShareResult(BaseModel):
+    patients : int
+    users : int
+    teams : int
+    grants : int # (patient, user or team) pairs written or removed
+
+class TeamAccessResponse(BaseModel):
+    id : int
+    patient_id : int
+    team_id : int
+    granted_by : int
+    permission : str
+    created_at : datetime
+    team_name : Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class TeamCreate(BaseModel):
+    name : str = Field(min_length=1, max_length=100)
+
+class TeamMembersAdd(BaseModel):
+    user_emails : List[EmailStr] = Field(min_length=1)
+
+class TeamMemberOut(BaseModel):
+    user_id : int
+    created_at : datetime
+    user_name : Optional[str] = None
+    user_email : Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class TeamOut(BaseModel):
+    id : int
+    name : str
+    owner_id : int
+    created_at : datetime
+    members : List[TeamMemberOut] = []
+
+    class Config:
+        from_attributes = True
+
 class RegisterPatient(BaseModel):
     name : str
     phone_number : str
@@ -50,6 +104,12 @@ class LoginRequest(BaseModel):
     email : EmailStr
     password : str
 
+class RefreshRequest(BaseModel):
+    refresh_token : str
+
+class LogoutRequest(BaseModel):
+    refresh_token : Optional[str] = None
+
 class NoteCreate(BaseModel):
     patient_id : int
     chief_complaint : Optional[str] = None
@@ -58,6 +118,7 @@ class NoteCreate(BaseModel):
     assessment : Optional[str] = None
     plan : Optional[str] = None
     raw_notes : Optional[str] = None
+    idempotency_key : Optional[str] = Field(default=None, max_length=64) # Client-generated, makes retries safe
 
 class NoteResponse(BaseModel):
     id : int
@@ -75,6 +136,22 @@ class NoteResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class NoteSearchHit(BaseModel):
+    note_id : int
+    patient_id : int
+    patient_name : str
+    physician_name : str
+    created_at : datetime
+    rank : int
+    snippets : Dict[str, str] # field -> HTML snippet with matches in <mark>
+
+class NoteSearchResponse(BaseModel):
+    query : str
+    total : int
+    page : int
+    page_size : int
+    results : List[NoteSearchHit]
+
 class VitalsCreate(BaseModel):
     patient_id : int
     systolic_bp : Optional[int] = None
@@ -82,6 +159,7 @@ class VitalsCreate(BaseModel):
     heart_rate : Optional[int] = None
     temperature : Optional[float] = None
     spo2 : Optional[int] = None
+    idempotency_key : Optional[str] = Field(default=None, max_length=64)
 
 class VitalsResponse(BaseModel):
     id : int
@@ -97,6 +175,33 @@ class VitalsResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class VitalsColumns(BaseModel):
+    """Vitals as parallel arrays for charting (?format=columns), oldest first"""
+    count : int
+    id : List[int]
+    timestamps : List[int] # Epoch milliseconds, UTC
+    systolic_bp : List[Optional[int]]
+    diastolic_bp : List[Optional[int]]
+    heart_rate : List[Optional[int]]
+    temperature : List[Optional[float]]
+    spo2 : List[Optional[int]]
+
+# Offline sync (queued note/vitals writes replayed in one request)
+class SyncItem(BaseModel):
+    kind : str # 'note' or 'vitals'
+    idempotency_key : str = Field(min_length=1, max_length=64)
+    data : dict # NoteCreate or VitalsCreate payload
+
+class SyncRequest(BaseModel):
+    items : List[SyncItem]
+
+class SyncItemResult(BaseModel):
+    idempotency_key : str
+    kind : str
+    status : str # created, duplicate or error
+    id : Optional[int] = None
+    detail : Optional[str] = None
+
 # AI Consultation Analysis Schemas
 class ConsultationAnalysis(BaseModel):
     transcript: str
@@ -140,3 +245,47 @@ class PatientDetail(BaseModel):
 
     class Config:
         from_attributes = True
+
+class BatchReportRequest(BaseModel):
+    patient_ids : Optional[List[int]] = None # None: every patient the user owns or has been shared
+    period : str = "week" # week, month, all, custom
+    start_date : Optional[str] = None # YYYY-MM-DD, for custom
+    end_date : Optional[str] = None
+
+class ReportJobOut(BaseModel):
+    id : int
+    period : str
+    total : int
+    done : int
+    failed : int
+    status : str
+    created_at : datetime
+    updated_at : datetime
+
+    class Config:
+        from_attributes = True
+
+class AuditEventOut(BaseModel):
+    id : int
+    user_id : int
+    patient_id : int
+    action : str
+    detail : Optional[str] = None
+    created_at : datetime
+
+    class Config:
+        from_attributes = True
+
+class AlertOut(BaseModel):
+    id : int
+    patient_id : int
+    patient_name : str
+    vitals_id : int
+    metric : str
+    kind : str # threshold, zscore, trend
+    severity : str # warning, critical
+    value : float
+    baseline : Optional[float] = None
+    message : str
+    created_at : datetime
+    detected_at : datetime
@@ -0,0 +1,209 @@
+"""Full-text search over clinical notes, including Hindi/Devanagari text.
+
+Note text is tokenised in Python into `Notes.search_text` (space-separated,
+normalised tokens). The database indexes that column: a generated tsvector
+with a GIN index on Postgres, an external-content FTS5 table on SQLite.
+
+Tokenising in Python keeps Devanagari words whole. Vowel signs (matras) and
+virama are combining marks, which both regex `\\w` and the default database
+tokenisers treat as separators, splitting "घुटने" into "घ" and "टन".
+"""
+import heapq
+import html
+import re
+import unicodedata
+from typing import List, Optional
+
+from sqlalchemy import select, text, func, column, cast, bindparam, literal_column, Float, Integer
+from sqlalchemy.dialects.postgresql import TSQUERY
+from sqlalchemy.orm import Session, joinedload, selectinload
+
+import models, sharding
+
+SEARCH_FIELDS = ("chief_complaint", "subjective", "objective", "assessment", "plan", "raw_notes")
+
+# Devanagari combining marks: signs, nukta, matras, virama, stress marks, vocalic vowel signs
+DEVANAGARI_MARKS = "".join(
+    chr(c) for c in [*range(0x0900, 0x0904), *range(0x093A, 0x0950), *range(0x0951, 0x0958), 0x0962, 0x0963]
+)
+TOKEN_RE = re.compile(rf"(?:[^\W_]|[{DEVANAGARI_MARKS}])+")
+
+MAX_QUERY_TOKENS = 8
+SNIPPET_RADIUS = 60
+
+def normalise(value: str) -> str:
+    return unicodedata.normalize("NFC", value).casefold()
+
+def tokenize(value: Optional[str]) -> List[str]:
+    """Split text into normalised search tokens"""
+    if not value:
+        return []
+    return TOKEN_RE.findall(normalise(value))
+
+def build_search_text(note: models.Notes) -> str:
+    """Value stored in Notes.search_text for a note"""
+    tokens = []
+    for field in SEARCH_FIELDS:
+        tokens.extend(tokenize(getattr(note, field)))
+    return " ".join(tokens)
+
+# Index setup
+SQLITE_FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        search_text, content='notes', content_rowid='id',
+        tokenize="unicode61 remove_diacritics 0 tokenchars '{DEVANAGARI_MARKS}'"
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, search_text) VALUES (new.id, new.search_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF search_text ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, search_text) VALUES ('delete', old.id, old.search_text);
+        INSERT INTO notes_fts(rowid, search_text) VALUES (new.id, new.search_text);
+    END""",
+]
+
+# Tokens are already normalised, so the tsvector is built from them verbatim
+# instead of going through a text search parser
+POSTGRES_FTS_DDL = [
+    """ALTER TABLE notes ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (array_to_tsvector(string_to_array(coalesce(search_text, ''), ' '))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_notes_search_vector ON notes USING GIN (search_vector)",
+]
+
+def install(engine):
+    """Create the full-text index for the current database and backfill existing notes"""
+    backfill(engine)
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            for statement in POSTGRES_FTS_DDL:
+                conn.execute(text(statement))
+        elif engine.dialect.name == "sqlite":
+            created = conn.execute(text(
+                "SELECT count(*) FROM sqlite_master WHERE name = 'notes_fts'"
+            )).scalar() == 0
+            for statement in SQLITE_FTS_DDL:
+                conn.execute(text(statement))
+            if created:
+                conn.execute(text("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"))
+
+def backfill(engine, batch_size: int = 500):
+    """Fill search_text for notes written before search existed"""
+    with Session(engine) as db:
+        while True:
+            notes = db.query(models.Notes).filter(
+                models.Notes.search_text.is_(None)
+            ).limit(batch_size).all()
+            if not notes:
+                break
+            for note in notes:
+                note.search_text = build_search_text(note)
+            db.commit()
+
+# Querying
+def search_notes(query: str, patient_ids, db: Session, page: int = 1, page_size: int = 20) -> dict:
+    """Ranked, paginated note search restricted to `patient_ids` (a select of accessible ids).
+
+    Every shard ranks its own notes; the page is cut from their merged rankings.
+    """
+    tokens = tokenize(query)[:MAX_QUERY_TOKENS]
+    result = {"query": query, "total": 0, "page": page, "page_size": page_size, "results": []}
+    if not tokens:
+        return result
+
+    def ranked(session, shard):
+        dialect = session.get_bind(models.Notes).dialect.name
+        if dialect == "postgresql":
+            # Lexemes are quoted so they are taken literally; ':*' makes each a prefix match
+            params = {"q": " & ".join(f"'{token}':*" for token in tokens)}
+            match = text("notes.search_vector @@ CAST(:q AS tsquery)")
+            # Negated so that lower scores rank first, as with bm25()
+            score = -func.ts_rank(literal_column("notes.search_vector"), cast(bindparam("q"), TSQUERY), type_=Float)
+            stmt = select(
+                models.Notes.id, models.Notes.created_at, score.label("score"), func.count().over().label("total")
+            ).where(match)
+        elif dialect == "sqlite":
+            params = {"q": " ".join(f'"{token}"*' for token in tokens)}
+            # bm25() is only usable in a query driven by the FTS table itself
+            hits = text(
+                "SELECT rowid AS id, bm25(notes_fts) AS score FROM notes_fts WHERE notes_fts MATCH :q"
+            ).columns(column("id", Integer), column("score", Float)).subquery("hits")
+            stmt = select(
+                models.Notes.id, models.Notes.created_at, hits.c.score, func.count().over().label("total")
+            ).join(hits, hits.c.id == models.Notes.id)
+        else:
+            raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+
+        stmt = stmt.where(models.Notes.patient_id.in_(patient_ids))
+        rows = session.execute(stmt.order_by(
+            literal_column("score"), models.Notes.created_at.desc()
+        ).limit(offset + page_size - skip).offset(skip), params).all()
+        if rows or not skip:
+            return rows, rows[0].total if rows else 0
+        # A page past the last hit has no row to carry the window count
+        return rows, session.execute(select(func.count()).select_from(stmt.subquery()), params).scalar()
+
+    # Across shards the page can be anywhere in the first page * page_size hits of each
+    offset = (page - 1) * page_size
+    skip = 0 if sharding.enabled() else offset
+    hits, totals = zip(*sharding.fan_out(ranked, db))
+    result["total"] = sum(totals)
+    merged = heapq.merge(*hits, key=lambda row: (row.score, -row.created_at.timestamp()))
+    rows = list(merged)[offset - skip:offset - skip + page_size]
+    if not rows:
+        return result
+
+    note_ids = sharding.by_shard(row.id for row in rows)
+    notes = {
+        note.id: note for shard_notes in sharding.fan_out(
+            lambda session, shard: session.query(models.Notes).options(
+                selectinload(models.Notes.author), joinedload(models.Notes.patient) # Authors are on the primary
+            ).filter(models.Notes.id.in_(note_ids[shard])).all(), db, note_ids
+        ) for note in shard_notes
+    }
+
+    for position, row in enumerate(rows):
+        note = notes[row.id]
+        result["results"].append({
+            "note_id": note.id,
+            "patient_id": note.patient_id,
+            "patient_name": note.patient.name,
+            "physician_name": note.author.name,
+            "created_at": note.created_at,
+            "rank": (page - 1) * page_size + position + 1,
+            "snippets": highlight(note, tokens),
+        })
+    return result
+
+def highlight(note: models.Notes, tokens: List[str]) -> dict:
+    """HTML snippets around the first match in each matching field, matches wrapped in <mark>"""
+    snippets = {}
+    for field in SEARCH_FIELDS:
+        value = getattr(note, field)
+        if not value:
+            continue
+        value = unicodedata.normalize("NFC", value)
+        matches = [
+            m for m in TOKEN_RE.finditer(value)
+            if any(m.group().casefold().startswith(token) for token in tokens)
+        ]
+        if not matches:
+            continue
+
+        start = max(0, matches[0].start() - SNIPPET_RADIUS)
+        end = min(len(value), matches[0].end() + SNIPPET_RADIUS)
+        parts = ["…" if start > 0 else ""]
+        cursor = start
+        for m in matches:
+            if m.start() < start or m.end() > end:
+                continue
+            parts.append(html.escape(value[cursor:m.start()]))
+            parts.append(f"<mark>{html.escape(m.group())}</mark>")
+            cursor = m.end()
+        parts.append(html.escape(value[cursor:end]))
+        parts.append("…" if end < len(value) else "")
+        snippets[field] = "".join(parts)
+    return snippets
@@ -0,0 +1,217 @@
+"""Horizontal sharding of patient data by owning physician.
+
+    SHARD_URLS=sqlite:///shard1.db,sqlite:///shard2.db uvicorn app:app    # shards besides DATABASE_URL
+
+DATABASE_URL is the primary, shard 0. It keeps the global tables (users,
+teams, tokens, audit trail, report jobs) and the directory of which shard
+holds each physician's patients, and holds patients itself like any other
+shard. SHARD_URLS adds shards 1, 2, ...; unset, the primary is the only shard
+and everything here comes down to using the request's session as before.
+
+A patient and everything recorded about it (notes, vitals, alerts, sharing
+grants, idempotency keys) live on its owner's shard, so a write such as
+create_note touches one shard in one transaction. An owner is placed on the
+shard with the fewest owners when they register their first patient, and
+stays there. Shard k issues the ids of these tables from its own range,
+[k * ID_SPAN, (k + 1) * ID_SPAN), so ids stay unique across shards and a
+patient, note or vitals id names its shard without a lookup.
+
+crud routes through for_patient() and for_owner(): the request's Session for
+the primary, otherwise a Session on that shard which reads the global tables
+from the primary and is closed along with the request's. fan_out() runs a
+read on every shard at once, one pool thread per extra shard, for rows that
+can be anywhere, such as the patients shared with a user. A statement cannot
+join across databases, so rows of global tables (user names, team
+memberships) are read separately and matched up in Python.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import MetaData, create_engine, func, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import database, models
+from config import settings
+
+PRIMARY = 0
+ID_SPAN = settings.shard_id_span # Ids per shard; 21 shards fit in a 32-bit id
+FAN_OUT_WORKERS = settings.shard_fan_out_workers
+
+# Tables whose rows live on their patient's shard; every other table is only on the primary
+SHARDED_MODELS = (
+    models.Patients, models.SharedAccess, models.TeamAccess, models.Notes, models.Vitals,
+    models.Alerts, models.IdempotencyKeys,
+    models.ScanWatermarks, # Per database: the anomaly scan runs on each shard
+)
+
+SESSIONS_KEY = "shard_sessions" # session.info of a request's Session: shard -> Session (closed by AppSession)
+ROOT_KEY = "shard_root" # session.info of a shard Session: the request's Session it belongs to
+
+def _create_engine(url: str):
+    return create_engine(url, pool_pre_ping=True, pool_recycle=3600, pool_size=10, max_overflow=20)
+
+_engines: Dict[int, object] = {shard: _create_engine(url) for shard, url in enumerate(settings.shard_urls, 1)}
+_owners: Dict[int, int] = {} # physician id -> shard; directory entries never change
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# Shards
+def enabled() -> bool:
+    return bool(_engines)
+
+def shard_ids() -> List[int]:
+    return [PRIMARY, *_engines]
+
+def engines() -> Dict[int, object]:
+    """Every shard's engine, the primary's first"""
+    return {PRIMARY: database.engine, **_engines}
+
+def use_engines(shard_engines: Dict[int, object]) -> Dict[int, object]:
+    """Replace the extra shards (engines or connections, see testing.py); returns the previous ones"""
+    global _engines
+    previous, _engines = _engines, dict(shard_engines)
+    _owners.clear()
+    return previous
+
+def dispose(close: bool = True):
+    for engine in _engines.values():
+        engine.dispose(close=close)
+
+def shard_of(record_id: int) -> int:
+    """The shard that issued a patient, note, vitals... id"""
+    shard = record_id // ID_SPAN
+    return shard if shard in _engines else PRIMARY
+
+def by_shard(record_ids: Iterable[int]) -> Dict[int, List[int]]:
+    groups = {}
+    for record_id in record_ids:
+        groups.setdefault(shard_of(record_id), []).append(record_id)
+    return groups
+
+# Sessions
+def root(db: Session) -> Session:
+    """The request's Session (on the primary) that `db` belongs to"""
+    return db.info.get(ROOT_KEY, db)
+
+def session(shard: int, db: Session) -> Session:
+    """`db`'s request Session for the primary, otherwise its Session on `shard`"""
+    db = root(db)
+    if shard == PRIMARY:
+        return db
+    sessions = db.info.setdefault(SESSIONS_KEY, {})
+    if shard not in sessions:
+        shard_db = database.SessionLocal(
+            bind=db.get_bind(), # Global tables
+            binds={model: _engines[shard] for model in SHARDED_MODELS},
+        )
+        shard_db.info[ROOT_KEY] = db
+        sessions[shard] = shard_db
+    return sessions[shard]
+
+def for_patient(patient_id: int, db: Session) -> Session:
+    return session(shard_of(patient_id), db)
+
+def for_owner(physician_id: int, db: Session) -> Session:
+    return session(owner_shard(physician_id, db), db)
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix="shard-fan-out")
+        return _pool
+
+def fan_out(read: Callable[[Session, int], object], db: Session, shards: Optional[Iterable[int]] = None) -> list:
+    """read(session, shard) on every shard (or just `shards`) at once; the results in the same order.
+
+    The primary's read runs in this thread. Each extra shard's runs in the pool on
+    that shard's Session of this request, so the rows it loads stay usable after;
+    it must only touch sharded tables, as the Session's primary connection is this thread's.
+    """
+    shards = list(shard_ids() if shards is None else shards)
+    futures = {shard: _executor().submit(read, session(shard, db), shard) for shard in shards if shard != PRIMARY}
+    results = {}
+    try:
+        if PRIMARY in shards:
+            results[PRIMARY] = read(root(db), PRIMARY)
+    finally:
+        wait(futures.values()) # Never leave a Session in use by a pool thread
+    for shard, future in futures.items():
+        results[shard] = future.result()
+    return [results[shard] for shard in shards]
+
+# Directory
+def owner_shard(physician_id: int, db: Session) -> int:
+    """The shard holding a physician's patients; a new owner goes to the shard with the fewest owners"""
+    if not _engines:
+        return PRIMARY
+    shard = _owners.get(physician_id)
+    if shard is not None:
+        return shard
+
+    db = root(db)
+    shard = db.scalar(select(models.PhysicianShards.shard).where(models.PhysicianShards.physician_id == physician_id))
+    if shard is None:
+        owners = dict(db.execute(
+            select(models.PhysicianShards.shard, func.count()).group_by(models.PhysicianShards.shard)
+        ).all())
+        shard = min(shard_ids(), key=lambda candidate: (owners.get(candidate, 0), candidate))
+        # In a transaction of its own, committed before the patient is written to the shard
+        with database.SessionLocal() as directory:
+            directory.add(models.PhysicianShards(physician_id=physician_id, shard=shard))
+            try:
+                directory.commit()
+            except IntegrityError:
+                # Placed by a concurrent request first
+                directory.rollback()
+                shard = directory.scalar(
+                    select(models.PhysicianShards.shard).where(models.PhysicianShards.physician_id == physician_id)
+                )
+    _owners[physician_id] = shard
+    return shard
+
+# Schema
+def shard_metadata() -> MetaData:
+    """The sharded tables as created on an extra shard: no foreign keys into tables that only the primary has"""
+    metadata = MetaData()
+    names = {model.__table__.name for model in SHARDED_MODELS}
+    for model in SHARDED_MODELS:
+        table = model.__table__.to_metadata(metadata)
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split(".")[0] in names:
+                continue
+            table.constraints.discard(constraint)
+            for element in constraint.elements:
+                element.parent.foreign_keys.discard(element)
+                table.foreign_keys.discard(element)
+        if "id" in table.c:
+            # So SQLite's next id follows sqlite_sequence (see reserve_ids) rather than the largest id present
+            table.dialect_kwargs["sqlite_autoincrement"] = True
+    return metadata
+
+def reserve_ids(engine, shard: int):
+    """Make a shard's sharded tables issue ids from the shard's range"""
+    low, high = max(1, shard * ID_SPAN), (shard + 1) * ID_SPAN - 1
+    with engine.begin() as conn:
+        for model in SHARDED_MODELS:
+            table = model.__table__
+            if "id" not in table.c:
+                continue
+            largest = conn.scalar(select(func.max(table.c.id)))
+            if largest is not None and not low <= largest <= high:
+                raise RuntimeError(
+                    f"{table.name} on shard {shard} has ids outside {low}-{high}; SHARD_ID_SPAN is too small"
+                )
+            if conn.dialect.name == "postgresql":
+                sequence = conn.scalar(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table.name})
+                restart = f" RESTART WITH {low}" if largest is None else ""
+                conn.execute(text(f"ALTER SEQUENCE {sequence} MINVALUE {low} MAXVALUE {high} START WITH {low}{restart}"))
+            elif conn.dialect.name == "sqlite" and largest is None and shard != PRIMARY:
+                # The primary's tables have no AUTOINCREMENT and start from 1 anyway
+                updated = conn.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = :table"),
+                                       {"seq": low - 1, "table": table.name}).rowcount
+                if not updated:
+                    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES (:table, :seq)"),
+                                 {"seq": low - 1, "table": table.name})
@@ -0,0 +1,90 @@
+// Token handling shared by the logged-in pages.
+// Access tokens live 15 minutes: authFetch sends the current one and, on a 401,
+// trades the refresh token for a new pair once and retries the request.
+
+function storeTokens(data) {
+    localStorage.setItem('access_token', data.access_token);
+    localStorage.setItem('refresh_token', data.refresh_token);
+}
+
+function currentAccessToken() {
+    return localStorage.getItem('access_token');
+}
+
+function tokenExpiresWithin(token, seconds) {
+    try {
+        const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+        return payload.exp * 1000 - Date.now() < seconds * 1000;
+    } catch (error) {
+        return true;
+    }
+}
+
+async function rotateTokens(staleToken) {
+    // Another tab may have refreshed while we waited for the lock
+    if (currentAccessToken() !== staleToken) return true;
+
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!refreshToken) return false;
+
+    const response = await fetch('/token/refresh', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ refresh_token: refreshToken })
+    });
+    if (!response.ok) return false;
+
+    storeTokens(await response.json());
+    return true;
+}
+
+// Returns true once a newer access token than `staleToken` is in storage
+function refreshAccessToken(staleToken) {
+    // Refresh tokens are single-use: serialise refreshes across tabs so only one spends it
+    if (navigator.locks) {
+        return navigator.locks.request('token-refresh', () => rotateTokens(staleToken));
+    }
+    return rotateTokens(staleToken);
+}
+
+// An access token good for at least another 30 seconds, e.g. for EventSource URLs
+async function freshAccessToken() {
+    const token = currentAccessToken();
+    if (token && tokenExpiresWithin(token, 30)) {
+        await refreshAccessToken(token);
+    }
+    return currentAccessToken();
+}
+
+async function authFetch(url, options = {}) {
+    const send = (token) => {
+        const headers = new Headers(options.headers || {});
+        headers.set('Authorization', `Bearer ${token}`);
+        return fetch(url, { ...options, headers });
+    };
+
+    const token = currentAccessToken();
+    const response = await send(token);
+    if (response.status === 401 && await refreshAccessToken(token)) {
+        return send(currentAccessToken());
+    }
+    return response;
+}
+
+async function logout() {
+    const token = await freshAccessToken().catch(() => currentAccessToken());
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (token) {
+        try {
+            await fetch('/logout', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
+                body: JSON.stringify({ refresh_token: refreshToken })
+            });
+        } catch (error) {
+            // Offline: the tokens still expire on their own
+        }
+    }
+    localStorage.clear();
+    window.location.href = '/static/index.html';
+}
@@ -41,7 +41,7 @@ const physicianName = localStorage.getItem('physician_name');
 
 async function loadPatients() {
     try {
-        const response = await fetch(`/users/${physicianId}/patients`, {
+        const response = await authFetch(`/users/${physicianId}/patients`, {
             headers: {
                 'Authorization': `Bearer ${token}`
             }
@@ -113,19 +113,28 @@ function displayPatients(patients) {
     `}).join('');
 }
 
+let searchController = null;
+let searchTimer = null;
+
 async function searchPatients() {
     const query = document.getElementById('searchInput').value.trim();
 
+    // Only the latest keystroke's results matter
+    if (searchController) searchController.abort();
+
     if (!query) {
         loadPatients();
         return;
     }
 
+    searchController = new AbortController();
+
     try {
-        const response = await fetch(`/users/${physicianId}/patients/search?q=${encodeURIComponent(query)}`, {
+        const response = await authFetch(`/users/${physicianId}/patients/search?q=${encodeURIComponent(query)}`, {
             headers: {
                 'Authorization': `Bearer ${token}`
-            }
+            },
+            signal: searchController.signal
         });
 
         if (response.status === 401) {
@@ -137,6 +146,7 @@ async function searchPatients() {
         const patients = await response.json();
         displayPatients(patients);
     } catch (error) {
+        if (error.name === 'AbortError') return;
         console.error('Error searching patients:', error);
     }
 }
@@ -165,7 +175,7 @@ document.getElementById('addPatientForm').addEventListener('submit', async (e) =
     };
 
     try {
-        const response = await fetch('/register_patient', {
+        const response = await authFetch('/register_patient', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -197,14 +207,15 @@ function openPatientRecord(patientId) {
     window.location.href = `/static/patient-record.html?id=${patientId}`;
 }
 
-// Allow search on Enter key
+// Search as you type (debounced), or immediately on Enter
+document.getElementById('searchInput').addEventListener('input', () => {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(searchPatients, 120);
+});
+
 document.getElementById('searchInput').addEventListener('keypress', (e) => {
     if (e.key === 'Enter') {
+        clearTimeout(searchTimer);
         searchPatients();
     }
 });
-
-function logout() {
-    localStorage.clear();
-    window.location.href = '/static/index.html';
-}
@@ -0,0 +1,34 @@
+// Offline write queue - registers the service worker and flushes queued writes when back online
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    // crypto.randomUUID needs a secure context; fall back for plain-HTTP demos
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+}
+
+async function requestOfflineFlush() {
+    const token = await freshAccessToken();
+    if (!token || !navigator.serviceWorker || !navigator.serviceWorker.controller) return;
+
+    navigator.serviceWorker.controller.postMessage({
+        type: 'flush',
+        authorization: `Bearer ${token}`
+    });
+}
+
+if ('serviceWorker' in navigator) {
+    navigator.serviceWorker.register('/static/sw.js', { scope: '/static/' })
+        .catch(error => console.error('Service worker registration failed:', error));
+
+    // Flush anything left over from an earlier offline session
+    navigator.serviceWorker.ready.then(requestOfflineFlush);
+    window.addEventListener('online', requestOfflineFlush);
+
+    navigator.serviceWorker.addEventListener('message', (event) => {
+        if (event.data && event.data.type === 'sync-complete') {
+            window.dispatchEvent(new CustomEvent('offline-sync', { detail: event.data }));
+        }
+    });
+}
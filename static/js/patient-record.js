@@ -9,21 +9,117 @@ if (!patientId || !physicianId || !token) {
 }
 
 let vitalsChart = null;
+let currentNotes = [];
+let currentVitals = emptyVitalsColumns();
+let eventSource = null;
 
 // Load patient data
 window.addEventListener('DOMContentLoaded', () => {
     loadPatientInfo();
     loadNotes();
     loadVitals();
+    subscribeToUpdates();
+});
+
+// Live updates: new notes/vitals from other users arrive over Server-Sent Events,
+// so the lists never need to be re-downloaded while the page is open
+async function subscribeToUpdates() {
+    if (!window.EventSource) return;
+
+    // EventSource can't send headers, and reconnects reuse the URL, so each
+    // connection gets a fresh token and is replaced once the server ends it
+    const accessToken = await freshAccessToken();
+    eventSource = new EventSource(`/patients/${patientId}/events?token=${encodeURIComponent(accessToken)}`);
+
+    // The access token in the URL ran out; reconnect with a new one
+    eventSource.addEventListener('expired', () => {
+        eventSource.close();
+        subscribeToUpdates();
+    });
+
+    // A rejected reconnect (e.g. 401) closes the stream for good
+    eventSource.addEventListener('error', () => {
+        if (eventSource.readyState !== EventSource.CLOSED) return;
+        setTimeout(subscribeToUpdates, 5000);
+    });
+
+    eventSource.addEventListener('note', (event) => {
+        const note = JSON.parse(event.data);
+        if (currentNotes.some(n => n.id === note.id)) return;
+        currentNotes.unshift(note);
+        displayNotes(currentNotes);
+    });
+
+    eventSource.addEventListener('vitals', (event) => {
+        const vitals = JSON.parse(event.data);
+        if (currentVitals.id.includes(vitals.id)) return;
+        appendVitals(currentVitals, vitals);
+        displayVitalsTable(currentVitals);
+        displayVitalsChart(currentVitals);
+    });
+
+    // Our own permission changed (e.g. VIEW -> EDIT)
+    eventSource.addEventListener('access', () => loadPatientInfo());
+
+    eventSource.addEventListener('revoked', () => {
+        eventSource.close();
+        alert('Your access to this patient has been revoked.');
+        goBack();
+    });
+
+    // Too many missed events; fall back to a full reload
+    eventSource.addEventListener('resync', () => {
+        loadNotes();
+        loadVitals();
+    });
+}
+
+function isLive() {
+    return eventSource && eventSource.readyState === EventSource.OPEN;
+}
+
+// Conditional GET: revalidate against the stored ETag and reuse the stored body on 304
+async function fetchWithETag(url) {
+    const cacheKey = `etag:${physicianId}:${url}`;
+    const cached = JSON.parse(sessionStorage.getItem(cacheKey) || 'null');
+
+    const headers = { 'Authorization': `Bearer ${token}` };
+    if (cached) headers['If-None-Match'] = cached.etag;
+
+    // no-store keeps the browser's HTTP cache out of the way; revalidation is done here
+    const response = await authFetch(url, { headers, cache: 'no-store' });
+
+    if (response.status === 304 && cached) {
+        return new Response(cached.body, { status: 200, headers: { 'Content-Type': 'application/json' } });
+    }
+
+    const etag = response.headers.get('ETag');
+    if (response.ok && etag) {
+        try {
+            sessionStorage.setItem(cacheKey, JSON.stringify({ etag, body: await response.clone().text() }));
+        } catch (error) {
+            sessionStorage.removeItem(cacheKey); // Storage full; just skip caching
+        }
+    }
+    return response;
+}
+
+// Writes queued while offline have been replayed
+window.addEventListener('offline-sync', (event) => {
+    const { synced, failed } = event.detail;
+    if (synced > 0) {
+        loadNotes();
+        loadVitals();
+    }
+    if (failed.length > 0) {
+        console.error('Offline writes rejected on sync:', failed);
+        alert(`${failed.length} offline entr${failed.length === 1 ? 'y' : 'ies'} could not be saved: ${failed[0].detail}`);
+    }
 });
 
 async function loadPatientInfo() {
     try {
-        const response = await fetch(`/patients/${patientId}`, {
-            headers: {
-                'Authorization': `Bearer ${token}`
-            }
-        });
+        const response = await fetchWithETag(`/patients/${patientId}`);
 
         if (response.status === 401) {
             localStorage.clear();
@@ -66,11 +162,7 @@ async function loadPatientInfo() {
 
 async function loadNotes() {
     try {
-        const response = await fetch(`/patients/${patientId}/notes`, {
-            headers: {
-                'Authorization': `Bearer ${token}`
-            }
-        });
+        const response = await fetchWithETag(`/patients/${patientId}/notes`);
 
         if (response.status === 401) {
             localStorage.clear();
@@ -78,9 +170,9 @@ async function loadNotes() {
             return;
         }
 
-        const notes = await response.json();
+        currentNotes = await response.json();
 
-        displayNotes(notes);
+        displayNotes(currentNotes);
     } catch (error) {
         console.error('Error loading notes:', error);
         document.getElementById('timelineContainer').innerHTML =
@@ -140,13 +232,27 @@ function displayNotes(notes) {
     }).join('');
 }
 
+// Vitals are kept as parallel arrays, oldest first (GET /vitals?format=columns)
+function emptyVitalsColumns() {
+    return { count: 0, id: [], timestamps: [], systolic_bp: [], diastolic_bp: [], heart_rate: [], temperature: [], spo2: [] };
+}
+
+// Append one reading in row form (as pushed over SSE)
+function appendVitals(columns, v) {
+    const timeString = v.created_at.endsWith('Z') ? v.created_at : v.created_at + 'Z';
+    columns.id.push(v.id);
+    columns.timestamps.push(Date.parse(timeString));
+    columns.systolic_bp.push(v.systolic_bp);
+    columns.diastolic_bp.push(v.diastolic_bp);
+    columns.heart_rate.push(v.heart_rate);
+    columns.temperature.push(v.temperature);
+    columns.spo2.push(v.spo2);
+    columns.count += 1;
+}
+
 async function loadVitals() {
     try {
-        const response = await fetch(`/patients/${patientId}/vitals`, {
-            headers: {
-                'Authorization': `Bearer ${token}`
-            }
-        });
+        const response = await fetchWithETag(`/patients/${patientId}/vitals?format=columns`);
 
         if (response.status === 401) {
             localStorage.clear();
@@ -154,10 +260,10 @@ async function loadVitals() {
             return;
         }
 
-        const vitals = await response.json();
+        currentVitals = await response.json();
 
-        displayVitalsTable(vitals);
-        displayVitalsChart(vitals);
+        displayVitalsTable(currentVitals);
+        displayVitalsChart(currentVitals);
     } catch (error) {
         console.error('Error loading vitals:', error);
     }
@@ -166,31 +272,34 @@ async function loadVitals() {
 function displayVitalsTable(vitals) {
     const tbody = document.getElementById('vitalsTableBody');
 
-    if (vitals.length === 0) {
+    if (vitals.count === 0) {
         tbody.innerHTML = '<tr><td colspan="5" style="text-align: center; color: var(--gray-500);">No vitals logged yet</td></tr>';
         return;
     }
 
-    tbody.innerHTML = vitals.map(v => {
-        const timeString = v.created_at.endsWith('Z') ? v.created_at : v.created_at + 'Z';
-        const date = new Date(timeString);
-        const formattedDate = date.toLocaleDateString('en-IN', {
+    // Most recent first
+    const rows = [];
+    for (let i = vitals.count - 1; i >= 0; i--) {
+        const formattedDate = new Date(vitals.timestamps[i]).toLocaleDateString('en-IN', {
             month: 'short',
             day: 'numeric',
             year: 'numeric',
             timeZone: 'Asia/Kolkata'
         });
+        const systolic = vitals.systolic_bp[i];
+        const diastolic = vitals.diastolic_bp[i];
 
-        return `
+        rows.push(`
             <tr>
                 <td>${formattedDate}</td>
-                <td>${v.systolic_bp && v.diastolic_bp ? `${v.systolic_bp}/${v.diastolic_bp}` : '-'}</td>
-                <td>${v.heart_rate || '-'}</td>
-                <td>${v.temperature || '-'}</td>
-                <td>${v.spo2 || '-'}</td>
+                <td>${systolic && diastolic ? `${systolic}/${diastolic}` : '-'}</td>
+                <td>${vitals.heart_rate[i] || '-'}</td>
+                <td>${vitals.temperature[i] || '-'}</td>
+                <td>${vitals.spo2[i] || '-'}</td>
             </tr>
-        `;
-    }).join('');
+        `);
+    }
+    tbody.innerHTML = rows.join('');
 }
 
 function displayVitalsChart(vitals) {
@@ -200,18 +309,14 @@ function displayVitalsChart(vitals) {
         vitalsChart.destroy();
     }
 
-    if (vitals.length === 0) {
+    if (vitals.count === 0) {
         return;
     }
 
-    // Reverse to show chronological order
-    const reversedVitals = [...vitals].reverse();
-
-    const labels = reversedVitals.map(v => {
-        const timeString = v.created_at.endsWith('Z') ? v.created_at : v.created_at + 'Z';
-        const date = new Date(timeString);
-        return date.toLocaleDateString('en-IN', { month: 'short', day: 'numeric', timeZone: 'Asia/Kolkata' });
-    });
+    // Columns are already in chronological order and feed the datasets directly
+    const labels = vitals.timestamps.map(t =>
+        new Date(t).toLocaleDateString('en-IN', { month: 'short', day: 'numeric', timeZone: 'Asia/Kolkata' })
+    );
 
     vitalsChart = new Chart(ctx, {
         type: 'line',
@@ -220,21 +325,21 @@ function displayVitalsChart(vitals) {
             datasets: [
                 {
                     label: 'Sys BP',
-                    data: reversedVitals.map(v => v.systolic_bp),
+                    data: vitals.systolic_bp,
                     borderColor: '#EF4444',
                     backgroundColor: 'rgba(239, 68, 68, 0.1)',
                     tension: 0.4
                 },
                 {
                     label: 'Dia BP',
-                    data: reversedVitals.map(v => v.diastolic_bp),
+                    data: vitals.diastolic_bp,
                     borderColor: '#F472B6',
                     backgroundColor: 'rgba(244, 114, 182, 0.1)',
                     tension: 0.4
                 },
                 {
                     label: 'Heart Rate',
-                    data: reversedVitals.map(v => v.heart_rate),
+                    data: vitals.heart_rate,
                     borderColor: '#4F7FFF',
                     backgroundColor: 'rgba(79, 127, 255, 0.1)',
                     tension: 0.4
@@ -307,9 +412,7 @@ function closeShareModal() {
 
 async function loadSharedList() {
     try {
-        const response = await fetch(`/patients/${patientId}/access`, {
-            headers: { 'Authorization': `Bearer ${token}` }
-        });
+        const response = await fetchWithETag(`/patients/${patientId}/access`);
 
         if (response.ok) {
             const list = await response.json();
@@ -342,7 +445,7 @@ async function revokeAccess(userId) {
     if (!confirm("Are you sure you want to revoke access for this user?")) return;
 
     try {
-        const response = await fetch(`/patients/${patientId}/share/${userId}`, {
+        const response = await authFetch(`/patients/${patientId}/share/${userId}`, {
             method: 'DELETE',
             headers: { 'Authorization': `Bearer ${token}` }
         });
@@ -381,12 +484,13 @@ document.getElementById('addNoteForm').addEventListener('submit', async (e) => {
 
     const noteData = {
         patient_id: parseInt(patientId),
-        raw_notes: notesField.value
+        raw_notes: notesField.value,
+        idempotency_key: newIdempotencyKey()
     };
 
     try {
         // Updated endpoint to users
-        const response = await fetch(`/users/${physicianId}/notes`, {
+        const response = await authFetch(`/users/${physicianId}/notes`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -401,9 +505,14 @@ document.getElementById('addNoteForm').addEventListener('submit', async (e) => {
             return;
         }
 
-        if (response.ok) {
+        if (response.status === 202) {
+            // Offline: queued by the service worker, synced when back online
+            const queued = await response.json();
             closeAddNoteModal();
-            loadNotes(); // Reload notes
+            alert(queued.message);
+        } else if (response.ok) {
+            closeAddNoteModal();
+            if (!isLive()) loadNotes(); // Otherwise the new note arrives over the event stream
         } else {
             const error = await response.json();
             errorDiv.textContent = error.detail || 'Failed to add note';
@@ -427,12 +536,13 @@ document.getElementById('addVitalsForm').addEventListener('submit', async (e) =>
         diastolic_bp: parseInt(document.getElementById('diastolicBP').value) || null,
         heart_rate: parseInt(document.getElementById('heartRate').value) || null,
         temperature: parseFloat(document.getElementById('temperature').value) || null,
-        spo2: parseInt(document.getElementById('spo2').value) || null
+        spo2: parseInt(document.getElementById('spo2').value) || null,
+        idempotency_key: newIdempotencyKey()
     };
 
     try {
         // Updated endpoint to users
-        const response = await fetch(`/users/${physicianId}/vitals`, {
+        const response = await authFetch(`/users/${physicianId}/vitals`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -447,9 +557,13 @@ document.getElementById('addVitalsForm').addEventListener('submit', async (e) =>
             return;
         }
 
-        if (response.ok) {
+        if (response.status === 202) {
+            const queued = await response.json();
+            closeAddVitalsModal();
+            alert(queued.message);
+        } else if (response.ok) {
             closeAddVitalsModal();
-            loadVitals(); // Reload vitals
+            if (!isLive()) loadVitals();
         } else {
             const error = await response.json();
             errorDiv.textContent = error.detail || 'Failed to log vitals';
@@ -470,7 +584,7 @@ document.getElementById('shareForm').addEventListener('submit', async (e) => {
     const permission = document.getElementById('sharePermission').value;
 
     try {
-        const response = await fetch(`/patients/${patientId}/share`, {
+        const response = await authFetch(`/patients/${patientId}/share`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -515,7 +629,7 @@ document.getElementById('reportForm').addEventListener('submit', async (e) => {
     }
 
     try {
-        const response = await fetch(`/patients/${patientId}/report${queryParams}`, {
+        const response = await authFetch(`/patients/${patientId}/report${queryParams}`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
 
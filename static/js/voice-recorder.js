@@ -42,6 +42,7 @@ window.toggleRecording = async function () {
             console.log('Requesting microphone access...');
             const stream = await navigator.mediaDevices.getUserMedia({
                 audio: {
+                    channelCount: 1, // Speech recognition only uses one channel
                     echoCancellation: true,
                     noiseSuppression: true,
                     autoGainControl: true
@@ -63,6 +64,9 @@ window.toggleRecording = async function () {
                 options = {};
             }
 
+            // Speech needs far less than the default ~128 kbps; smaller uploads for long consultations
+            options.audioBitsPerSecond = 32000;
+
             console.log('Using format:', options.mimeType || 'default');
             mediaRecorder = new MediaRecorder(stream, options);
 
@@ -177,7 +181,7 @@ async function transcribeAudio(audioBlob, token) {
         statusText.style.color = 'var(--primary)';
 
         // Transcribe with Sarvam API
-        const response = await fetch('/transcribe', {
+        const response = await authFetch('/transcribe', {
             method: 'POST',
             headers: {
                 'Authorization': `Bearer ${token}`
@@ -0,0 +1,198 @@
+// VriddhaMitra Service Worker
+// Precaches the app shell, and queues note/vitals writes made while offline
+// to replay them in one /sync request
+
+const QUEUE_DB = 'vriddhamitra-offline';
+const QUEUE_STORE = 'writes';
+const WRITE_PATTERN = /^\/users\/(\d+)\/(notes|vitals)$/;
+
+// Filled in by static_assets.py; empty when serving the unbuilt sources
+const SHELL_VERSION = 'dev';
+const PRECACHE_URLS = [];
+const SHELL_CACHE = `vriddhamitra-shell-${SHELL_VERSION}`;
+const HASHED_ASSET = /\.[0-9a-f]{10}\.\w+$/;
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => key.startsWith('vriddhamitra-shell-') && key !== SHELL_CACHE)
+                    .map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+// App shell: hashed assets never change, so serve them from the cache;
+// pages go to the network first and fall back to the cache when offline
+self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin || !url.pathname.startsWith('/static/')) return;
+
+    if (HASHED_ASSET.test(url.pathname)) {
+        event.respondWith(cacheFirst(event.request));
+    } else if (PRECACHE_URLS.includes(url.pathname)) {
+        event.respondWith(networkFirst(event.request));
+    }
+});
+
+async function cacheFirst(request) {
+    const cache = await caches.open(SHELL_CACHE);
+    const cached = await cache.match(request);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) cache.put(request, response.clone());
+    return response;
+}
+
+async function networkFirst(request) {
+    const cache = await caches.open(SHELL_CACHE);
+    try {
+        const response = await fetch(request);
+        if (response.ok) cache.put(request, response.clone());
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request, { ignoreSearch: true });
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+// IndexedDB helpers
+function openQueue() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open(QUEUE_DB, 1);
+        request.onupgradeneeded = () => {
+            request.result.createObjectStore(QUEUE_STORE, { keyPath: 'idempotency_key' });
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function withStore(mode, callback) {
+    const db = await openQueue();
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(QUEUE_STORE, mode);
+        const result = callback(tx.objectStore(QUEUE_STORE));
+        tx.oncomplete = () => resolve(result && 'result' in result ? result.result : undefined);
+        tx.onerror = () => reject(tx.error);
+    });
+}
+
+const enqueue = (item) => withStore('readwrite', (store) => store.put(item));
+const allQueued = () => withStore('readonly', (store) => store.getAll());
+const removeQueued = (keys) => withStore('readwrite', (store) => keys.forEach(key => store.delete(key)));
+
+// Intercept note/vitals POSTs: go to the network, fall back to the queue when offline
+self.addEventListener('fetch', (event) => {
+    const url = new URL(event.request.url);
+    const match = event.request.method === 'POST' && url.pathname.match(WRITE_PATTERN);
+    if (!match) return;
+
+    event.respondWith(handleWrite(event.request, match[1], match[2] === 'notes' ? 'note' : 'vitals'));
+});
+
+async function handleWrite(request, userId, kind) {
+    const body = await request.clone().json();
+
+    try {
+        return await fetch(request);
+    } catch (error) {
+        // Without a key a replay could create a duplicate, so let the page see the failure
+        if (!body.idempotency_key) throw error;
+
+        await enqueue({
+            idempotency_key: body.idempotency_key,
+            user_id: userId,
+            kind: kind,
+            data: body,
+            authorization: request.headers.get('Authorization'),
+            queued_at: Date.now()
+        });
+
+        if (self.registration.sync) {
+            try {
+                await self.registration.sync.register('flush-writes');
+            } catch (e) {
+                console.warn('Background sync unavailable, waiting for the page to flush', e);
+            }
+        }
+
+        return new Response(JSON.stringify({
+            queued: true,
+            idempotency_key: body.idempotency_key,
+            message: 'Saved offline. It will sync when you are back online.'
+        }), { status: 202, headers: { 'Content-Type': 'application/json' } });
+    }
+}
+
+// Replay everything queued, one request per user
+async function flushQueue(authorization) {
+    const items = await allQueued();
+    if (items.length === 0) return;
+
+    const byUser = {};
+    items.forEach(item => {
+        (byUser[item.user_id] = byUser[item.user_id] || []).push(item);
+    });
+
+    let synced = 0;
+    const failed = [];
+
+    for (const [userId, userItems] of Object.entries(byUser)) {
+        let response;
+        try {
+            response = await fetch(`/users/${userId}/sync`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': authorization || userItems[userItems.length - 1].authorization
+                },
+                body: JSON.stringify({
+                    items: userItems.map(item => ({
+                        kind: item.kind,
+                        idempotency_key: item.idempotency_key,
+                        data: item.data
+                    }))
+                })
+            });
+        } catch (error) {
+            return; // Still offline, keep everything queued
+        }
+
+        if (!response.ok) continue; // e.g. expired token; retried on the next flush
+
+        // Errors are permanent (validation, revoked access), so they leave the queue too
+        const results = await response.json();
+        await removeQueued(results.map(result => result.idempotency_key));
+
+        results.forEach(result => {
+            if (result.status === 'error') failed.push(result);
+            else synced += 1;
+        });
+    }
+
+    const clients = await self.clients.matchAll({ type: 'window' });
+    clients.forEach(client => client.postMessage({ type: 'sync-complete', synced, failed }));
+}
+
+self.addEventListener('sync', (event) => {
+    if (event.tag === 'flush-writes') {
+        event.waitUntil(flushQueue());
+    }
+});
+
+self.addEventListener('message', (event) => {
+    if (event.data && event.data.type === 'flush') {
+        event.waitUntil(flushQueue(event.data.authorization));
+    }
+});
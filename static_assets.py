@@ -0,0 +1,240 @@
+"""Fingerprinted, precompressed static assets.
+
+    python static_assets.py    # build ahead of deploy (the app also builds at startup when needed)
+
+build() copies static/ into BUILD_DIR/<source digest>/:
+
+- CSS, JS, fonts and images get a content hash in their name (js/dashboard.3f2a9c1b7d.js)
+  and are served with `Cache-Control: public, max-age=31536000, immutable`.
+  The unhashed names are kept too, for old pages and bookmarks, with no-cache.
+- HTML, sw.js and manifest.json keep their names (they are the entry points)
+  and are served with no-cache; every reference in them to a hashed asset is
+  rewritten to the hashed URL, and sw.js gets the app shell precache list.
+- Text files get .gz and, when brotli is installed, .br siblings, compressed
+  once at maximum level rather than per request.
+
+Directories are named by a digest of the sources, so workers starting together
+build the same thing, and a deploy that changes nothing reuses the last build.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.staticfiles import StaticFiles
+
+from compression import accepted_encodings
+from config import settings
+
+try:
+    import brotli
+except ImportError: # Optional; gzip variants are always built
+    brotli = None
+
+SOURCE_DIR = "static"
+BUILD_DIR = settings.static_build_dir
+URL_PREFIX = "/static/"
+MANIFEST = "asset-manifest.json"
+KEEP_BUILDS = 3
+BUILD_FORMAT = 2 # Part of the digest: bump when build() output changes, so older builds are not reused
+
+FINGERPRINTED = (".css", ".js", ".ttf", ".woff", ".woff2", ".svg", ".png")
+NOT_FINGERPRINTED = {"sw.js"} # The service worker URL must never change
+COMPRESSED = (".css", ".js", ".html", ".json", ".svg", ".ttf")
+SHELL = (".html", ".css", ".js", ".json") # Precached by the service worker
+SHELL_EXCLUDED = {"sw.js"}
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+def hashed_name(path: str, content: bytes) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:10]}{ext}"
+
+def source_files(source: str):
+    for root, _, names in os.walk(source):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, source).replace(os.sep, "/"), path
+
+def source_digest(source: str) -> str:
+    digest = hashlib.sha256(f"format {BUILD_FORMAT}\0".encode())
+    for relative, path in sorted(source_files(source)):
+        digest.update(relative.encode() + b"\0")
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()[:16]
+
+def rewrite(content: bytes, urls: dict) -> bytes:
+    """Replace /static/<original> with /static/<hashed> for every fingerprinted asset"""
+    if not urls:
+        return content
+    pattern = re.compile("|".join(re.escape(url) for url in sorted(urls, key=len, reverse=True)).encode())
+    return pattern.sub(lambda match: urls[match.group(0).decode()].encode(), content)
+
+def _dependency_order(files: dict) -> list:
+    """The fingerprinted assets, each after the fingerprinted assets it references.
+
+    An asset in a reference cycle keeps the unhashed URL of the member that
+    comes after it; that name is still served, just not as immutable.
+    """
+    assets = [name for name in sorted(files) if name.endswith(FINGERPRINTED) and name not in NOT_FINGERPRINTED]
+    references = {
+        name: [other for other in assets if other != name and (URL_PREFIX + other).encode() in files[name]]
+        for name in assets
+    }
+    order, seen = [], set()
+
+    def visit(name):
+        seen.add(name)
+        for other in references[name]:
+            if other not in seen:
+                visit(other)
+        order.append(name)
+
+    for name in assets:
+        if name not in seen:
+            visit(name)
+    return order
+
+def _write(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    if path.endswith(COMPRESSED):
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(path + ".br", "wb") as f:
+                f.write(brotli.compress(content, quality=11))
+
+def build(source: str = SOURCE_DIR, target: str = BUILD_DIR) -> str:
+    """Build (or reuse) the asset directory for the current sources and return its path"""
+    version = source_digest(source)
+    output = os.path.join(target, version)
+    if os.path.isfile(os.path.join(output, MANIFEST)):
+        return output
+
+    files = {}
+    for relative, path in source_files(source):
+        with open(path, "rb") as f:
+            files[relative] = f.read()
+    urls = {} # /static/original -> /static/hashed
+    hashed = {}
+
+    # Dependencies first, so every URL in an asset is final before the asset is hashed
+    for name in _dependency_order(files):
+        content = rewrite(files[name], urls)
+        files[name] = content
+        hashed[name] = hashed_name(name, content)
+        urls[URL_PREFIX + name] = URL_PREFIX + hashed[name]
+
+    shell = sorted(
+        URL_PREFIX + hashed.get(name, name) for name in files
+        if name.endswith(SHELL) and name not in SHELL_EXCLUDED
+    )
+
+    staging = tempfile.mkdtemp(prefix=".build-", dir=_ensure_dir(target))
+    for name, content in files.items():
+        if name in hashed:
+            _write(os.path.join(staging, hashed[name]), content) # Exactly what was hashed
+        else:
+            content = rewrite(content, urls)
+        if name == "sw.js":
+            content = content.replace(b"const SHELL_VERSION = 'dev';", f"const SHELL_VERSION = '{version}';".encode())
+            content = content.replace(b"const PRECACHE_URLS = [];", f"const PRECACHE_URLS = {json.dumps(shell)};".encode())
+        _write(os.path.join(staging, name), content)
+
+    with open(os.path.join(staging, MANIFEST), "w") as f:
+        json.dump({"version": version, "assets": hashed, "shell": shell}, f, indent=2)
+
+    try:
+        os.rename(staging, output)
+    except OSError:
+        # Another worker finished the same build first
+        shutil.rmtree(staging, ignore_errors=True)
+    _prune(target, keep=output)
+    return output
+
+def _ensure_dir(path: str) -> str:
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _prune(target: str, keep: str):
+    builds = sorted(
+        (os.path.join(target, name) for name in os.listdir(target) if not name.startswith(".")),
+        key=os.path.getmtime, reverse=True,
+    )
+    for path in builds[KEEP_BUILDS:]:
+        if path != keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+def build_or_source(source: str = SOURCE_DIR) -> str:
+    """The built directory, or the plain sources if building fails (e.g. read-only filesystem)"""
+    try:
+        return build(source)
+    except OSError as e:
+        print(f"Static asset build failed, serving {source}/ as is: {e}")
+        return source
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that serves precompressed variants and long-lived caching for hashed names"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        manifest = os.path.join(str(self.directory), MANIFEST)
+        self.hashed_paths = set()
+        if os.path.isfile(manifest):
+            with open(manifest) as f:
+                self.hashed_paths = set(json.load(f)["assets"].values())
+
+    def _encodings(self, scope):
+        """Precompressed variants the client accepts, preferred first"""
+        accepted = accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        return [
+            (name, ext) for name, ext in (("br", ".br"), ("gzip", ".gz"))
+            if accepted.get(name, accepted.get("*", 0.0)) > 0
+        ]
+
+    async def get_response(self, path: str, scope):
+        relative = path.replace(os.sep, "/")
+        response = None
+        for encoding, ext in self._encodings(scope):
+            try:
+                variant = await super().get_response(path + ext, scope)
+            except HTTPException:
+                continue
+            if variant.status_code in (200, 304):
+                response = variant
+                response.headers["Content-Encoding"] = encoding
+                response.headers["Content-Type"] = self._media_type(relative)
+                break
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        if relative.endswith(COMPRESSED):
+            response.headers["Vary"] = "Accept-Encoding"
+        response.headers["Cache-Control"] = IMMUTABLE if relative in self.hashed_paths else REVALIDATE
+        return response
+
+    @staticmethod
+    def _media_type(path: str) -> str:
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        return media_type
+
+if __name__ == "__main__":
+    output = build(sys.argv[1] if len(sys.argv) > 1 else SOURCE_DIR)
+    with open(os.path.join(output, MANIFEST)) as f:
+        manifest = json.load(f)
+    for original, name in sorted(manifest["assets"].items()):
+        print(f"{original} -> {name}")
+    print(f"Built {output} ({len(manifest['shell'])} files precached by the service worker)")
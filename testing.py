@@ -0,0 +1,356 @@
+"""Isolated, fast test databases for the API, as a pytest plugin.
+
+    pytest -p testing              # or pytest_plugins = ["testing"] in a conftest.py
+    pytest -p testing -n auto      # with pytest-xdist: each worker has its own database
+
+Tests run on SQLite files under pytest's temp directory, or on Postgres when
+TEST_DATABASE_URL points at a server (its database is only used to connect
+and create the others, so the role needs CREATEDB). DATABASE_URL is always
+replaced: tests never touch the real database, unlike reset_db.py.
+
+The schema is built once into a template: a Postgres database made by
+migrate.init_schema and shared by all workers and later runs (its name carries
+a hash of the schema code, so changing a model builds a new one), or a SQLite
+file per worker. Each worker then works on its own clone (CREATE DATABASE ...
+TEMPLATE, or a file copy) that database.use_engine() points the app at.
+
+SHARD_URLS is ignored. TEST_SHARDS=2 runs the tests sharded instead (see
+sharding.py): each worker also gets that many shard clones, made from a
+second template with the shard schema. A test marked @pytest.mark.shards(2)
+runs sharded even when the rest don't, on shard clones made once per worker.
+
+Fixtures:
+
+- db: a Session inside a transaction that is rolled back after the test (one per shard).
+  SessionLocal is bound to the same connection for the duration, so get_db,
+  the API and modules with their own sessions (exports, reports, audit) all
+  see what the test wrote; their commits become savepoints. Nothing runs DDL
+  or truncates between tests.
+- client: a TestClient on that transaction.
+- make_user: a factory for users with ready auth headers, without password
+  hashing or a login request.
+- fresh_db: an engine on a brand new clone of the template, for tests that need
+  real commits or concurrent connections. Slower: a file copy or CREATE DATABASE per test.
+
+Background threads (token revocation sync, audit flushing) are slowed to
+once an hour so they never share the test connection with a request; the
+audit buffer is flushed into the transaction before it is rolled back.
+"""
+import hashlib
+import os
+from contextlib import contextmanager
+import shutil
+import tempfile
+from pathlib import Path
+
+# Before anything imports config: settings are read once, at import
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or f"sqlite:///{tempfile.gettempdir()}/vm_physio_unused.db" # Replaced by use_engine
+os.environ["SHARD_URLS"] = "" # Test shards are clones too, set with sharding.use_engines
+TEST_SHARDS = int(os.getenv("TEST_SHARDS", "0"))
+for name, value in {
+    "AUTO_MIGRATE": "0", # The template has the schema
+    "WARMUP": "0",
+    "HASH_WORKERS": "1",
+    "ARGON2_TIME_COST": "1", # Login tests still hash; cheaply
+    "ARGON2_MEMORY_COST": "1024",
+    "REVOCATION_SYNC_SECONDS": "3600",
+    "AUDIT_FLUSH_SECONDS": "3600",
+}.items():
+    os.environ.setdefault(name, value)
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+import database, sharding
+
+ROOT = Path(__file__).resolve().parent
+# Whatever shapes the schema; a change to any of them builds a new template
+SCHEMA_SOURCES = ("models.py", "database.py", "migrate.py", "search.py", "partitioning.py", "sharding.py")
+TEMPLATE_LOCK = 7_041_977 # pg_advisory_lock key, so parallel workers build the template once
+
+def schema_hash() -> str:
+    digest = hashlib.sha1()
+    for name in SCHEMA_SOURCES:
+        digest.update((ROOT / name).read_bytes())
+    return digest.hexdigest()[:12]
+
+def worker_id() -> str:
+    return os.getenv("PYTEST_XDIST_WORKER", "main")
+
+def make_engine(url):
+    """Engine for a test database; SQLite gets real SAVEPOINTs (pysqlite's own transaction handling breaks them)"""
+    engine = create_engine(url)
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _no_implicit_transactions(dbapi_connection, record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, "begin")
+        def _begin(conn):
+            conn.exec_driver_sql("BEGIN")
+    return engine
+
+def build_schema(url):
+    import migrate
+
+    engine = create_engine(url)
+    try:
+        migrate.init_schema(engine)
+    finally:
+        engine.dispose()
+
+def build_shard_schema(url):
+    import migrate
+
+    engine = create_engine(url)
+    try:
+        migrate.init_shard_schema(engine, 1) # Each clone reserves its own shard's ids
+    finally:
+        engine.dispose()
+
+def reserve_ids(url, shard: int):
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        sharding.reserve_ids(engine, shard)
+    finally:
+        engine.dispose()
+
+class SQLiteDatabases:
+    """Template and clones as files in one directory"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.template = directory / f"template_{schema_hash()}.db"
+        self.shard_template = directory / f"shard_template_{schema_hash()}.db"
+
+    def _build(self, template: Path, build):
+        if not template.exists():
+            building = template.with_suffix(".building")
+            building.unlink(missing_ok=True)
+            build(f"sqlite:///{building}")
+            building.rename(template)
+
+    def build_template(self):
+        self._build(self.template, build_schema)
+        if TEST_SHARDS:
+            self.build_shard_template()
+
+    def build_shard_template(self):
+        self._build(self.shard_template, build_shard_schema)
+
+    def clone(self, name: str, shard: bool = False) -> str:
+        path = self.directory / f"{name}.db"
+        shutil.copyfile(self.shard_template if shard else self.template, path)
+        return f"sqlite:///{path}"
+
+    def drop(self, url: str):
+        Path(make_url(url).database).unlink(missing_ok=True)
+
+class PostgresDatabases:
+    """Template and clones as databases on the TEST_DATABASE_URL server"""
+
+    def __init__(self, server_url: str):
+        self.server_url = make_url(server_url)
+        self.prefix = f"{self.server_url.database}_test"
+        self.template = f"{self.prefix}_template_{schema_hash()}"
+        self.shard_template = f"{self.template}_shard"
+        self.admin = create_engine(self.server_url, isolation_level="AUTOCOMMIT", poolclass=NullPool)
+
+    def _exists(self, conn, name: str) -> bool:
+        return conn.execute(text("SELECT 1 FROM pg_database WHERE datname = :name"), {"name": name}).first() is not None
+
+    @contextmanager
+    def _locked(self):
+        with self.admin.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": TEMPLATE_LOCK})
+            try:
+                yield conn
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": TEMPLATE_LOCK})
+
+    def build_template(self):
+        with self._locked() as conn:
+            if not self._exists(conn, self.template):
+                # Templates of older schemas are no use to anyone
+                stale = conn.execute(text(
+                    "SELECT datname FROM pg_database WHERE datname LIKE :pattern"
+                ), {"pattern": f"{self.prefix}_template_%"}).scalars().all()
+                for name in stale:
+                    conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+                self._build(conn, self.template, build_schema)
+        if TEST_SHARDS:
+            self.build_shard_template()
+
+    def build_shard_template(self):
+        with self._locked() as conn:
+            if not self._exists(conn, self.shard_template):
+                self._build(conn, self.shard_template, build_shard_schema)
+
+    def _build(self, conn, template: str, build):
+        # Built under another name and renamed, so an interrupted build is never used as a template
+        building = f"{template}_building"
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{building}" WITH (FORCE)'))
+        conn.execute(text(f'CREATE DATABASE "{building}"'))
+        build(self.server_url.set(database=building))
+        conn.execute(text(f'ALTER DATABASE "{building}" RENAME TO "{template}"'))
+
+    def clone(self, name: str, shard: bool = False) -> str:
+        name = f"{self.prefix}_{name}"
+        template = self.shard_template if shard else self.template
+        with self.admin.connect() as conn:
+            # FILE_COPY copies the template's few files directly instead of through the WAL (Postgres 15+)
+            strategy = " STRATEGY FILE_COPY" if conn.dialect.server_version_info >= (15,) else ""
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+            conn.execute(text(f'CREATE DATABASE "{name}" TEMPLATE "{template}"{strategy}'))
+        return self.server_url.set(database=name).render_as_string(hide_password=False)
+
+    def drop(self, url: str):
+        with self.admin.connect() as conn:
+            conn.execute(text(f'DROP DATABASE IF EXISTS "{make_url(url).database}" WITH (FORCE)'))
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "shards(count): run the test with this many shards besides the primary")
+
+def reset_caches():
+    """Forget per-process state a rolled-back test may have left pointing at rows that no longer exist"""
+    import entity_cache, typeahead
+
+    typeahead.indexes = typeahead.TypeaheadIndexes()
+    entity_cache.clear()
+
+@pytest.fixture(scope="session")
+def test_databases(tmp_path_factory):
+    if TEST_DATABASE_URL and make_url(TEST_DATABASE_URL).get_backend_name() == "postgresql":
+        databases = PostgresDatabases(TEST_DATABASE_URL)
+    else:
+        databases = SQLiteDatabases(tmp_path_factory.mktemp("databases"))
+    databases.build_template()
+    return databases
+
+def clone_shards(test_databases, name: str, count: int = TEST_SHARDS) -> dict:
+    """{shard: url} of new clones of the shard template, `count` of them"""
+    urls = {}
+    for shard in range(1, count + 1):
+        urls[shard] = test_databases.clone(f"{name}_shard{shard}", shard=True)
+        reserve_ids(urls[shard], shard)
+    return urls
+
+def drop_shards(test_databases, engines: dict, urls: dict):
+    for shard, url in urls.items():
+        engines[shard].dispose()
+        test_databases.drop(url)
+
+@pytest.fixture(scope="session")
+def shard_engines(test_databases):
+    """This worker's shard clones (none unless TEST_SHARDS is set), used by the app for the whole session"""
+    urls = clone_shards(test_databases, worker_id())
+    engines = {shard: make_engine(url) for shard, url in urls.items()}
+    previous = sharding.use_engines(engines)
+    yield engines
+    sharding.use_engines(previous)
+    drop_shards(test_databases, engines, urls)
+
+@pytest.fixture(scope="session")
+def marked_shard_engines(test_databases):
+    """shards(count) -> shard engines for tests marked shards(count), cloned on first use and kept for the session"""
+    made = {} # count -> (engines, urls)
+
+    def shards(count: int) -> dict:
+        if count not in made:
+            test_databases.build_shard_template()
+            urls = clone_shards(test_databases, f"{worker_id()}_marked{count}", count)
+            made[count] = ({shard: make_engine(url) for shard, url in urls.items()}, urls)
+        return made[count][0]
+
+    yield shards
+    for engines, urls in made.values():
+        drop_shards(test_databases, engines, urls)
+
+@pytest.fixture(scope="session", autouse=True)
+def worker_engine(test_databases, shard_engines):
+    """This worker's clone, which the app uses for the whole session"""
+    url = test_databases.clone(worker_id())
+    engine = make_engine(url)
+    previous = database.use_engine(engine)
+    yield engine
+    database.use_engine(previous)
+    engine.dispose()
+    test_databases.drop(url)
+
+@pytest.fixture
+def db(request, worker_engine, shard_engines, marked_shard_engines):
+    import audit
+
+    engines = shard_engines
+    marker = request.node.get_closest_marker("shards")
+    if marker is not None and len(shard_engines) < marker.args[0]:
+        engines = marked_shard_engines(marker.args[0])
+
+    connection = worker_engine.connect()
+    transaction = connection.begin()
+    # Shard sessions are bound to a connection of their own, in the same way
+    shard_connections = {shard: engine.connect() for shard, engine in engines.items()}
+    shard_transactions = [shard_connection.begin() for shard_connection in shard_connections.values()]
+    sharding.use_engines(shard_connections)
+    settings = dict(database.SessionLocal.kw)
+    database.SessionLocal.configure(bind=connection, join_transaction_mode="create_savepoint")
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        audit.audit_log.flush() # Into the transaction, so the test's events go with it
+        database.SessionLocal.kw.clear()
+        database.SessionLocal.kw.update(settings)
+        sharding.use_engines(shard_engines)
+        for shard_transaction, shard_connection in zip(shard_transactions, shard_connections.values()):
+            shard_transaction.rollback()
+            shard_connection.close()
+        transaction.rollback()
+        connection.close()
+        reset_caches()
+
+@pytest.fixture
+def client(db):
+    from fastapi.testclient import TestClient
+    from app import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def make_user(db):
+    """make_user(email, role=...) -> (user, headers)"""
+    import auth, models
+
+    def make(email: str, name: str = "Test User", role: str = "physician"):
+        user = models.Users(name=name, email=email, hashed_password="-", role=role) # "-" matches no password
+        db.add(user)
+        db.commit()
+        token = auth.create_access_token(data={"sub": str(user.id), "email": email, "role": role, "name": name})
+        return user, {"Authorization": f"Bearer {token}"}
+
+    return make
+
+@pytest.fixture
+def fresh_db(test_databases, worker_engine, shard_engines):
+    """Engine on a brand new database (and new shards), used by the app for this test"""
+    name = f"{worker_id()}_fresh_{os.getpid()}"
+    url = test_databases.clone(name)
+    engine = make_engine(url)
+    shard_urls = clone_shards(test_databases, name)
+    fresh_shards = {shard: make_engine(shard_url) for shard, shard_url in shard_urls.items()}
+    database.use_engine(engine)
+    sharding.use_engines(fresh_shards)
+    try:
+        yield engine
+    finally:
+        database.use_engine(worker_engine)
+        sharding.use_engines(shard_engines)
+        engine.dispose()
+        test_databases.drop(url)
+        drop_shards(test_databases, fresh_shards, shard_urls)
+        reset_caches()
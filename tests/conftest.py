@@ -0,0 +1,46 @@
+import itertools
+
+import pytest
+
+import models
+
+@pytest.fixture(params=[
+    pytest.param(0, id="one-database"),
+    pytest.param(2, id="sharded", marks=pytest.mark.shards(2)),
+])
+def shards(request):
+    """Shards besides the primary the test runs with; tests using it run both ways"""
+    return request.param
+
+@pytest.fixture
+def published(monkeypatch):
+    """Events the app publishes during the test, as (patient_id, type, data)"""
+    import app
+
+    events = []
+    monkeypatch.setattr(app.hub, "publish", lambda patient_id, event_type, data: events.append((patient_id, event_type, data)))
+    return events
+
+@pytest.fixture
+def owner(make_user, db, request):
+    """(user, headers) of a physician whose patients live on the last shard, or the primary when unsharded"""
+    user, headers = make_user("owner@example.com", name="Owner")
+    shards = request.getfixturevalue("shards") if "shards" in request.fixturenames else 0
+    if shards:
+        db.add(models.PhysicianShards(physician_id=user.id, shard=shards))
+        db.commit()
+    return user, headers
+
+@pytest.fixture
+def make_patient(client):
+    """make_patient(headers, name) -> id of a patient registered by the physician `headers` belong to"""
+    phones = itertools.count(9000000001)
+
+    def make(headers, name: str = "Test Patient") -> int:
+        response = client.post("/register_patient", headers=headers, json={
+            "name": name, "phone_number": str(next(phones)), "membership_price": 0, "physician_id": 0,
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+
+    return make
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+import admission
+
+def make_lane(**limits):
+    return admission.Lane("test", r"^/slow$", **{"concurrency": 1, "max_queue": 10, "max_queue_per_user": 5, "max_wait": 5, **limits})
+
+def test_freed_slots_go_round_robin_by_user():
+    async def main():
+        lane = make_lane()
+        assert await lane.acquire("a") is None
+        admitted = []
+
+        async def request(user, n):
+            assert await lane.acquire(user) is None
+            admitted.append(f"{user}{n}")
+
+        tasks = [asyncio.create_task(request("a", n)) for n in (1, 2, 3)] + [asyncio.create_task(request("b", 1))]
+        await asyncio.sleep(0)
+        assert (lane.in_flight, lane.queued) == (1, 4)
+        for _ in tasks:
+            lane.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return lane, admitted
+
+    lane, admitted = asyncio.run(main())
+    assert admitted == ["a1", "b1", "a2", "a3"]
+    assert (lane.in_flight, lane.queued) == (1, 0)
+
+def test_queue_limits():
+    async def main():
+        lane = make_lane(max_queue=3, max_queue_per_user=2)
+        assert await lane.acquire("a") is None
+        waiting = [asyncio.create_task(lane.acquire("a")) for _ in range(2)]
+        await asyncio.sleep(0)
+        reasons = [await lane.acquire("a")]
+        waiting.append(asyncio.create_task(lane.acquire("b")))
+        await asyncio.sleep(0)
+        reasons.append(await lane.acquire("c"))
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        return lane, reasons
+
+    lane, reasons = asyncio.run(main())
+    assert reasons == ["user_limit", "queue_full"]
+    assert (lane.in_flight, lane.queued) == (1, 0) # Cancelled waiters leave the queue
+
+def test_timeout():
+    async def main():
+        lane = make_lane(max_wait=0.05)
+        assert await lane.acquire("a") is None
+        reason = await lane.acquire("b")
+        lane.release()
+        return lane, reason
+
+    lane, reason = asyncio.run(main())
+    assert reason == "timeout"
+    assert (lane.in_flight, lane.queued) == (0, 0)
+
+def test_unlimited_lane_never_queues():
+    async def main():
+        lane = make_lane(concurrency=0)
+        return [await lane.acquire("a") for _ in range(50)]
+
+    assert asyncio.run(main()) == [None] * 50
+
+@pytest.mark.parametrize("max_queue, user, status", [(2, "a", 429), (1, "b", 503)])
+def test_middleware_rejects_with_retry_after(monkeypatch, max_queue, user, status):
+    lane = make_lane(max_queue=max_queue, max_queue_per_user=1)
+    monkeypatch.setattr(admission, "LANES", [lane])
+    monkeypatch.setattr(admission, "request_user", lambda scope: scope["user"])
+
+    async def main():
+        running = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def app(scope, receive, send):
+            running.set()
+            await finish.wait()
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        middleware = admission.AdmissionMiddleware(app)
+
+        async def call(user):
+            sent = []
+
+            async def send(message):
+                sent.append(message)
+
+            await middleware({"type": "http", "path": "/slow", "user": user, "headers": []}, None, send)
+            return sent[0]
+
+        first = asyncio.create_task(call("a"))
+        await running.wait()
+        queued = asyncio.create_task(call("a"))
+        await asyncio.sleep(0)
+        rejected = await call(user)
+        finish.set()
+        await asyncio.gather(first, queued)
+        return rejected, first.result(), queued.result()
+
+    rejected, first, queued = asyncio.run(main())
+    assert first["status"] == 200 and queued["status"] == 200
+    assert rejected["status"] == status
+    assert dict(rejected["headers"])[b"retry-after"] == b"2" # One ahead of a one-second average, one slot
+    assert lane.admitted == 2
+    assert lane.rejected == {"queue_full": int(status == 503), "user_limit": int(status == 429), "timeout": 0}
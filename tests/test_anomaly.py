@@ -0,0 +1,65 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import anomaly
+
+def make_chunk(readings):
+    """readings: (patient_id, day, {metric: value}) in patient then time order; ids are 1, 2, ..."""
+    start = np.datetime64("2024-03-01T08:00:00", "us")
+    return {
+        "ids": np.arange(1, len(readings) + 1, dtype=np.int64),
+        "patient_ids": np.array([patient for patient, _, _ in readings], dtype=np.int64),
+        "times": np.array([start + np.timedelta64(int(day * 86400e6), "us") for _, day, _ in readings]),
+        "values": np.array([[values.get(metric, np.nan) for metric in anomaly.METRICS] for _, _, values in readings]),
+    }
+
+def kinds(alerts):
+    return sorted((alert["vitals_id"], alert["metric"], alert["kind"], alert["severity"]) for alert in alerts)
+
+def test_thresholds():
+    chunk = make_chunk([
+        (1, 0, {"spo2": 85, "heart_rate": 72}),
+        (1, 1, {"spo2": 90}),
+        (1, 2, {"spo2": 97, "temperature": 101.0}),
+    ])
+    alerts = anomaly.detect(chunk, after_id=0)
+    assert kinds(alerts) == [
+        (1, "spo2", "threshold", "critical"),
+        (2, "spo2", "threshold", "warning"),
+        (3, "temperature", "threshold", "warning"),
+    ]
+    [first] = [alert for alert in alerts if alert["vitals_id"] == 1]
+    assert first["message"] == "SpO2 85 % is below the critical limit of 88"
+
+    # Readings at or below the watermark were checked by an earlier run
+    assert kinds(anomaly.detect(chunk, after_id=2)) == [(3, "temperature", "threshold", "warning")]
+
+def test_zscore_against_the_patients_own_baseline():
+    stable = [(1, day, {"heart_rate": 70 + (day % 2)}) for day in range(10)]
+    chunk = make_chunk(stable + [(1, 10, {"heart_rate": 100}), (2, 0, {"heart_rate": 100})])
+    alerts = anomaly.detect(chunk, after_id=0)
+    # Patient 2 has no baseline: their first reading is not compared with patient 1's
+    assert kinds(alerts) == [(11, "heart_rate", "zscore", "critical")]
+    assert alerts[0]["baseline"] == pytest.approx(70.5)
+
+def test_small_changes_do_not_alert():
+    chunk = make_chunk([(1, day, {"heart_rate": 70 + (day % 2), "spo2": 97}) for day in range(10)] + [(1, 10, {"heart_rate": 80})])
+    assert anomaly.detect(chunk, after_id=0) == []
+
+def test_trend():
+    chunk = make_chunk([(1, day, {"systolic_bp": 120 + 5 * day}) for day in range(7)])
+    alerts = anomaly.detect(chunk, after_id=0)
+    # The sixth reading is the first where the change over the window reaches 25
+    assert kinds(alerts) == [(6, "systolic_bp", "trend", "warning"), (7, "systolic_bp", "trend", "warning")]
+    assert alerts[-1]["baseline"] == pytest.approx(30.0)
+    assert alerts[-1]["message"].startswith("Systolic BP rose 30.0 mmHg over the last 7 readings (6.0 days)")
+
+def test_readings_minutes_apart_are_not_a_trend():
+    chunk = make_chunk([(1, minute / 1440, {"systolic_bp": 120 + 5 * minute}) for minute in range(7)])
+    assert anomaly.detect(chunk, after_id=0) == []
+
+def test_missing_values_are_skipped():
+    chunk = make_chunk([(1, day, {"heart_rate": 70 + (day % 2)} if day % 3 else {"spo2": 97}) for day in range(12)])
+    assert anomaly.detect(chunk, after_id=0) == []
+    assert anomaly.detect(make_chunk([]), after_id=0) == []
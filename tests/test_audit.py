@@ -0,0 +1,79 @@
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import audit, models
+
+class Unavailable:
+    """A session factory whose database is down for the first `failures` transactions"""
+
+    def __init__(self, factory, failures: int):
+        self.factory = factory
+        self.failures = failures
+
+    def begin(self):
+        if self.failures:
+            self.failures -= 1
+            raise OperationalError("INSERT", {}, Exception("connection refused"))
+        return self.factory.begin()
+
+@pytest.fixture
+def events_db():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    models.AuditEvents.__table__.create(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+@pytest.fixture
+def make_log(monkeypatch):
+    monkeypatch.setattr(audit, "FLUSH_SECONDS", 3600) # Flushed by the test, not the background thread
+    logs = []
+
+    def make(session_factory):
+        logs.append(audit.AuditLog(session_factory=session_factory))
+        return logs[-1]
+
+    yield make
+    for log in logs:
+        log.stop()
+
+def written(events_db):
+    with events_db() as db:
+        return [(e.patient_id, e.action) for e in db.scalars(select(models.AuditEvents).order_by(models.AuditEvents.id))]
+
+def test_flush_writes_in_order(events_db, make_log):
+    log = make_log(events_db)
+    log.record(1, 10, "view")
+    log.record_many(1, [11, 12], "share", "user 2 VIEW")
+    assert written(events_db) == []
+    assert log.flush() == 3
+    assert log.flush() == 0
+    assert written(events_db) == [(10, "view"), (11, "share"), (12, "share")]
+    assert (log.recorded, log.flushed, log.pending) == (3, 3, 0)
+
+def test_failed_flush_is_retried(events_db, make_log):
+    log = make_log(Unavailable(events_db, failures=1))
+    log.record(1, 10, "view")
+    with pytest.raises(OperationalError):
+        log.flush()
+    log.record(1, 11, "export")
+    assert log.pending == 2
+
+    # The failed events go back in front of those recorded since
+    assert log.flush() == 2
+    assert written(events_db) == [(10, "view"), (11, "export")]
+    assert log.dropped == 0
+
+def test_oldest_events_are_dropped_past_the_limit(events_db, make_log, monkeypatch):
+    monkeypatch.setattr(audit, "MAX_BUFFERED", 3)
+    log = make_log(Unavailable(events_db, failures=1))
+    log.record_many(1, [10, 11], "view")
+    with pytest.raises(OperationalError):
+        log.flush()
+    log.record_many(1, [12, 13], "view")
+    assert (log.pending, log.dropped) == (3, 1)
+
+    log.flush()
+    assert written(events_db) == [(11, "view"), (12, "view"), (13, "view")]
@@ -0,0 +1,37 @@
+import pytest
+
+import auth, models
+
+@pytest.fixture
+def session_tokens(db, make_user):
+    user, _ = make_user("doctor@example.com")
+    return auth.issue_tokens(user, db)
+
+def refresh(client, token: str):
+    return client.post("/token/refresh", json={"refresh_token": token})
+
+def test_refresh_rotates(client, session_tokens):
+    response = refresh(client, session_tokens["refresh_token"])
+    assert response.status_code == 200
+    rotated = response.json()
+    assert rotated["refresh_token"] != session_tokens["refresh_token"]
+    assert client.get("/teams", headers={"Authorization": f"Bearer {rotated['access_token']}"}).status_code == 200
+    assert refresh(client, rotated["refresh_token"]).status_code == 200
+
+def test_concurrent_refresh_within_grace_keeps_the_session(client, session_tokens):
+    rotated = refresh(client, session_tokens["refresh_token"]).json()
+    # A second tab sent the same token at the same moment: refused, but not treated as theft
+    assert refresh(client, session_tokens["refresh_token"]).status_code == 401
+    assert refresh(client, rotated["refresh_token"]).status_code == 200
+
+def test_reuse_after_grace_revokes_the_session(client, db, session_tokens, monkeypatch):
+    monkeypatch.setattr(auth, "REFRESH_REUSE_GRACE_SECONDS", -1)
+    rotated = refresh(client, session_tokens["refresh_token"]).json()
+
+    assert refresh(client, session_tokens["refresh_token"]).status_code == 401
+    assert refresh(client, rotated["refresh_token"]).status_code == 401
+    assert client.get("/teams", headers={"Authorization": f"Bearer {rotated['access_token']}"}).status_code == 401
+    assert db.query(models.RefreshTokens).filter(models.RefreshTokens.revoked_at.is_(None)).count() == 0
+
+def test_unknown_refresh_token(client):
+    assert refresh(client, "not-a-token").status_code == 401
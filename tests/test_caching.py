@@ -0,0 +1,50 @@
+def test_unchanged_notes_are_not_modified(client, owner, make_patient):
+    user, headers = owner
+    patient = make_patient(headers)
+    first = client.get(f"/patients/{patient}/notes", headers=headers)
+    etag = first.headers["etag"]
+
+    again = client.get(f"/patients/{patient}/notes", headers={**headers, "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert again.content == b""
+
+    client.post(f"/users/{user.id}/notes", headers=headers, json={"patient_id": patient, "raw_notes": "Follow-up"})
+    changed = client.get(f"/patients/{patient}/notes", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert len(changed.json()) == 1
+
+def test_etag_depends_on_the_permission(client, owner, make_user, make_patient):
+    _, headers = owner
+    patient = make_patient(headers)
+    _, colleague_headers = make_user("colleague@example.com")
+    client.post(f"/patients/{patient}/share", headers=headers, json={"user_email": "colleague@example.com", "permission": "VIEW"})
+    etag = client.get(f"/patients/{patient}", headers=headers).headers["etag"]
+
+    # Same record, but the detail shows the viewer's permission
+    response = client.get(f"/patients/{patient}", headers={**colleague_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+
+def test_weak_etag_from_compression_matches(client, owner, make_patient):
+    _, headers = owner
+    patient = make_patient(headers)
+    etag = client.get(f"/patients/{patient}/notes", headers=headers).headers["etag"]
+    response = client.get(f"/patients/{patient}/notes", headers={**headers, "If-None-Match": f"W/{etag}"})
+    assert response.status_code == 304
+
+def test_write_through_another_worker_changes_the_etag(client, db, owner, make_patient):
+    import entity_cache, models
+    from sqlalchemy import update
+
+    _, headers = owner
+    patient = make_patient(headers)
+    etag = client.get(f"/patients/{patient}/notes", headers=headers).headers["etag"]
+    assert ("id", patient) in entity_cache.patients._entries
+
+    # Another worker's write: committed, but this worker's cache is never told
+    db.execute(update(models.Patients).where(models.Patients.id == patient).values(data_version=models.Patients.data_version + 1))
+    db.commit()
+    response = client.get(f"/patients/{patient}/notes", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
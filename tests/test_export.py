@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+
+import export
+
+def test_iter_records(client, owner, make_user, make_patient, shards):
+    patient = make_patient(owner[1])
+    colleague, _ = make_user("colleague@example.com", name="Colleague")
+    make_user("member@example.com")
+    client.post(f"/users/{owner[0].id}/notes", headers=owner[1], json={"patient_id": patient, "raw_notes": "first"})
+    client.post(f"/users/{owner[0].id}/vitals", headers=owner[1], json={"patient_id": patient, "heart_rate": 72})
+    client.post(f"/patients/{patient}/share", headers=owner[1], json={"user_email": "colleague@example.com", "permission": "VIEW"})
+    client.delete(f"/patients/{patient}/share/{colleague.id}", headers=owner[1])
+    client.post(f"/patients/{patient}/share", headers=owner[1], json={"user_email": "colleague@example.com", "permission": "EDIT"})
+    team = client.post("/teams", headers=owner[1], json={"name": "Ward 3"}).json()
+    client.post("/patients/share/bulk", headers=owner[1], json={"patient_ids": [patient], "team_ids": [team["id"]], "permission": "VIEW"})
+
+    records = list(export.iter_records(patient))
+    types = [record_type for record_type, _ in records]
+    assert types[0] == "patient" and records[0][1]["id"] == patient
+    assert types.count("note") == 1 and types.count("vitals") == 1
+    by_type = {record_type: record for record_type, record in records}
+    assert by_type["note"]["raw_notes"] == "first" and by_type["note"]["physician_name"] == owner[0].name
+    assert by_type["vitals"]["heart_rate"] == 72
+
+    [access] = [record for record_type, record in records if record_type == "access"]
+    assert (access["user_email"], access["user_name"], access["permission"].value) == ("colleague@example.com", "Colleague", "EDIT")
+    [team_access] = [record for record_type, record in records if record_type == "team_access"]
+    assert tuple(team_access) == export.TEAM_ACCESS_FIELDS
+    assert (team_access["team_id"], team_access["team_name"], team_access["granted_by"]) == (team["id"], "Ward 3", owner[0].id)
+
+    history = [record for record_type, record in records if record_type == "sharing_history"]
+    assert [record["action"] for record in history] == ["share", "revoke", "share", "share"]
+    assert history[1]["detail"] == f"user {colleague.id}"
+    assert history[-1]["detail"].startswith(f"team {team['id']}")
+    assert {record["user_name"] for record in history} == {owner[0].name}
+
+def test_export_formats(client, owner, make_patient):
+    patient = make_patient(owner[1])
+    client.post(f"/users/{owner[0].id}/notes", headers=owner[1], json={"patient_id": patient, "raw_notes": "first"})
+
+    response = client.get(f"/patients/{patient}/export", headers=owner[1])
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["record_type"] for line in lines] == ["export", "patient", "note"]
+
+    response = client.get(f"/patients/{patient}/export?format=csv", headers=owner[1])
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert tuple(rows[0]) == export.CSV_FIELDS
+    assert [row["record_type"] for row in rows] == ["patient", "note"]
@@ -0,0 +1,18 @@
+import dataclasses
+
+from fastapi.testclient import TestClient
+
+import app
+
+def test_metrics_from_this_host(client):
+    local = TestClient(app.app, client=("127.0.0.1", 50000))
+    response = local.get("/metrics")
+    assert response.status_code == 200
+    assert 'vm_admission_in_flight{lane="interactive"}' in response.text
+    assert client.get("/metrics").status_code == 403
+
+def test_metrics_token(client, monkeypatch):
+    monkeypatch.setattr(app, "settings", dataclasses.replace(app.settings, metrics_token="scrape-me"))
+    assert client.get("/metrics", headers={"Authorization": "Bearer scrape-me"}).status_code == 200
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    assert TestClient(app.app, client=("127.0.0.1", 50000)).get("/metrics").status_code == 403
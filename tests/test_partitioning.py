@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.pool import NullPool
+
+import partitioning, sharding
+from testing import PostgresDatabases, reserve_ids, worker_id
+
+@pytest.fixture
+def two_shards(test_databases):
+    """Engines on a new primary and a new shard 1, outside the app's databases"""
+    if not isinstance(test_databases, PostgresDatabases):
+        pytest.skip("Partitioning is Postgres only")
+    test_databases.build_shard_template()
+    urls = {
+        sharding.PRIMARY: test_databases.clone(f"{worker_id()}_partitioning"),
+        1: test_databases.clone(f"{worker_id()}_partitioning_shard1", shard=True),
+    }
+    reserve_ids(urls[1], 1)
+    engines = {shard: create_engine(url, poolclass=NullPool) for shard, url in urls.items()}
+    yield engines
+    for shard, url in urls.items():
+        engines[shard].dispose()
+        test_databases.drop(url)
+
+def referenced_tables(engine, table: str) -> set:
+    return {fk["referred_table"] for fk in inspect(engine).get_foreign_keys(table)}
+
+def test_convert_every_shard(two_shards):
+    shard = two_shards[1]
+    with shard.begin() as conn:
+        # Physician 5 is a user on the primary only
+        patient = conn.execute(text(
+            "INSERT INTO patients (name, phone_number, membership_price, physician_id) VALUES ('Asha', '9000000001', 0, 5) RETURNING id"
+        )).scalar()
+        conn.execute(text(
+            "INSERT INTO vitals (patient_id, physician_id, heart_rate, created_at) VALUES (:patient, 5, 70, :at)"
+        ), {"patient": patient, "at": datetime(2024, 3, 5)})
+
+    for number, engine in two_shards.items():
+        partitioning.convert(engine, number)
+
+    for engine in two_shards.values():
+        with engine.connect() as conn:
+            assert partitioning.is_partitioned(conn, "notes")
+            assert partitioning.is_partitioned(conn, "vitals")
+    assert "users" in referenced_tables(two_shards[sharding.PRIMARY], "vitals")
+    assert "users" not in referenced_tables(shard, "vitals")
+    with shard.connect() as conn:
+        assert conn.execute(text("SELECT heart_rate FROM vitals_2024_03")).scalars().all() == [70]
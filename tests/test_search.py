@@ -0,0 +1,38 @@
+import pytest
+
+@pytest.fixture
+def notes(client, owner, make_patient, shards):
+    """Five notes mentioning knee pain over two patients, and one that doesn't"""
+    user, headers = owner
+    patients = [make_patient(headers, name="Asha"), make_patient(headers, name="Vikram")]
+    for i in range(5):
+        client.post(f"/users/{user.id}/notes", headers=headers, json={"patient_id": patients[i % 2], "raw_notes": f"Knee pain, visit {i}"})
+    client.post(f"/users/{user.id}/notes", headers=headers, json={"patient_id": patients[0], "raw_notes": "Shoulder stiffness"})
+    return patients
+
+def search(client, owner, q: str, **params):
+    user, headers = owner
+    response = client.get(f"/users/{user.id}/notes/search", headers=headers, params={"q": q, **params})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_pages(client, owner, notes):
+    pages = [search(client, owner, "knee", page=page, page_size=2) for page in (1, 2, 3)]
+    assert [len(page["results"]) for page in pages] == [2, 2, 1]
+    assert {page["total"] for page in pages} == {5}
+    ids = [hit["note_id"] for page in pages for hit in page["results"]]
+    assert len(set(ids)) == 5
+
+def test_page_past_the_last_hit_keeps_the_total(client, owner, notes):
+    result = search(client, owner, "knee", page=4, page_size=2)
+    assert result["results"] == []
+    assert result["total"] == 5
+
+def test_prefix_and_snippets(client, owner, notes):
+    result = search(client, owner, "shoul")
+    assert result["total"] == 1
+    assert "<mark>" in " ".join(result["results"][0]["snippets"].values())
+
+def test_only_accessible_notes(client, make_user, notes):
+    stranger = make_user("stranger@example.com")
+    assert search(client, stranger, "knee")["total"] == 0
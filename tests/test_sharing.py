@@ -0,0 +1,66 @@
+import pytest
+
+import crud, models, sharding
+
+@pytest.fixture
+def patient(owner, make_patient, shards):
+    patient_id = make_patient(owner[1])
+    if shards:
+        assert sharding.shard_of(patient_id) == shards
+    return patient_id
+
+def test_share_and_revoke(client, owner, make_user, patient):
+    colleague, headers = make_user("colleague@example.com")
+    assert client.get(f"/patients/{patient}", headers=headers).status_code == 403
+
+    response = client.post(f"/patients/{patient}/share", headers=owner[1], json={"user_email": "colleague@example.com", "permission": "VIEW"})
+    assert response.status_code == 200, response.text
+    assert client.get(f"/patients/{patient}", headers=headers).status_code == 200
+    assert client.post(f"/users/{colleague.id}/notes", headers=headers, json={"patient_id": patient, "raw_notes": "x"}).status_code == 403
+
+    assert client.delete(f"/patients/{patient}/share/{colleague.id}", headers=owner[1]).status_code == 200
+    assert client.get(f"/patients/{patient}", headers=headers).status_code == 403
+
+def test_only_the_owner_shares(client, owner, make_user, patient):
+    _, headers = make_user("colleague@example.com")
+    response = client.post(f"/patients/{patient}/share", headers=headers, json={"user_email": "owner@example.com"})
+    assert response.status_code == 403
+
+def test_team_access(client, db, owner, make_user, patient):
+    member, headers = make_user("member@example.com")
+    team = client.post("/teams", headers=owner[1], json={"name": "Ward 3"}).json()
+    client.post(f"/teams/{team['id']}/members", headers=owner[1], json={"user_emails": ["member@example.com"]})
+    assert crud.check_access(patient, member.id, db) is None
+
+    response = client.post("/patients/share/bulk", headers=owner[1], json={"patient_ids": [patient], "team_ids": [team["id"]], "permission": "EDIT"})
+    assert response.status_code == 200, response.text
+    assert crud.check_access(patient, member.id, db) == models.PermissionLevel.EDIT
+    assert client.get(f"/patients/{patient}/notes", headers=headers).status_code == 200
+
+    client.post("/patients/share/bulk-revoke", headers=owner[1], json={"patient_ids": [patient], "team_ids": [team["id"]]})
+    assert client.get(f"/patients/{patient}/notes", headers=headers).status_code == 403
+
+def test_direct_grant_survives_joining_a_team(client, db, owner, make_user, patient):
+    colleague, headers = make_user("colleague@example.com")
+    other, other_headers = make_user("other@example.com")
+    client.post(f"/patients/{patient}/share", headers=owner[1], json={"user_email": "colleague@example.com", "permission": "EDIT"})
+
+    # A team with no grant on this patient
+    team = client.post("/teams", headers=other_headers, json={"name": "Elsewhere"}).json()
+    client.post(f"/teams/{team['id']}/members", headers=other_headers, json={"user_emails": ["colleague@example.com"]})
+    assert crud.check_access(patient, colleague.id, db) == models.PermissionLevel.EDIT
+    assert client.get(f"/patients/{patient}/notes", headers=headers).status_code == 200
+
+def test_share_publishes_the_effective_permission(client, owner, make_user, patient, published):
+    colleague, _ = make_user("colleague@example.com")
+    team = client.post("/teams", headers=owner[1], json={"name": "Ward 3"}).json()
+    client.post(f"/teams/{team['id']}/members", headers=owner[1], json={"user_emails": ["colleague@example.com"]})
+    client.post("/patients/share/bulk", headers=owner[1], json={"patient_ids": [patient], "team_ids": [team["id"]], "permission": "EDIT"})
+    published.clear()
+
+    client.post(f"/patients/{patient}/share", headers=owner[1], json={"user_email": "colleague@example.com", "permission": "VIEW"})
+    assert published == [(patient, "access", {"user_id": colleague.id, "permission": "EDIT"})]
+
+    published.clear()
+    client.delete(f"/patients/{patient}/share/{colleague.id}", headers=owner[1])
+    assert published == [(patient, "access", {"user_id": colleague.id, "permission": "EDIT"})] # Still through the team
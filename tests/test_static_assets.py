@@ -0,0 +1,54 @@
+import hashlib
+import json
+import os
+
+import static_assets
+
+def write(root, name, content):
+    path = root / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+def built(output, name) -> str:
+    with open(os.path.join(output, name)) as f:
+        return f.read()
+
+def test_build_hashes_final_content(tmp_path):
+    source = tmp_path / "static"
+    # A chain the old fonts-then-everything order got wrong: page.js -> util.js -> styles.css -> font
+    write(source, "fonts/a.ttf", "font")
+    write(source, "css/styles.css", "@font-face { src: url(/static/fonts/a.ttf); }")
+    write(source, "js/page.js", "import '/static/js/util.js';")
+    write(source, "js/util.js", "fetch('/static/css/styles.css');")
+    write(source, "index.html", '<script src="/static/js/page.js"></script>')
+    write(source, "sw.js", "const SHELL_VERSION = 'dev';\nconst PRECACHE_URLS = [];")
+
+    output = static_assets.build(str(source), str(tmp_path / "build"))
+    with open(os.path.join(output, static_assets.MANIFEST)) as f:
+        assets = json.load(f)["assets"]
+    assert set(assets) == {"fonts/a.ttf", "css/styles.css", "js/page.js", "js/util.js"}
+
+    for original, name in assets.items():
+        content = built(output, name)
+        # The name is the hash of exactly what was written, and every reference in it is hashed
+        assert name == static_assets.hashed_name(original, content.encode())
+        assert content == built(output, original)
+        for other in assets:
+            assert "/static/" + other not in content
+    assert f"/static/{assets['js/util.js']}" in built(output, assets["js/page.js"])
+    assert built(output, "index.html") == f'<script src="/static/{assets["js/page.js"]}"></script>'
+    assert f"/static/{assets['js/page.js']}" in built(output, "sw.js")
+
+    # The same sources build to the same directory
+    assert static_assets.build(str(source), str(tmp_path / "build")) == output
+
+def test_build_with_a_reference_cycle(tmp_path):
+    source = tmp_path / "static"
+    write(source, "js/a.js", "import '/static/js/b.js';")
+    write(source, "js/b.js", "import '/static/js/a.js';")
+
+    output = static_assets.build(str(source), str(tmp_path / "build"))
+    with open(os.path.join(output, static_assets.MANIFEST)) as f:
+        assets = json.load(f)["assets"]
+    for original, name in assets.items():
+        assert hashlib.sha256(built(output, name).encode()).hexdigest()[:10] in name
@@ -0,0 +1,70 @@
+import pytest
+
+import models
+
+@pytest.fixture
+def patient(owner, make_patient, shards):
+    return make_patient(owner[1])
+
+def note(patient_id: int, key: str, text: str = "Knee pain after walking") -> dict:
+    return {"patient_id": patient_id, "raw_notes": text, "idempotency_key": key}
+
+def audited(db, action: str) -> int:
+    import audit
+
+    audit.audit_log.flush()
+    return db.query(models.AuditEvents).filter(models.AuditEvents.action == action).count()
+
+def test_retried_note_is_written_once(client, db, owner, patient, published):
+    user, headers = owner
+    first = client.post(f"/users/{user.id}/notes", headers=headers, json=note(patient, "k1"))
+    retry = client.post(f"/users/{user.id}/notes", headers=headers, json=note(patient, "k1"))
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["id"] == first.json()["id"]
+    assert len(client.get(f"/patients/{patient}/notes", headers=headers).json()) == 1
+    assert audited(db, "add_note") == 1
+    assert [event_type for _, event_type, _ in published] == ["note"]
+
+def test_key_reused_for_another_write_is_rejected(client, owner, make_patient, patient):
+    user, headers = owner
+    other = make_patient(headers, name="Other Patient")
+    client.post(f"/users/{user.id}/notes", headers=headers, json=note(patient, "k1"))
+
+    response = client.post(f"/users/{user.id}/vitals", headers=headers, json={"patient_id": patient, "heart_rate": 70, "idempotency_key": "k1"})
+    assert response.status_code == 409
+    response = client.post(f"/users/{user.id}/notes", headers=headers, json=note(other, "k1"))
+    assert response.status_code == 409
+    assert client.get(f"/patients/{other}/notes", headers=headers).json() == []
+
+def test_sync_replay(client, db, owner, make_user, patient):
+    user, headers = owner
+    items = [
+        {"kind": "note", "idempotency_key": "n1", "data": note(patient, "n1")},
+        {"kind": "vitals", "idempotency_key": "v1", "data": {"patient_id": patient, "heart_rate": 72}},
+        {"kind": "note", "idempotency_key": "n1", "data": note(patient, "n1")}, # Queued twice offline
+    ]
+    results = client.post(f"/users/{user.id}/sync", headers=headers, json={"items": items}).json()
+    assert [r["status"] for r in results] == ["created", "created", "duplicate"]
+    assert results[2]["id"] == results[0]["id"]
+
+    # The client never saw the response and sends the batch again
+    replayed = client.post(f"/users/{user.id}/sync", headers=headers, json={"items": items}).json()
+    assert [r["status"] for r in replayed] == ["duplicate"] * 3
+    assert [r["id"] for r in replayed] == [r["id"] for r in results]
+    assert audited(db, "add_note") == 1
+    assert audited(db, "add_vitals") == 1
+
+def test_sync_reports_errors_per_item(client, owner, make_user, patient):
+    user, headers = owner
+    stranger, stranger_headers = make_user("stranger@example.com")
+    items = [
+        {"kind": "note", "idempotency_key": "n1", "data": note(patient, "n1")},
+        {"kind": "vitals", "idempotency_key": "n1", "data": {"patient_id": patient, "heart_rate": 72}},
+        {"kind": "letter", "idempotency_key": "x1", "data": {}},
+    ]
+    results = client.post(f"/users/{user.id}/sync", headers=headers, json={"items": items}).json()
+    assert [r["status"] for r in results] == ["created", "error", "error"]
+
+    results = client.post(f"/users/{stranger.id}/sync", headers=stranger_headers, json={"items": items[:1]}).json()
+    assert results[0]["status"] == "error"
+    assert results[0]["detail"] == "Edit access required"
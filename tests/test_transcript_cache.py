@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import transcript_cache
+
+@pytest.fixture
+def cache(tmp_path):
+    return transcript_cache.TranscriptCache(directory=str(tmp_path / "transcripts"), ttl=60)
+
+class Provider:
+    """A transcription call that blocks until released, counting how often it is made"""
+
+    def __init__(self, result=None):
+        self.calls = 0
+        self.result = result or {"status": "success", "transcript": "hello"}
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return dict(self.result)
+
+def run_concurrently(cache, provider, count: int, key: str = "k"):
+    async def main():
+        provider.release = asyncio.Event()
+        calls = [asyncio.create_task(cache.get_or_create(key, provider)) for _ in range(count)]
+        while provider.calls == 0:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01) # Let the rest join
+        provider.release.set()
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    return asyncio.run(main())
+
+def test_concurrent_calls_share_one_create(cache):
+    provider = Provider()
+    results = run_concurrently(cache, provider, 5)
+    assert provider.calls == 1
+    assert sorted(cached for _, cached in results) == [False, True, True, True, True]
+    assert all(result == provider.result for result, _ in results)
+    results[0][0]["transcript"] = "changed" # Each caller gets its own copy
+    assert results[1][0]["transcript"] == "hello"
+
+    # Stored: later calls, and other workers sharing the directory, don't call the provider
+    assert asyncio.run(cache.get_or_create("k", provider)) == (provider.result, True)
+    assert provider.calls == 1
+    other_worker = transcript_cache.TranscriptCache(directory=cache.directory, ttl=60)
+    assert other_worker.get("k") == provider.result
+
+def test_failures_are_not_stored(cache):
+    provider = Provider({"status": "error", "message": "quota"})
+    results = run_concurrently(cache, provider, 3)
+    assert provider.calls == 1 and all(result["status"] == "error" for result, _ in results)
+    assert cache.get("k") is None
+
+    provider = Provider(RuntimeError("provider down"))
+    results = run_concurrently(cache, provider, 3)
+    assert provider.calls == 1 and all(isinstance(result, RuntimeError) for result in results)
+
+    provider = Provider()
+    run_concurrently(cache, provider, 1)
+    assert provider.calls == 1 # Nothing left in flight from the failed call
+    assert cache.get("k") == provider.result
+
+def test_expired_entries_are_not_served(tmp_path):
+    cache = transcript_cache.TranscriptCache(directory=str(tmp_path), ttl=0)
+    cache.put("k", {"status": "success", "transcript": "hello"})
+    assert cache.get("k") is None
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import typeahead
+
+def patient(patient_id: int, name: str):
+    return SimpleNamespace(id=patient_id, name=name, phone_number=f"98{patient_id:08d}", physician_id=1)
+
+def names(results):
+    return sorted(result["name"] for result in results)
+
+def test_prefix_search():
+    indexes = typeahead.TypeaheadIndexes()
+    load = lambda: [patient(1, "Ramesh Kumar"), patient(2, "Sita Devi")]
+    assert names(indexes.search(1, "ram", load)) == ["Ramesh Kumar"]
+    assert names(indexes.search(1, "kum", load)) == ["Ramesh Kumar"]
+
+def test_updates_in_place():
+    indexes = typeahead.TypeaheadIndexes()
+    loads = []
+    load = lambda: loads.append(1) or [patient(1, "Ramesh Kumar")]
+    indexes.search(1, "r", load)
+    indexes.add_patient(1, patient(2, "Rakesh Singh"))
+    indexes.remove_patient(1, 1)
+    assert names(indexes.search(1, "r", load)) == ["Rakesh Singh"]
+    assert len(loads) == 1
+
+def test_change_during_a_build_is_not_lost():
+    indexes = typeahead.TypeaheadIndexes()
+    stored = [patient(1, "Ramesh Kumar")]
+
+    def load():
+        snapshot = list(stored)
+        if len(stored) == 1:
+            # Registered while this build was reading: missing from its snapshot
+            stored.append(patient(2, "Rakesh Singh"))
+            indexes.add_patient(1, stored[-1])
+        return snapshot
+
+    assert names(indexes.search(1, "ra", load)) == ["Rakesh Singh", "Ramesh Kumar"]
+    assert names(indexes.search(1, "ra", lambda: [])) == ["Rakesh Singh", "Ramesh Kumar"] # Kept, not rebuilt
+
+def test_build_that_keeps_changing_is_not_kept():
+    indexes = typeahead.TypeaheadIndexes()
+
+    def load():
+        indexes.invalidate(1)
+        return [patient(1, "Ramesh Kumar")]
+
+    assert names(indexes.search(1, "ra", load)) == ["Ramesh Kumar"]
+    assert names(indexes.search(1, "ra", lambda: [])) == []
@@ -0,0 +1,165 @@
+"""Content-addressed cache of transcripts, so a re-uploaded recording isn't paid for twice.
+
+Keys are sha256 digests of the audio plus the model and language it was
+transcribed with. /transcribe looks up the raw upload first (a retried upload
+is byte-identical, so nothing needs decoding), then the normalised 16 kHz mono
+audio, which also matches the same recording sent in a different container.
+
+Entries live in a small in-memory LRU in front of JSON files under
+TRANSCRIPT_CACHE_DIR, shared by the workers on a host. Both expire after
+TRANSCRIPT_CACHE_TTL_HOURS; the directory is trimmed to
+TRANSCRIPT_CACHE_MAX_MB, oldest first. Transcripts are patient data: the
+directory is created private to the app's user, and the TTL is kept short.
+
+Identical uploads in flight at the same time share one provider call.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+
+CACHE_DIR = settings.transcript_cache_dir
+TTL_SECONDS = settings.transcript_cache_ttl_hours * 3600
+MAX_DISK_BYTES = settings.transcript_cache_max_mb * 1024 * 1024
+MAX_MEMORY_ENTRIES = 256
+TRIM_EVERY = 100 # Puts between directory scans
+
+def content_key(parts: Iterable[bytes], model: str, language: str) -> str:
+    digest = hashlib.sha256(f"{model}\0{language}\0".encode())
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest()) # Chunk boundaries are part of the key
+    return digest.hexdigest()
+
+def file_key(file, model: str, language: str) -> str:
+    """Key of an uploaded file's raw bytes"""
+    digest = hashlib.sha256(f"{model}\0{language}\0raw\0".encode())
+    file.seek(0)
+    for block in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+class TranscriptCache:
+    def __init__(self, directory: str = CACHE_DIR, ttl: float = TTL_SECONDS,
+                 max_disk_bytes: int = MAX_DISK_BYTES, max_memory_entries: int = MAX_MEMORY_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict() # key -> (stored at, result)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._puts = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._memory.move_to_end(key)
+                    return dict(entry[1])
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if now - stored_at >= self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, stored_at, result)
+        return dict(result)
+
+    def put(self, key: str, result: dict):
+        self._remember(key, time.time(), result)
+        path = self._path(key)
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True) # mode only applies to the last level
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            # Write then rename, so another worker never reads half a file
+            handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(handle, "w") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Transcript cache write failed: {e}") # Memory copy still serves this worker
+            return
+        self._puts += 1
+        if self._puts % TRIM_EVERY == 0:
+            self.trim()
+
+    def _remember(self, key: str, stored_at: float, result: dict):
+        with self._lock:
+            self._memory[key] = (stored_at, dict(result))
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def trim(self):
+        """Delete expired files, then the oldest ones until the directory fits in max_disk_bytes"""
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime >= self.ttl or (name.endswith(".tmp") and now - stat.st_mtime > 60):
+                    self._remove(path)
+                else:
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        """(result, cached). Concurrent calls for one key share a single `create`; only successes are stored"""
+        cached = await run_in_threadpool(self.get, key)
+        if cached is not None:
+            return cached, True
+
+        task = self._inflight.get(key)
+        joined = task is not None
+        if task is None:
+            task = asyncio.ensure_future(self._create_and_store(key, create))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shielded: a caller that disconnects doesn't cancel the call others are waiting on
+        result = await asyncio.shield(task)
+        return dict(result), joined
+
+    async def _create_and_store(self, key: str, create) -> dict:
+        result = await create()
+        if result.get("status") == "success":
+            await run_in_threadpool(self.put, key, result)
+        return result
+
+transcripts = TranscriptCache()
@@ -0,0 +1,293 @@
+"""In-memory typeahead index for patient lookup.
+
+Each user gets a sorted prefix index over the names, phone digits and
+transliterated (Devanagari -> Latin) names of the patients they can access.
+Indexes are built lazily on the first search, kept in an LRU, updated in place
+when crud registers, shares or revokes patients, and rebuilt after a TTL so
+writes made by other workers show up.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+MAX_INDEXES = 256 # Users whose index is kept in memory
+INDEX_TTL_SECONDS = 300
+DEFAULT_LIMIT = 20
+BUILD_ATTEMPTS = 3 # Builds redone because patients changed while they loaded
+
+# Match weights, lower ranks first
+FULL_NAME, NAME_WORD, TRANSLITERATED, PHONE = 0, 1, 2, 3
+
+# Devanagari -> Latin, spelled the way names are usually typed on a phone keyboard
+CONSONANTS = {
+    "क": "k", "ख": "kh", "ग": "g", "घ": "gh", "ङ": "n",
+    "च": "ch", "छ": "chh", "ज": "j", "झ": "jh", "ञ": "n",
+    "ट": "t", "ठ": "th", "ड": "d", "ढ": "dh", "ण": "n",
+    "त": "t", "थ": "th", "द": "d", "ध": "dh", "न": "n",
+    "प": "p", "फ": "ph", "ब": "b", "भ": "bh", "म": "m",
+    "य": "y", "र": "r", "ल": "l", "ळ": "l", "व": "v",
+    "श": "sh", "ष": "sh", "स": "s", "ह": "h",
+    "क़": "q", "ख़": "kh", "ग़": "g", "ज़": "z", "ड़": "r", "ढ़": "rh", "फ़": "f", "य़": "y",
+}
+VOWELS = {
+    "अ": "a", "आ": "a", "इ": "i", "ई": "i", "उ": "u", "ऊ": "u", "ऋ": "ri",
+    "ए": "e", "ऐ": "ai", "ओ": "o", "औ": "au", "ऍ": "e", "ऑ": "o",
+}
+VOWEL_SIGNS = {
+    "ा": "a", "ि": "i", "ी": "i", "ु": "u", "ू": "u", "ृ": "ri",
+    "े": "e", "ै": "ai", "ो": "o", "ौ": "au", "ॅ": "e", "ॉ": "o",
+}
+OTHER_SIGNS = {"ं": "n", "ँ": "n", "ः": "h"}
+# Nukta letters decompose under NFC, so key the table the same way lookups see them
+CONSONANTS = {unicodedata.normalize("NFC", k): v for k, v in CONSONANTS.items()}
+VIRAMA = "्"
+NUKTA = "़"
+
+DEVANAGARI_RE = re.compile(r"[\u0900-\u097F]")
+# \w alone would split Devanagari words at their vowel signs
+WORD_RE = re.compile(r"(?:[^\W_]|[\u0900-\u097F])+")
+
+def transliterate(word: str) -> str:
+    """Romanise a Devanagari word, dropping the word-final inherent vowel (राम -> ram)"""
+    word = unicodedata.normalize("NFC", word)
+    out = []
+    inherent_at = None # Position of an inherent 'a' that may be dropped at word end
+    i = 0
+    while i < len(word):
+        char = word[i]
+        if i + 1 < len(word) and word[i + 1] == NUKTA:
+            char += NUKTA
+            i += 1
+        i += 1
+
+        if char[0] in CONSONANTS:
+            out.append(CONSONANTS.get(char, CONSONANTS[char[0]]))
+            following = word[i] if i < len(word) else ""
+            if following in VOWEL_SIGNS:
+                out.append(VOWEL_SIGNS[following])
+                i += 1
+                inherent_at = None
+            elif following == VIRAMA:
+                i += 1
+                inherent_at = None
+            else:
+                out.append("a")
+                inherent_at = len(out) - 1
+            continue
+
+        inherent_at = None
+        if char in VOWELS:
+            out.append(VOWELS[char])
+        elif char in VOWEL_SIGNS:
+            out.append(VOWEL_SIGNS[char])
+        elif char in OTHER_SIGNS:
+            out.append(OTHER_SIGNS[char])
+        elif char.isdigit():
+            out.append(str(unicodedata.digit(char)))
+
+    if inherent_at is not None and inherent_at == len(out) - 1 and inherent_at > 1:
+        out.pop()
+    return "".join(out)
+
+def squash(word: str) -> str:
+    """Spelling-tolerant Latin key: 'Raam', 'Ram' and 'raaam' all index as 'ram'"""
+    word = word.replace("ee", "i").replace("oo", "u")
+    return re.sub(r"(.)\1+", r"\1", word)
+
+def digits(value: str) -> str:
+    return "".join(c for c in value if c.isdigit())
+
+def name_words(name: str) -> List[str]:
+    return WORD_RE.findall(unicodedata.normalize("NFC", name).lower())
+
+def latin_key(word: str) -> str:
+    """Key for one word of a name, in the form queries are matched against"""
+    if DEVANAGARI_RE.search(word):
+        return word
+    return squash(word)
+
+def patient_keys(patient: dict) -> List[Tuple[str, int]]:
+    """(key, weight) pairs indexed for one patient"""
+    words = name_words(patient["name"])
+    keys = [(" ".join(latin_key(w) for w in words), FULL_NAME)]
+    keys += [(latin_key(w), NAME_WORD) for w in words]
+
+    romanised = [transliterate(w) for w in words if DEVANAGARI_RE.search(w)]
+    if romanised:
+        keys.append((" ".join(squash(w) for w in romanised), TRANSLITERATED))
+        keys += [(squash(w), TRANSLITERATED) for w in romanised]
+
+    phone = digits(patient["phone_number"])
+    if phone:
+        keys.append((phone, PHONE))
+        if len(phone) > 10:
+            keys.append((phone[-10:], PHONE)) # Without the country code
+    return list(dict.fromkeys(k for k in keys if k[0]))
+
+def query_words(query: str) -> List[str]:
+    if digits(query) and not re.search(r"[^\d\s+\-()]", query):
+        return [digits(query)]
+    return [latin_key(w) for w in name_words(query)]
+
+class PatientIndex:
+    """Sorted (key, weight, patient_id) entries for one user's patients"""
+
+    def __init__(self, patients: Iterable[dict]):
+        self.built_at = time.monotonic()
+        self.entries: List[Tuple[str, int, int]] = []
+        self.patients: Dict[int, dict] = {}
+        self.keys: Dict[int, List[Tuple[str, int]]] = {}
+        for patient in patients:
+            self._add(patient)
+        self.entries.sort()
+
+    def _add(self, patient: dict, keep_sorted: bool = False):
+        keys = patient_keys(patient)
+        self.patients[patient["id"]] = patient
+        self.keys[patient["id"]] = keys
+        for key, weight in keys:
+            entry = (key, weight, patient["id"])
+            if keep_sorted:
+                bisect.insort(self.entries, entry)
+            else:
+                self.entries.append(entry)
+
+    def add(self, patient: dict):
+        self.remove(patient["id"])
+        self._add(patient, keep_sorted=True)
+
+    def remove(self, patient_id: int):
+        for key, weight in self.keys.pop(patient_id, []):
+            position = bisect.bisect_left(self.entries, (key, weight, patient_id))
+            if position < len(self.entries) and self.entries[position] == (key, weight, patient_id):
+                del self.entries[position]
+        self.patients.pop(patient_id, None)
+
+    def _prefix_matches(self, prefix: str) -> Dict[int, int]:
+        """Best weight per patient with a key starting with `prefix`"""
+        best = {}
+        start = bisect.bisect_left(self.entries, (prefix,))
+        end = bisect.bisect_left(self.entries, (prefix + "\uffff",))
+        for key, weight, patient_id in self.entries[start:end]:
+            if weight < best.get(patient_id, PHONE + 1):
+                best[patient_id] = weight
+        return best
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        words = query_words(query)
+        if not words:
+            return []
+
+        # Whole query as a prefix of the full name ("ram ku" -> "Ram Kumar") ranks first
+        matches = self._prefix_matches(" ".join(words)) if len(words) > 1 else {}
+        for patient_id, weight in self._prefix_matches(words[0]).items():
+            if all(
+                any(key.startswith(w) for key, _ in self.keys[patient_id])
+                for w in words[1:]
+            ):
+                matches.setdefault(patient_id, weight)
+
+        return [
+            self.patients[patient_id] for _, _, patient_id in heapq.nsmallest(
+                limit,
+                ((weight, self.patients[patient_id]["name"].lower(), patient_id) for patient_id, weight in matches.items())
+            )
+        ]
+
+class TypeaheadIndexes:
+    """LRU of per-user indexes"""
+
+    def __init__(self, max_indexes: int = MAX_INDEXES, ttl_seconds: float = INDEX_TTL_SECONDS):
+        self.max_indexes = max_indexes
+        self.ttl_seconds = ttl_seconds
+        self._indexes: "OrderedDict[int, PatientIndex]" = OrderedDict()
+        self._building: Dict[int, List[int]] = {} # user -> [changes so far, builds in flight], while building
+        self._lock = threading.Lock()
+
+    def _get(self, user_id: int) -> Optional[PatientIndex]:
+        index = self._indexes.get(user_id)
+        if index is None:
+            return None
+        if time.monotonic() - index.built_at > self.ttl_seconds:
+            del self._indexes[user_id]
+            return None
+        self._indexes.move_to_end(user_id)
+        return index
+
+    def search(self, user_id: int, query: str, load: Callable[[], Iterable], limit: int = DEFAULT_LIMIT) -> List[dict]:
+        """Top `limit` patients matching `query`; `load` returns the user's patients when a build is needed"""
+        with self._lock:
+            index = self._get(user_id)
+        if index is None:
+            index = self._build(user_id, load)
+        with self._lock:
+            return index.search(query, limit)
+
+    def _build(self, user_id: int, load: Callable[[], Iterable]) -> "PatientIndex":
+        """Build a user's index outside the lock and keep it, unless their patients changed meanwhile.
+
+        A patient added or removed while `load` ran may be missing from (or still in) what it read,
+        so such a build is done again rather than kept.
+        """
+        with self._lock:
+            building = self._building.setdefault(user_id, [0, 0])
+            building[1] += 1
+        try:
+            for _ in range(BUILD_ATTEMPTS):
+                with self._lock:
+                    changes = building[0]
+                index = PatientIndex(patient_record(p) for p in load())
+                with self._lock:
+                    if building[0] == changes:
+                        self._indexes[user_id] = index
+                        while len(self._indexes) > self.max_indexes:
+                            self._indexes.popitem(last=False)
+                        return index
+            return index # Still changing: answers this search, but is not kept
+        finally:
+            with self._lock:
+                building[1] -= 1
+                if not building[1]:
+                    del self._building[user_id]
+
+    def _changed(self, user_id: int):
+        # Caller holds _lock
+        building = self._building.get(user_id)
+        if building is not None:
+            building[0] += 1
+
+    def add_patient(self, user_id: int, patient):
+        """A patient became accessible to a user (registered or shared)"""
+        with self._lock:
+            self._changed(user_id)
+            index = self._get(user_id)
+            if index is not None:
+                index.add(patient_record(patient))
+
+    def remove_patient(self, user_id: int, patient_id: int):
+        with self._lock:
+            self._changed(user_id)
+            index = self._get(user_id)
+            if index is not None:
+                index.remove(patient_id)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._changed(user_id)
+            self._indexes.pop(user_id, None)
+
+def patient_record(patient) -> dict:
+    """The PatientListItem fields of a Patients row"""
+    return {
+        "id": patient.id,
+        "name": patient.name,
+        "phone_number": patient.phone_number,
+        "physician_id": patient.physician_id,
+    }
+
+indexes = TypeaheadIndexes()
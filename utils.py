@@ -1,14 +1,88 @@
 # Password hashing utilities - removed circular import
 # Import directly from passlib to avoid circular dependency with auth.py
+#
+# Hashing is CPU-bound, so the async helpers run it in a dedicated process pool:
+# a login burst then uses every core without tying up the request threadpool.
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Optional, Tuple
 
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from config import settings
+
+# argon2 for new hashes; bcrypt hashes still verify and are upgraded on the next login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated=["bcrypt"],
+    argon2__time_cost=settings.argon2_time_cost,
+    argon2__memory_cost=settings.argon2_memory_cost,
+    argon2__parallelism=settings.argon2_parallelism,
+    bcrypt__rounds=settings.bcrypt_rounds,
+)
+
+HASH_WORKERS = settings.hash_workers
+HASH_NICE = settings.hash_nice
+HASH_MAX_PENDING = settings.hash_max_pending # Beyond this, callers wait
 
 def hash_password(password: str) -> str:
-    """Hash a password using bcrypt"""
+    """Hash a password using the current default scheme"""
     return pwd_context.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
-    return pwd_context.verify(plain_password, hashed_password)
\ No newline at end of file
+    return pwd_context.verify(plain_password, hashed_password)
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password; also returns a new hash when the stored one uses a deprecated scheme or cost"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+# Process pool
+def _init_worker():
+    os.nice(HASH_NICE)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending: Optional[asyncio.Semaphore] = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool, _pending
+    if _pool is None:
+        # spawn: workers must not inherit the server's sockets and database connections
+        _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=get_context("spawn"), initializer=_init_worker)
+    if _pending is None:
+        _pending = asyncio.Semaphore(HASH_MAX_PENDING)
+    return _pool
+
+async def _run(fn, *args):
+    global _pool
+    pool = _get_pool()
+    async with _pending:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool and retry once
+            if _pool is pool:
+                _pool = None
+            return await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run(verify_and_update, plain_password, hashed_password)
+
+def warm_up():
+    """Start the worker processes now rather than on the first login"""
+    pool = _get_pool()
+    for future in [pool.submit(os.getpid) for _ in range(HASH_WORKERS)]:
+        future.result()
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
@@ -0,0 +1,47 @@
+"""One-off import and setup costs, paid before a worker takes traffic.
+
+Handlers import reportlab, openai and pydub lazily, so without this the first
+report or SOAP analysis on every worker waits about a second for imports. run()
+is called in the gunicorn master before it forks (see gunicorn.conf.py), so the
+loaded modules are shared copy-on-write by every worker, and again at app
+startup, where it finds everything already loaded and returns at once.
+"""
+import importlib
+import os
+from functools import lru_cache
+
+HEAVY_MODULES = (
+    "reportlab.lib.colors",
+    "reportlab.lib.pagesizes",
+    "reportlab.lib.styles",
+    "reportlab.pdfbase.pdfmetrics",
+    "reportlab.pdfbase.ttfonts",
+    "reportlab.platypus",
+    "openai",
+    "pydub",
+    "pydub.silence",
+)
+
+DEVANAGARI_FONT_PATH = "static/fonts/NotoSansDevanagari-Regular.ttf"
+
+@lru_cache(maxsize=None)
+def devanagari_font() -> bool:
+    """Register the Devanagari font with reportlab, once per process. False if the font file is missing"""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    if not os.path.exists(DEVANAGARI_FONT_PATH):
+        return False
+    pdfmetrics.registerFont(TTFont("Devanagari", DEVANAGARI_FONT_PATH))
+    return True
+
+def import_heavy_modules():
+    for name in HEAVY_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Warmup: {name} not available: {e}")
+
+def run():
+    import_heavy_modules()
+    devanagari_font() # Parsing the font takes longer than drawing most reports